@@ -327,6 +327,13 @@ CELERYBEAT_SCHEDULE = {
             'expires': 30,  # seconds
         }
     },
+    'clean_up_downloads': {
+        'task': 'file_store.tasks.clean_up_downloads',
+        'schedule': timedelta(hours=6),
+        'options': {
+            'expires': 30,  # seconds
+        }
+    },
 }
 
 CHUNKED_UPLOAD_ABSTRACT_MODEL = False
@@ -365,6 +372,25 @@ REFINERY_FILE_SOURCE_MAP = get_setting("REFINERY_FILE_SOURCE_MAP")
 
 # data file import directory
 REFINERY_DATA_IMPORT_DIR = get_setting("REFINERY_DATA_IMPORT_DIR")
+# minimum number of seconds and percentage points between updates of the
+# progress of a file import in the Celery result backend
+REFINERY_IMPORT_PROGRESS_INTERVAL = get_setting(
+    "REFINERY_IMPORT_PROGRESS_INTERVAL", default=1)
+REFINERY_IMPORT_PROGRESS_STEP = get_setting("REFINERY_IMPORT_PROGRESS_STEP",
+                                            default=1)
+# URL imports from servers that accept range requests: number of parallel
+# connections, part size (MB), request timeout (seconds) and retries per part
+REFINERY_DOWNLOAD_CONCURRENCY = get_setting("REFINERY_DOWNLOAD_CONCURRENCY",
+                                            default=4)
+REFINERY_DOWNLOAD_PART_SIZE = get_setting("REFINERY_DOWNLOAD_PART_SIZE",
+                                          default=16)
+REFINERY_DOWNLOAD_TIMEOUT = get_setting("REFINERY_DOWNLOAD_TIMEOUT",
+                                        default=30)
+REFINERY_DOWNLOAD_RETRIES = get_setting("REFINERY_DOWNLOAD_RETRIES",
+                                        default=3)
+# hours after which the files of an interrupted URL import are removed
+REFINERY_DOWNLOAD_MAX_AGE = get_setting("REFINERY_DOWNLOAD_MAX_AGE",
+                                        default=48)
 
 # location of the Solr server (must be accessible from the web browser)
 REFINERY_SOLR_BASE_URL = get_setting("REFINERY_SOLR_BASE_URL")
@@ -373,6 +399,33 @@ REFINERY_SOLR_BASE_URL = get_setting("REFINERY_SOLR_BASE_URL")
 REFINERY_SOLR_SPACE_DYNAMIC_FIELDS = get_setting(
     "REFINERY_SOLR_SPACE_DYNAMIC_FIELDS")
 
+# number of Solr documents prepared and sent per request when indexing nodes
+# in bulk
+REFINERY_SOLR_INDEXING_BATCH_SIZE = get_setting(
+    "REFINERY_SOLR_INDEXING_BATCH_SIZE", default=500)
+# connection pool and request settings of the shared Solr HTTP client
+# (timeouts in seconds)
+REFINERY_SOLR_POOL_SIZE = get_setting("REFINERY_SOLR_POOL_SIZE", default=10)
+REFINERY_SOLR_CONNECT_TIMEOUT = get_setting("REFINERY_SOLR_CONNECT_TIMEOUT",
+                                            default=3.05)
+REFINERY_SOLR_READ_TIMEOUT = get_setting("REFINERY_SOLR_READ_TIMEOUT",
+                                         default=30)
+REFINERY_SOLR_RETRIES = get_setting("REFINERY_SOLR_RETRIES", default=3)
+REFINERY_SOLR_RETRY_BACKOFF = get_setting("REFINERY_SOLR_RETRY_BACKOFF",
+                                          default=0.1)
+# seconds between logging the Solr request counts and latencies of each
+# process (0: never)
+REFINERY_SOLR_METRICS_INTERVAL = get_setting("REFINERY_SOLR_METRICS_INTERVAL",
+                                             default=300)
+# seconds the formatted Solr responses of the assay files API are cached
+# (they are invalidated when an assay is reindexed)
+REFINERY_SOLR_RESPONSE_CACHE_TIMEOUT = get_setting(
+    "REFINERY_SOLR_RESPONSE_CACHE_TIMEOUT", default=600)
+# maximum number of assays of an investigation annotated and indexed in
+# parallel
+REFINERY_ANNOTATION_CONCURRENCY = get_setting(
+    "REFINERY_ANNOTATION_CONCURRENCY", default=4)
+
 HAYSTACK_CONNECTIONS = {
     'default': {
         # Haystack requires a default, but there's less risk of confusion
@@ -511,6 +564,18 @@ TASTYPIE_DEFAULT_FORMATS = ['json']
 
 # temporary feature toggle for using S3 as user data file storage backend
 REFINERY_S3_USER_DATA = get_setting('REFINERY_S3_USER_DATA')
+# S3 client connection pool size (at least REFINERY_S3_MAX_CONCURRENCY) and
+# managed transfer settings (sizes in MB) for file imports
+REFINERY_S3_MAX_POOL_CONNECTIONS = get_setting(
+    "REFINERY_S3_MAX_POOL_CONNECTIONS", default=10)
+REFINERY_S3_MULTIPART_THRESHOLD = get_setting(
+    "REFINERY_S3_MULTIPART_THRESHOLD", default=64)
+REFINERY_S3_MULTIPART_CHUNKSIZE = get_setting(
+    "REFINERY_S3_MULTIPART_CHUNKSIZE", default=64)
+REFINERY_S3_MAX_CONCURRENCY = get_setting("REFINERY_S3_MAX_CONCURRENCY",
+                                          default=10)
+REFINERY_S3_USE_THREADS = get_setting("REFINERY_S3_USE_THREADS",
+                                      default=True)
 
 # ALLOWED_HOSTS required in 1.8.16 to prevent a DNS rebinding attack.
 ALLOWED_HOSTS = get_setting("ALLOWED_HOSTS")
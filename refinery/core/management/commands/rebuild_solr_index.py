@@ -0,0 +1,365 @@
+import copy
+from functools import partial
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from haystack import connections as haystack_connections
+from haystack.constants import DJANGO_CT, DJANGO_ID, ID
+from haystack.utils import get_model_ct
+import pysolr
+
+from data_set_manager.models import Assay, Node, bump_assay_index_generations
+from data_set_manager.search_indexes import NodeIndex
+
+from ...search_indexes import DataSetIndex, ProjectIndex
+from ...solr_client import get_solr_client
+
+logger = logging.getLogger(__name__)
+
+CORES = ['core', 'data_set_manager']
+
+
+def get_partitions(core, batch_size):
+    """Returns the units of work of a rebuild of a Solr core as JSON lists:
+    nodes of the data_set_manager core are partitioned by assay (nodes
+    outside of assays by study) and data sets of the core core by ID range
+    """
+    if core == 'data_set_manager':
+        partitions = [
+            ['assay', assay_id] for assay_id
+            in Assay.objects.order_by('id').values_list('id', flat=True)
+        ]
+        study_ids = Node.objects.filter(
+            assay__isnull=True, type__in=Node.INDEXED_FILES
+        ).order_by('study_id').values_list('study_id', flat=True)
+        partitions.extend(['study', study_id]
+                          for study_id in study_ids.distinct())
+    else:
+        data_set_ids = list(DataSetIndex().index_queryset().order_by(
+            'id'
+        ).values_list('id', flat=True))
+        partitions = [
+            ['data_sets', data_set_ids[start],
+             data_set_ids[min(start + batch_size, len(data_set_ids)) - 1]]
+            for start in range(0, len(data_set_ids), batch_size)
+        ]
+        partitions.append(['projects'])
+    return partitions
+
+
+def get_indexed_querysets(core):
+    """Returns a list of (model, queryset of the objects with documents) of
+    the indexes of a Solr core as indexed by index_partition()
+    """
+    if core == 'data_set_manager':
+        return [(Node, Node.objects.filter(type__in=Node.INDEXED_FILES))]
+    return [(index.get_model(), index.index_queryset(core))
+            for index in [DataSetIndex(), ProjectIndex()]]
+
+
+def get_document_ids(core, model, batch_size):
+    """Yields the Solr ID and the object ID of all documents of a model in
+    a Solr core (in batches using a cursor)
+    """
+    cursor = '*'
+    while True:
+        response = get_solr_client().get(core, params={
+            'q': '{}:"{}"'.format(DJANGO_CT, get_model_ct(model)),
+            'fl': ','.join([ID, DJANGO_ID]), 'sort': '{} asc'.format(ID),
+            'rows': batch_size, 'cursorMark': cursor, 'wt': 'json'
+        })
+        response.raise_for_status()
+        results = response.json()
+        for document in results['response']['docs']:
+            yield document[ID], document[DJANGO_ID]
+        if results['nextCursorMark'] == cursor:
+            return
+        cursor = results['nextCursorMark']
+
+
+def get_backend(using, url=None):
+    """Returns a copy of the Haystack backend of using with its own Solr
+    connection (to url instead of the core of using if given) so that
+    processes never share connections
+    """
+    backend = copy.copy(haystack_connections[using].get_backend())
+    backend.conn = pysolr.Solr(
+        url or settings.HAYSTACK_CONNECTIONS[using]['URL'],
+        timeout=backend.timeout
+    )
+    return backend
+
+
+def index_partition(partition, using, url=None, batch_size=None):
+    """Sends the documents of a partition to Solr without committing
+    :returns: tuple of the partition and the number of objects processed
+    """
+    backend = get_backend(using, url)
+    if partition[0] in ('assay', 'study'):
+        # other nodes are skipped by NodeIndex anyway
+        nodes = Node.objects.filter(type__in=Node.INDEXED_FILES)
+        if partition[0] == 'assay':
+            nodes = nodes.filter(assay_id=partition[1])
+        else:
+            nodes = nodes.filter(study_id=partition[1], assay__isnull=True)
+        count = NodeIndex().update_objects(nodes, using=using,
+                                           batch_size=batch_size,
+                                           backend=backend, commit=False)
+    else:
+        if partition[0] == 'data_sets':
+            index = DataSetIndex()
+            objects = list(index.index_queryset(using).filter(
+                id__range=partition[1:]
+            ))
+        else:
+            index = ProjectIndex()
+            objects = list(index.index_queryset(using))
+        backend.update(index, objects, commit=False)
+        count = len(objects)
+    return partition, count
+
+
+def _init_worker():
+    # database connections inherited from the parent can't be shared
+    connections.close_all()
+
+
+def load_checkpoint(path):
+    with open(path) as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+def save_checkpoint(path, checkpoint):
+    """Replaces the checkpoint file atomically"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(temp_path, path)
+
+
+def _core_admin(**params):
+    """Returns the response of a Solr CoreAdmin API request"""
+    params['wt'] = 'json'
+    response = get_solr_client().get('admin', 'cores', params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+class Command(BaseCommand):
+    help = """Rebuilds a Solr core: documents are prepared by a pool of
+    worker processes (nodes partitioned by assay, data sets by ID range) and
+    sent to Solr in batches. Progress is checkpointed after every commit so
+    that an interrupted rebuild can be continued with --resume. With
+    --staging the documents are indexed into an empty staging core that is
+    swapped with the live core once complete; otherwise the live core is
+    updated in place and the documents of objects that no longer exist (or
+    are no longer indexed) are removed once all partitions are indexed.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'core',
+            choices=CORES,
+            help='Name of the Solr core (and Haystack connection)'
+        )
+        parser.add_argument(
+            '--workers',
+            action='store',
+            type=int,
+            default=multiprocessing.cpu_count(),
+            help='Number of worker processes (1 indexes in this process)'
+        )
+        parser.add_argument(
+            '--batch_size',
+            action='store',
+            type=int,
+            default=settings.REFINERY_SOLR_INDEXING_BATCH_SIZE,
+            help='Number of documents per Solr request'
+        )
+        parser.add_argument(
+            '--commit_every',
+            action='store',
+            type=int,
+            default=100,
+            help='Number of partitions between commits and checkpoints'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            action='store',
+            help='Path of the checkpoint file (default: in the temporary '
+                 'directory)'
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            default=False,
+            help='Skip the partitions completed by an interrupted rebuild'
+        )
+        parser.add_argument(
+            '--staging',
+            action='store',
+            nargs='?',
+            const='',
+            help='Build into an existing staging core (default: '
+                 '<core>_staging) and swap it with the live core'
+        )
+
+    def handle(self, *args, **options):
+        core = options['core']
+        staging_core = options['staging']
+        if staging_core == '':
+            staging_core = '{}_staging'.format(core)
+        checkpoint_path = options['checkpoint'] or os.path.join(
+            tempfile.gettempdir(), 'refinery-solr-{}.json'.format(core)
+        )
+        url = None
+        if staging_core:
+            url = settings.REFINERY_SOLR_BASE_URL + staging_core
+
+        if options['resume']:
+            try:
+                checkpoint = load_checkpoint(checkpoint_path)
+            except (IOError, ValueError) as exc:
+                raise CommandError(
+                    "Could not read checkpoint '{}': {}".format(
+                        checkpoint_path, exc
+                    )
+                )
+            if (checkpoint['core'], checkpoint['staging']) != \
+                    (core, staging_core):
+                raise CommandError(
+                    "Checkpoint '{}' belongs to a rebuild of core '{}' "
+                    "(staging core: {})".format(
+                        checkpoint_path, checkpoint['core'],
+                        checkpoint['staging']
+                    )
+                )
+            if 'partitions' not in checkpoint:
+                raise CommandError(
+                    "Checkpoint '{}' does not list the partitions of the "
+                    "rebuild: start a new rebuild".format(checkpoint_path)
+                )
+        else:
+            # the partitions are stored so that a resumed rebuild works on
+            # the same ones even if the IDs or the batch size have changed
+            checkpoint = {
+                'core': core, 'staging': staging_core,
+                'partitions': get_partitions(core, options['batch_size']),
+                'done': []
+            }
+            if staging_core:
+                self._clear_staging_core(core, staging_core, url)
+            save_checkpoint(checkpoint_path, checkpoint)
+
+        done = set(tuple(partition) for partition in checkpoint['done'])
+        partitions = [partition for partition in checkpoint['partitions']
+                      if tuple(partition) not in done]
+        self.stdout.write("{} partitions to index ({} done before)".format(
+            len(partitions), len(done)
+        ))
+
+        index = partial(index_partition, using=core, url=url,
+                        batch_size=options['batch_size'])
+        solr = pysolr.Solr(url or settings.HAYSTACK_CONNECTIONS[core]['URL'])
+        start = time.time()
+        count = 0
+        completed = []
+        if options['workers'] > 1:
+            connections.close_all()
+            pool = multiprocessing.Pool(options['workers'],
+                                        initializer=_init_worker)
+            results = pool.imap_unordered(index, partitions)
+        else:
+            pool = None
+            results = (index(partition) for partition in partitions)
+        try:
+            for partition, partition_count in results:
+                completed.append(partition)
+                count += partition_count
+                if len(completed) >= options['commit_every']:
+                    self._commit(solr, checkpoint_path, checkpoint,
+                                 completed)
+                    completed = []
+                    self.stdout.write(
+                        "{} objects of {} partitions indexed in {:.0f} "
+                        "sec".format(count, len(checkpoint['done']),
+                                     time.time() - start)
+                    )
+            self._commit(solr, checkpoint_path, checkpoint, completed)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        if staging_core:
+            _core_admin(action='SWAP', core=core, other=staging_core)
+            self.stdout.write("Swapped core '{}' with '{}'".format(
+                core, staging_core
+            ))
+        else:
+            removed = self._remove_stale_documents(core, solr,
+                                                   options['batch_size'])
+            self.stdout.write("Removed {} stale documents".format(removed))
+        if core == 'data_set_manager':
+            bump_assay_index_generations(
+                Assay.objects.values_list('uuid', flat=True)
+            )
+        os.remove(checkpoint_path)
+        self.stdout.write(
+            "Rebuilt core '{}': {} objects of {} partitions in {:.0f} "
+            "sec".format(core, count, len(checkpoint['done']),
+                         time.time() - start)
+        )
+
+    def _clear_staging_core(self, core, staging_core, url):
+        status = _core_admin(action='STATUS', core=staging_core)
+        if not status['status'].get(staging_core):
+            raise CommandError(
+                "Solr core '{}' does not exist: create it with the "
+                "configuration of core '{}' first".format(staging_core, core)
+            )
+        pysolr.Solr(url).delete(q='*:*')
+
+    def _remove_stale_documents(self, core, solr, batch_size):
+        """Deletes the documents of the live core that the rebuild did not
+        update because their objects have been deleted (or are no longer
+        indexed), like update_index --remove
+        :returns: number of documents deleted
+        """
+        removed = 0
+        for model, queryset in get_indexed_querysets(core):
+            object_ids = set(
+                str(object_id)
+                for object_id in queryset.values_list('id', flat=True)
+            )
+            stale_ids = [
+                document_id for document_id, object_id
+                in get_document_ids(core, model, batch_size)
+                if object_id not in object_ids
+            ]
+            for start in range(0, len(stale_ids), batch_size):
+                response = get_solr_client().post(
+                    core, 'update',
+                    json={'delete': stale_ids[start:start + batch_size]}
+                )
+                response.raise_for_status()
+            removed += len(stale_ids)
+        if removed:
+            solr.commit()
+        return removed
+
+    def _commit(self, solr, checkpoint_path, checkpoint, completed):
+        """Commits the target core and only then records the completed
+        partitions so that a resumed rebuild doesn't skip uncommitted ones
+        """
+        solr.commit()
+        checkpoint['done'].extend(completed)
+        save_checkpoint(checkpoint_path, checkpoint)
@@ -21,7 +21,8 @@ def update_read_meta_dataset_permissions(apps, schema_editor):
     create_permissions(apps, verbosity=0)
     apps.models_module = None
 
-    for dataset in DataSet.objects.all():
+    # only load the ID: columns added by later migrations do not exist yet
+    for dataset in DataSet.objects.only('id'):
         for queryset in [User.objects.all(), Group.objects.all()]:
             for obj in queryset:
                 permission_checker = ObjectPermissionChecker(obj)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import migrations
+
+
+def backfill_owners(apps, schema_editor):
+    """Set the owner of data sets, projects and workflows to the user with
+    the share permission (the first one, as get_owner() used to return)
+    """
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    UserObjectPermission = apps.get_model('guardian', 'UserObjectPermission')
+    for model_name in ['dataset', 'project', 'workflow']:
+        model = apps.get_model('core', model_name)
+        try:
+            content_type = ContentType.objects.get(app_label='core',
+                                                   model=model_name)
+        except ContentType.DoesNotExist:
+            continue  # new database without any objects
+        owners = {}
+        for object_pk, user_id in UserObjectPermission.objects.filter(
+                content_type=content_type,
+                permission__codename='share_{}'.format(model_name)
+        ).order_by('id').values_list('object_pk', 'user_id'):
+            owners.setdefault(int(object_pk), user_id)
+        for object_id, user_id in owners.items():
+            model.objects.filter(id=object_id).update(owner_id=user_id)
+
+
+class Migration(migrations.Migration):
+    """Data migration runs separately from schema changes to avoid
+    OperationalError: cannot ALTER TABLE because it has pending trigger events
+    """
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('guardian', '0001_initial'),
+        ('core', '0038_sharableresource_owner'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_owners, migrations.RunPython.noop),
+    ]
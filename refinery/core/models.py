@@ -20,14 +20,13 @@ from django import forms
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.forms import AuthenticationForm
-from django.contrib.auth.models import Group, Permission, User
+from django.contrib.auth.models import Group, User
 from django.contrib.auth.signals import user_logged_in
-from django.contrib.contenttypes.models import ContentType
 from django.contrib.messages import get_messages, info
 from django.contrib.sites.models import Site
 from django.db import models, transaction
 from django.db.models import Sum
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import m2m_changed, post_save, pre_delete
 from django.dispatch import receiver
 from django.forms import ValidationError
 from django.template import loader
@@ -39,7 +38,6 @@ from django.utils.functional import cached_property
 from bioblend import galaxy
 from cuser.middleware import CuserMiddleware
 from django_extensions.db.fields import UUIDField
-from guardian.models import UserObjectPermission
 from guardian.shortcuts import (assign_perm, get_groups_with_perms,
                                 get_users_with_perms, remove_perm)
 import pysolr
@@ -58,9 +56,10 @@ from file_store.tasks import FileImportTask
 from galaxy_connector.models import Instance
 import tool_manager
 
-from .utils import (delete_data_set_index, email_admin,
-                    invalidate_cached_object, skip_if_test_run,
-                    update_data_set_index)
+from .utils import (bump_cache_generation, delete_data_set_index,
+                    email_admin, get_cache_generation,
+                    invalidate_cached_object, on_commit, skip_if_test_run,
+                    update_data_set_index, update_data_set_node_index)
 
 logger = logging.getLogger(__name__)
 
@@ -368,45 +367,45 @@ class SharableResource(OwnableResource):
     permissions, where "xxx" is the simple_modelname
     """
     share_list = None
+    # denormalized owner (the user with the "share" permission) maintained
+    # by set_owner() and remove_owner()
+    owner = models.ForeignKey(User, null=True, blank=True, editable=False,
+                              related_name='+', on_delete=models.SET_NULL)
 
     def __str__(self):
         return self.name
 
     def get_owner(self):
-        owner = None
-        content_type_id = ContentType.objects.get_for_model(self).id
-        codename = 'share_%s' % self._meta.verbose_name
-        try:
-            permission_id = Permission.objects.filter(
-                codename=codename
-            )[0].id
-        except IndexError:
-            logger.error('No Permission objects returned for codename %s',
-                         codename)
-            return owner
-
-        perms = UserObjectPermission.objects.filter(
-            content_type_id=content_type_id,
-            permission_id=permission_id,
-            object_pk=self.id
-        )
+        return self.owner
 
-        if perms.count() > 0:
-            try:
-                owner = User.objects.get(id=perms[0].user_id)
-            except (User.DoesNotExist, User.MultipleObjectsReturned) as exc:
-                logger.error("Error finding user with owner perms %s: %s",
-                             str(perms[0]), exc)
-
-        return owner
+    def save(self, *args, **kwargs):
+        # the owner column is only written by _update_owner(), so that saving
+        # a stale instance can't restore a previous owner
+        if not self._state.adding and not kwargs.get('force_insert') and \
+                kwargs.get('update_fields') is None and not args:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'owner' and
+                field.attname in self.__dict__  # not deferred
+            ]
+        super(SharableResource, self).save(*args, **kwargs)
 
     def set_owner(self, user):
         super(SharableResource, self).set_owner(user)
         assign_perm("share_%s" % self._meta.verbose_name, user, self)
+        self._update_owner(user)
 
     def remove_owner(self, user):
         super(SharableResource, self).remove_owner(user)
         remove_perm("share_%s" % self._meta.verbose_name, user, self)
+        if self.owner_id == user.id:
+            self._update_owner(None)
+
+    def _update_owner(self, user):
+        # update the column only to leave modification_date and post_save
+        # receivers alone
+        self.__class__.objects.filter(pk=self.pk).update(owner=user)
+        self.owner = user
 
     """
     Sharing something always grants read and add permission
@@ -495,6 +494,21 @@ class SharableResource(OwnableResource):
         abstract = True
 
 
+def prefetch_owners(resources):
+    """Loads the owners (with their profiles) of sharable resources with a
+    join for querysets or with one query for lists of instances
+    """
+    if isinstance(resources, models.QuerySet):
+        return resources.select_related('owner__profile')
+    owners = User.objects.select_related('profile').in_bulk(
+        set(resource.owner_id for resource in resources
+            if resource.owner_id is not None)
+    )
+    for resource in resources:
+        resource.owner = owners.get(resource.owner_id)
+    return resources
+
+
 class TemporaryResource(models.Model):
     """Mix-in class for temporary resources like NodeSet instances"""
     # Expiration time and date of the instance
@@ -534,6 +548,23 @@ class ManageableResource(models.Model):
         abstract = True
 
 
+def get_data_set_access_generation():
+    """Returns the generation of the data set permissions that cached
+    per-user data set lookups are keyed by
+    """
+    return get_cache_generation('data-set-access')
+
+
+def invalidate_data_set_access(data_set=None, investigations=None):
+    """Invalidates the cached data set lookups of all users and reindexes the
+    nodes of the investigations of data_set (default: the latest one) to
+    update their access field
+    """
+    bump_cache_generation('data-set-access')
+    if data_set is not None:
+        update_data_set_node_index(data_set, investigations)
+
+
 class DataSet(SharableResource):
     UNTITLED_DATA_SET_TITLE = "Untitled data set"
 
@@ -696,6 +727,14 @@ class DataSet(SharableResource):
         return sum([node.file_item.get_file_size() for node
                     in self.get_file_nodes().select_related('file_item')])
 
+    def set_owner(self, user):
+        super(DataSet, self).set_owner(user)
+        invalidate_data_set_access(self)
+
+    def remove_owner(self, user):
+        super(DataSet, self).remove_owner(user)
+        invalidate_data_set_access(self)
+
     def share(self, group, readonly=True, readmetaonly=False):
         # change: !readonly & !readmetaonly, read: readonly & !readmetaonly
         super(DataSet, self).share(group, readonly)
@@ -710,6 +749,7 @@ class DataSet(SharableResource):
 
         update_data_set_index(self)
         invalidate_cached_object(self)
+        invalidate_data_set_access(self)
         user_ids = [user.id for user in group.user_set.all()]
 
         # We need to give the anonymous user read access too.
@@ -721,6 +761,7 @@ class DataSet(SharableResource):
         remove_perm('read_meta_%s' % self._meta.verbose_name, group, self)
 
         update_data_set_index(self)
+        invalidate_data_set_access(self)
         # Need to check if the users of the group that is unshared still have
         # access via other groups or by ownership
         users = group.user_set.all()
@@ -815,7 +856,7 @@ class DataSet(SharableResource):
             investigation,
             "Metadata Revision: for {}".format(updated_data_set_title)
         )
-        data_set_manager.tasks.annotate_nodes(investigation.uuid)
+        on_commit(data_set_manager.tasks.annotate_nodes, investigation.uuid)
         self.set_title(updated_data_set_title)
 
     @transaction.atomic()
@@ -857,6 +898,7 @@ def _dataset_delete(sender, instance, *args, **kwargs):
 
     delete_data_set_index(instance)
     invalidate_cached_object(instance)
+    invalidate_data_set_access()
 
 
 @receiver(post_save, sender=DataSet)
@@ -902,6 +944,29 @@ class InvestigationLink(models.Model):
             return None
 
 
+@receiver(post_save, sender=InvestigationLink)
+def _investigation_link_saved(sender, instance, created, **kwargs):
+    # a new version replaces the assays (and indexed nodes) of the data set:
+    # the nodes of the previous version lose their access tokens
+    if not created:
+        return
+    if instance.version > 1:
+        investigations = [instance.investigation] + [
+            link.investigation for link in InvestigationLink.objects.filter(
+                data_set=instance.data_set, version=instance.version - 1
+            ).select_related('investigation')
+        ]
+        invalidate_data_set_access(instance.data_set, investigations)
+    else:
+        invalidate_data_set_access()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def _user_groups_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_data_set_access()
+
+
 class WorkflowEngine(OwnableResource, ManageableResource):
     # TODO: remove Galaxy dependency
     instance = models.ForeignKey(Instance, blank=True)
@@ -42,7 +42,7 @@ class DataSetIndex(indexes.SearchIndex, indexes.Indexable):
 
     def index_queryset(self, using=None):
         """Used when the entire index for model is updated"""
-        return self.get_model().objects.all()
+        return self.get_model().objects.select_related('owner')
 
     def prepare_description(self, object):
         try:
@@ -199,4 +199,6 @@ class ProjectIndex(indexes.SearchIndex, indexes.Indexable):
 
     def index_queryset(self, using=None):
         """Used when the entire index for model is updated."""
-        return self.get_model().objects.all().exclude(is_catch_all=True)
+        return self.get_model().objects.select_related('owner').exclude(
+            is_catch_all=True
+        )
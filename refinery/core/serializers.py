@@ -1,15 +1,23 @@
+from collections import defaultdict
 import logging
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.db.models import Count
 from django.utils import timezone
+from guardian.core import ObjectPermissionChecker
+from guardian.models import GroupObjectPermission, UserObjectPermission
 from guardian.shortcuts import get_perms
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 
-from tool_manager.models import Tool
+from data_set_manager.models import Node
+from tool_manager.models import Tool, VisualizationTool
 
 from .models import (Analysis, DataSet, Event, ExtendedGroup, Invitation,
-                     SiteProfile, SiteVideo, User, UserProfile, Workflow)
+                     InvestigationLink, SiteProfile, SiteVideo, User,
+                     UserProfile, Workflow, prefetch_owners)
 logger = logging.getLogger(__name__)
 
 
@@ -51,6 +59,105 @@ class AnalysisSerializer(serializers.ModelSerializer):
         return analysis.workflow.uuid
 
 
+def _get_owners(objects, codename):
+    """Returns a dict of the IDs of objects and their owners (the first user
+    with the given object permission)
+    """
+    owners = {}
+    if objects:
+        for permission in UserObjectPermission.objects.filter(
+                content_type=ContentType.objects.get_for_model(objects[0]),
+                permission__codename=codename,
+                object_pk__in=[str(obj.id) for obj in objects]
+        ).select_related('user__profile').order_by('id'):
+            owners.setdefault(int(permission.object_pk), permission.user)
+    return owners
+
+
+def _prefetch_data_set_details(data_sets, user=None):
+    """Loads the details serialized by DataSetSerializer for all data_sets
+    with a constant number of queries and attaches them to the instances
+    """
+    data_set_ids = [data_set.id for data_set in data_sets]
+    prefetch_owners(data_sets)
+
+    public_group = ExtendedGroup.objects.public_group()
+    public_ids = set(
+        int(object_pk) for object_pk in GroupObjectPermission.objects.filter(
+            content_type=ContentType.objects.get_for_model(DataSet),
+            permission__codename='read_meta_dataset',
+            group_id=public_group.id if public_group else None,
+            object_pk__in=[str(data_set_id) for data_set_id in data_set_ids]
+        ).values_list('object_pk', flat=True)
+    )
+
+    analyses = defaultdict(list)
+    for analysis in Analysis.objects.filter(data_set_id__in=data_set_ids):
+        analyses[analysis.data_set_id].append(analysis)
+    all_analyses = [analysis for data_set_analyses in analyses.values()
+                    for analysis in data_set_analyses]
+    analysis_owners = _get_owners(all_analyses, 'add_analysis')
+    for analysis in all_analyses:
+        analysis.prefetched_owner = analysis_owners.get(analysis.id)
+    visualized_ids = set(VisualizationTool.objects.filter(
+        dataset_id__in=data_set_ids
+    ).values_list('dataset_id', flat=True))
+
+    # later links replace earlier ones
+    latest_links = {}
+    for data_set_id, version, investigation_id in \
+            InvestigationLink.objects.filter(
+                data_set_id__in=data_set_ids
+            ).order_by('date', 'id').values_list(
+                'data_set_id', 'version', 'investigation_id'
+            ):
+        latest_links[data_set_id] = (version, investigation_id)
+    file_counts = dict(Node.objects.filter(
+        study__investigation_id__in=[
+            investigation_id for _, investigation_id in latest_links.values()
+        ],
+        file_item__isnull=False,
+        is_auxiliary_node=False
+    ).order_by().values_list('study__investigation_id').annotate(
+        Count('id')
+    ))
+
+    if user is not None:
+        checker = ObjectPermissionChecker(user)
+        checker.prefetch_perms(data_sets)
+
+    for data_set in data_sets:
+        data_set.public = data_set.id in public_ids
+        data_set.prefetched_analyses = analyses[data_set.id]
+        data_set.prefetched_is_clean = not (
+            any(not analysis.failed() for analysis in analyses[data_set.id])
+            or data_set.id in visualized_ids
+        )
+        version, investigation_id = latest_links.get(data_set.id,
+                                                     (None, None))
+        data_set.prefetched_version = version
+        data_set.prefetched_file_count = file_counts.get(investigation_id, 0)
+        if user is not None:
+            data_set.is_owner = (data_set.owner_id is not None and
+                                 data_set.owner_id == user.id)
+            data_set.prefetched_user_perms = checker.get_perms(data_set)
+
+
+class DataSetListSerializer(serializers.ListSerializer):
+    """Serializes lists of data sets with a constant number of queries"""
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        data_sets = list(iterable)
+        try:
+            user = self.context['request'].user
+        except (KeyError, AttributeError):
+            user = None
+        _prefetch_data_set_details(data_sets, user)
+        return super(DataSetListSerializer, self).to_representation(
+            data_sets
+        )
+
+
 class DataSetSerializer(serializers.ModelSerializer):
     slug = serializers.CharField(
             max_length=250,
@@ -71,13 +178,23 @@ class DataSetSerializer(serializers.ModelSerializer):
     version = serializers.SerializerMethodField()
 
     def get_analyses(self, data_set):
+        try:
+            analyses = data_set.prefetched_analyses
+        except AttributeError:
+            analyses = data_set.get_analyses()
         return [
             dict(uuid=analysis.uuid, name=analysis.name,
                  status=analysis.status,
-                 owner=str(analysis.get_owner().profile.uuid))
-            for analysis in data_set.get_analyses()
+                 owner=str(self._get_analysis_owner(analysis).profile.uuid))
+            for analysis in analyses
         ]
 
+    def _get_analysis_owner(self, analysis):
+        try:
+            return analysis.prefetched_owner
+        except AttributeError:
+            return analysis.get_owner()
+
     def get_is_owner(self, data_set):
         try:
             return data_set.is_owner
@@ -101,26 +218,38 @@ class DataSetSerializer(serializers.ModelSerializer):
             return is_public
 
     def get_is_clean(self, data_set):
-        return data_set.is_clean()
+        try:
+            return data_set.prefetched_is_clean
+        except AttributeError:
+            return data_set.is_clean()
 
     def get_file_count(self, data_set):
-        return data_set.get_file_count()
+        try:
+            return data_set.prefetched_file_count
+        except AttributeError:
+            return data_set.get_file_count()
 
     def get_user_perms(self, data_set):
         try:
-            request_user = self.context.get('request').user
-        except AttributeError as e:
-            logger.error("Request is missing a user: %s", e)
-            return {'change': False,
-                    'read': False,
-                    'read_meta': False}
-        user_perms = get_perms(request_user, data_set)
+            user_perms = data_set.prefetched_user_perms
+        except AttributeError:
+            try:
+                request_user = self.context.get('request').user
+            except AttributeError as e:
+                logger.error("Request is missing a user: %s", e)
+                return {'change': False,
+                        'read': False,
+                        'read_meta': False}
+            user_perms = get_perms(request_user, data_set)
         return {'change': 'change_dataset' in user_perms,
                 'read': 'read_dataset' in user_perms,
                 'read_meta': 'read_meta_dataset' in user_perms}
 
     def get_version(self, data_set):
-        return data_set.get_version()
+        try:
+            return data_set.prefetched_version
+        except AttributeError:
+            return data_set.get_version()
 
     class Meta:
         model = DataSet
@@ -128,6 +257,7 @@ class DataSetSerializer(serializers.ModelSerializer):
                   'file_count', 'id', 'is_clean', 'is_owner',
                   'modification_date', 'owner', 'public', 'slug', 'summary',
                   'title', 'uuid', 'user_perms', 'version')
+        list_serializer_class = DataSetListSerializer
 
     def partial_update(self, instance, validated_data):
         """
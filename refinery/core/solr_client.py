@@ -0,0 +1,145 @@
+"""
+Shared HTTP client for Solr requests
+
+Every process keeps one requests.Session with a pool of keep-alive
+connections to Solr instead of opening a new connection per request.
+"""
+
+from collections import defaultdict
+import logging
+import os
+import threading
+import time
+from urllib.parse import urljoin
+
+from django.conf import settings
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Solr searches are read-only and can be retried safely
+RETRY_METHODS = frozenset(['GET', 'POST'])
+RETRY_STATUSES = (502, 503, 504)
+
+
+class SolrClient(object):
+    """Sends requests to the Solr cores below base_url over pooled
+    connections and keeps request counts and latencies per core
+    """
+    def __init__(self, base_url, pool_size=10, timeout=(3.05, 30),
+                 retries=3, backoff_factor=0.1, metrics_interval=0):
+        """metrics_interval: seconds between logging and resetting the
+        metrics (0: never)
+        """
+        self.base_url = base_url
+        self.timeout = timeout
+        self.metrics_interval = metrics_interval
+        self._metrics_start = time.time()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size,
+            max_retries=Retry(total=retries, backoff_factor=backoff_factor,
+                              method_whitelist=RETRY_METHODS,
+                              status_forcelist=RETRY_STATUSES,
+                              raise_on_status=False)
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self._metrics = defaultdict(lambda: {
+            'requests': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0
+        })
+
+    def request(self, method, core, handler='select', **kwargs):
+        """Returns the requests.Response of a Solr request handler
+        core: name of the Solr core (e.g., 'data_set_manager')
+        kwargs: passed on to requests.Session.request()
+        """
+        url = urljoin(self.base_url, '/'.join([core, handler]))
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.time()
+        failed = True
+        try:
+            response = self.session.request(method, url, **kwargs)
+            failed = not response.ok
+            return response
+        finally:
+            self._record(core, time.time() - start, failed)
+
+    def get(self, core, handler='select', **kwargs):
+        return self.request('GET', core, handler, **kwargs)
+
+    def post(self, core, handler='select', **kwargs):
+        return self.request('POST', core, handler, **kwargs)
+
+    def _record(self, core, duration, failed):
+        with self._lock:
+            metrics = self._metrics[core]
+            metrics['requests'] += 1
+            metrics['errors'] += failed
+            metrics['total_time'] += duration
+            metrics['max_time'] = max(metrics['max_time'], duration)
+        logger.debug("Solr request to '%s' took %.3f sec", core, duration)
+        if (self.metrics_interval and
+                time.time() - self._metrics_start >= self.metrics_interval):
+            self.log_metrics()
+
+    def get_metrics(self, reset=False):
+        """Returns a dict of request count, error count, total, mean and
+        maximum latency (in seconds) per Solr core
+        reset: start counting again from zero
+        """
+        with self._lock:
+            metrics = {core: dict(values)
+                       for core, values in self._metrics.items()}
+            if reset:
+                self._metrics.clear()
+                self._metrics_start = time.time()
+        for values in metrics.values():
+            values['mean_time'] = (values['total_time'] / values['requests']
+                                   if values['requests'] else 0.0)
+        return metrics
+
+    def reset_metrics(self):
+        self.get_metrics(reset=True)
+
+    def log_metrics(self):
+        """Logs the metrics of each core since the last reset and resets
+        them
+        """
+        for core, values in sorted(self.get_metrics(reset=True).items()):
+            logger.info("Solr core '%s': %s requests, %s errors, mean %.3f "
+                        "sec, max %.3f sec", core, values['requests'],
+                        values['errors'], values['mean_time'],
+                        values['max_time'])
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_solr_client():
+    """Returns the SolrClient of the current process (a new one is created
+    after a fork so that pooled connections are never shared by processes)
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = SolrClient(
+                settings.REFINERY_SOLR_BASE_URL,
+                pool_size=settings.REFINERY_SOLR_POOL_SIZE,
+                timeout=(settings.REFINERY_SOLR_CONNECT_TIMEOUT,
+                         settings.REFINERY_SOLR_READ_TIMEOUT),
+                retries=settings.REFINERY_SOLR_RETRIES,
+                backoff_factor=settings.REFINERY_SOLR_RETRY_BACKOFF,
+                metrics_interval=settings.REFINERY_SOLR_METRICS_INTERVAL
+            )
+            _client_pid = os.getpid()
+        return _client
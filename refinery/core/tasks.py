@@ -2,7 +2,11 @@ import logging
 
 import celery
 
-from .models import SiteStatistics
+# These imports go against our coding style guide, but are necessary for the
+#  time being due to mutual import issues
+import data_set_manager
+
+from .models import DataSet, SiteStatistics
 
 logger = logging.getLogger(__name__)
 
@@ -10,3 +14,38 @@ logger = logging.getLogger(__name__)
 @celery.task.task()
 def collect_site_statistics():
     SiteStatistics.objects.create().collect()
+
+
+@celery.task.task()
+def update_data_set_node_index(data_set_uuid, investigation_uuids=None):
+    """Reindexes the nodes of the given investigations of a data set
+    (default: the latest one, as only its nodes are accessible)
+    """
+    try:
+        data_set = DataSet.objects.get(uuid=data_set_uuid)
+    except (DataSet.DoesNotExist, DataSet.MultipleObjectsReturned) as exc:
+        logger.error("Could not reindex nodes of data set %s: %s",
+                     data_set_uuid, exc)
+        return
+    if investigation_uuids is None:
+        investigation = data_set.get_investigation()
+        if investigation is None:
+            return
+        investigation_uuids = [investigation.uuid]
+    models = data_set_manager.models
+    studies = models.Study.objects.filter(
+        investigation__investigationlink__data_set=data_set,
+        investigation__uuid__in=investigation_uuids
+    )
+    # nodes are indexed after they were annotated: nothing to update for
+    # versions that are still being imported
+    study_ids = set(models.AnnotatedNode.objects.filter(
+        study__in=studies
+    ).order_by().values_list('study_id', flat=True).distinct())
+    if not study_ids:
+        return
+    data_set_manager.search_indexes.NodeIndex().update_objects(
+        models.Node.objects.filter(study_id__in=study_ids,
+                                   type__in=models.Node.INDEXED_FILES),
+        using='data_set_manager'
+    )
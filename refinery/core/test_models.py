@@ -41,8 +41,8 @@ from .models import (INPUT_CONNECTION, OUTPUT_CONNECTION, Analysis,
                      DataSet, Download, Event, ExtendedGroup,
                      InvestigationLink, Project, SiteProfile, SiteStatistics,
                      SiteVideo, Tutorials, UserProfile, Workflow,
-                     WorkflowEngine)
-from .tasks import collect_site_statistics
+                     WorkflowEngine, prefetch_owners)
+from .tasks import collect_site_statistics, update_data_set_node_index
 
 
 class AnalysisDeletionTest(TestCase):
@@ -968,6 +968,99 @@ class ShareableResourceTest(TestCase):
         user_perms = get_perms(self.user, self.data_set)
         self.assertTrue('share_dataset' in user_perms)
 
+    def test_set_owner_stores_owner(self):
+        self.data_set.set_owner(self.user)
+        self.assertEqual(DataSet.objects.get(id=self.data_set.id).owner,
+                         self.user)
+
+    def test_remove_owner_keeps_other_owner(self):
+        other_user = User.objects.create_user('OtherUser', '', 'OtherUser')
+        self.owned_data_set.remove_owner(other_user)
+        self.assertEqual(self.owned_data_set.get_owner(), self.user)
+
+    def test_transfer_ownership(self):
+        new_owner = User.objects.create_user('NewOwner', '', 'NewOwner')
+        self.owned_data_set.transfer_ownership(self.user, new_owner)
+        self.assertEqual(
+            DataSet.objects.get(id=self.owned_data_set.id).get_owner(),
+            new_owner
+        )
+
+    def test_save_of_stale_instance_keeps_owner(self):
+        stale_data_set = DataSet.objects.get(id=self.data_set.id)
+        self.data_set.set_owner(self.user)
+        stale_data_set.title = 'Stale'
+        stale_data_set.save()
+        data_set = DataSet.objects.get(id=self.data_set.id)
+        self.assertEqual(data_set.get_owner(), self.user)
+        self.assertEqual(data_set.title, 'Stale')
+
+    def test_save_of_stale_instance_keeps_owner_removed(self):
+        stale_data_set = DataSet.objects.get(id=self.owned_data_set.id)
+        self.owned_data_set.remove_owner(self.user)
+        stale_data_set.save()
+        self.assertIsNone(
+            DataSet.objects.get(id=self.owned_data_set.id).get_owner()
+        )
+
+    def test_get_owner_without_queries(self):
+        profile_uuid = self.user.profile.uuid
+        data_set = prefetch_owners(DataSet.objects.all()).get(
+            id=self.owned_data_set.id
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(data_set.get_owner().profile.uuid, profile_uuid)
+
+    def test_prefetch_owners_of_list(self):
+        data_sets = list(DataSet.objects.order_by('id'))
+        with self.assertNumQueries(1):
+            prefetch_owners(data_sets)
+        with self.assertNumQueries(0):
+            self.assertEqual([data_set.get_owner() for data_set in data_sets],
+                             [None, self.user])
+
+
+class DataSetNodeIndexTest(TestCase):
+    def setUp(self):
+        self.data_set = create_dataset_with_necessary_models()
+        self.investigation = self.data_set.get_investigation()
+        self.new_investigation = \
+            create_dataset_with_necessary_models().get_investigation()
+
+    def _indexed_studies(self, *args):
+        with mock.patch('data_set_manager.search_indexes.NodeIndex.'
+                        'update_objects') as update_objects_mock:
+            update_data_set_node_index(self.data_set.uuid, *args)
+        return set(node.study for node
+                   in update_objects_mock.call_args[0][0])
+
+    @mock.patch('core.models.update_data_set_node_index')
+    def test_new_version_reindexes_previous_and_new_version(self,
+                                                            update_mock):
+        self.data_set.update_investigation(self.new_investigation, 'v2')
+        update_mock.assert_called_once_with(
+            self.data_set, [self.new_investigation, self.investigation]
+        )
+
+    @mock.patch('core.models.update_data_set_node_index')
+    def test_share_reindexes_latest_version(self, update_mock):
+        self.data_set.share(ExtendedGroup.objects.public_group())
+        update_mock.assert_called_with(self.data_set, None)
+
+    def test_update_node_index_of_latest_version(self):
+        self.data_set.update_investigation(self.new_investigation, 'v2')
+        self.assertEqual(self._indexed_studies(),
+                         {self.new_investigation.get_study()})
+
+    def test_update_node_index_of_investigations(self):
+        self.data_set.update_investigation(self.new_investigation, 'v2')
+        self.assertEqual(
+            self._indexed_studies([self.investigation.uuid,
+                                   self.new_investigation.uuid]),
+            {self.investigation.get_study(),
+             self.new_investigation.get_study()}
+        )
+
 
 class SiteProfileUnitTests(TestCase):
     def setUp(self):
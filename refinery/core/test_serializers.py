@@ -119,6 +119,14 @@ class DataSetSerializerTests(TestCase):
         self.assertEqual(serializer.data.get('version'),
                          self.data_set.get_version())
 
+    def test_list_serializer_matches_serializer(self):
+        data_sets = [self.data_set,
+                     create_dataset_with_necessary_models(user=self.user)]
+        self.assertEqual(
+            DataSetSerializer(data_sets, many=True).data,
+            [DataSetSerializer(data_set).data for data_set in data_sets]
+        )
+
 
 class DateTimeWithTimeZoneTests(TestCase):
     def test_returns_localtime(self):
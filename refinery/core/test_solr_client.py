@@ -0,0 +1,88 @@
+from django.test import SimpleTestCase, override_settings
+
+import mock
+import requests
+
+from . import solr_client
+from .solr_client import SolrClient, get_solr_client
+
+
+class SolrClientTests(SimpleTestCase):
+    def setUp(self):
+        self.client = SolrClient('http://localhost:8983/solr/', pool_size=4,
+                                 timeout=(1, 2), retries=2)
+        self.response = mock.Mock(spec=requests.Response, ok=True)
+        self.request_mock = mock.patch.object(
+            self.client.session, 'request', return_value=self.response
+        ).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_connection_pool(self):
+        adapter = self.client.session.get_adapter('http://localhost:8983/')
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter.max_retries.total, 2)
+
+    def test_post(self):
+        self.assertEqual(
+            self.client.post('data_set_manager', json={'query': '*:*'}),
+            self.response
+        )
+        self.request_mock.assert_called_once_with(
+            'POST', 'http://localhost:8983/solr/data_set_manager/select',
+            json={'query': '*:*'}, timeout=(1, 2)
+        )
+
+    def test_get_with_timeout(self):
+        self.client.get('core', params={'q': '*:*'}, timeout=5)
+        self.request_mock.assert_called_once_with(
+            'GET', 'http://localhost:8983/solr/core/select',
+            params={'q': '*:*'}, timeout=5
+        )
+
+    def test_metrics(self):
+        self.client.get('core')
+        self.response.ok = False
+        self.client.get('core')
+        self.request_mock.side_effect = requests.exceptions.ConnectionError
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.client.get('data_set_manager')
+        metrics = self.client.get_metrics()
+        self.assertEqual(metrics['core']['requests'], 2)
+        self.assertEqual(metrics['core']['errors'], 1)
+        self.assertEqual(metrics['data_set_manager']['errors'], 1)
+        self.assertGreaterEqual(metrics['core']['max_time'],
+                                metrics['core']['mean_time'])
+        self.client.reset_metrics()
+        self.assertEqual(self.client.get_metrics(), {})
+
+    @mock.patch('core.solr_client.logger')
+    def test_metrics_are_logged_by_interval(self, logger_mock):
+        self.client.metrics_interval = 60
+        with mock.patch('time.time', return_value=0):
+            self.client.reset_metrics()
+        with mock.patch('time.time', return_value=30):
+            self.client.get('core')
+        self.assertFalse(logger_mock.info.called)
+        with mock.patch('time.time', return_value=60):
+            self.client.get('core')
+        self.assertEqual(logger_mock.info.call_args[0][1:3], ('core', 2))
+        self.assertEqual(self.client.get_metrics(), {})
+
+
+@override_settings(REFINERY_SOLR_BASE_URL='http://localhost:8983/solr/')
+class GetSolrClientTests(SimpleTestCase):
+    def setUp(self):
+        mock.patch.object(solr_client, '_client', None).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_client_is_reused(self):
+        self.assertIs(get_solr_client(), get_solr_client())
+
+    def test_new_client_after_fork(self):
+        client = get_solr_client()
+        with mock.patch('os.getpid', return_value=-1):
+            self.assertIsNot(get_solr_client(), client)
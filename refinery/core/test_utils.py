@@ -1,14 +1,20 @@
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.http import Http404
 from django.test import TestCase, override_settings
 
+import mock
+
 from factory_boy.utils import create_dataset_with_necessary_models
 
-from .models import ExtendedGroup
-from .utils import (build_absolute_url, is_absolute_url,
-                    get_non_manager_groups_for_user, get_data_set_for_view_set,
-                    get_group_for_view_set)
+from .models import DataSet, ExtendedGroup
+from .utils import (atomic_with_on_commit, build_absolute_url,
+                    bump_cache_generation, get_cache_generation,
+                    get_cached_object_key, invalidate_cached_object,
+                    is_absolute_url, get_non_manager_groups_for_user,
+                    get_data_set_for_view_set, get_group_for_view_set,
+                    on_commit, update_data_set_node_index)
 
 
 class TestIsAbsoluteURL(TestCase):
@@ -111,3 +117,117 @@ class GetGroupForViewSetTest(TestCase):
     def test_get_group_for_view_set_raises_404(self):
         with self.assertRaises(Http404):
             get_group_for_view_set('xxxxx7')
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+}})
+class InvalidateCachedObjectTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cachedJane', '', 'password')
+        self.data_set = create_dataset_with_necessary_models()
+        cache.set(get_cached_object_key(self.user.id, DataSet), 'cached')
+        cache.set(get_cached_object_key(self.user.id, User), 'cached')
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_invalidate_cached_object_without_queries(self):
+        with self.assertNumQueries(0):
+            invalidate_cached_object(self.data_set)
+        self.assertIsNone(
+            cache.get(get_cached_object_key(self.user.id, DataSet))
+        )
+
+    def test_invalidate_cached_object_keeps_other_classes(self):
+        invalidate_cached_object(self.data_set)
+        self.assertEqual(cache.get(get_cached_object_key(self.user.id, User)),
+                         'cached')
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+}})
+class CacheGenerationTest(TestCase):
+    def tearDown(self):
+        cache.clear()
+
+    def test_bump_cache_generation(self):
+        generation = get_cache_generation('test')
+        bump_cache_generation('test')
+        self.assertNotEqual(get_cache_generation('test'), generation)
+
+    @mock.patch('core.utils.logger')
+    def test_bump_cache_generation_with_failed_set(self, logger_mock):
+        with mock.patch.object(cache, 'set'):
+            bump_cache_generation('test')
+        self.assertTrue(logger_mock.error.called)
+
+    @mock.patch('core.utils.logger')
+    def test_bump_cache_generation_with_cache_error(self, logger_mock):
+        with mock.patch.object(cache, 'set', side_effect=IOError):
+            bump_cache_generation('test')
+        self.assertTrue(logger_mock.error.called)
+
+
+class OnCommitTest(TestCase):
+    def setUp(self):
+        self.callback = mock.Mock(__name__='callback')
+
+    def test_on_commit_outside_of_block(self):
+        on_commit(self.callback, 1, key='value')
+        self.callback.assert_called_once_with(1, key='value')
+
+    def test_on_commit_after_block(self):
+        with atomic_with_on_commit():
+            on_commit(self.callback, 1)
+            self.assertFalse(self.callback.called)
+        self.callback.assert_called_once_with(1)
+
+    def test_on_commit_after_outermost_block(self):
+        with atomic_with_on_commit():
+            with atomic_with_on_commit():
+                on_commit(self.callback)
+            self.assertFalse(self.callback.called)
+        self.assertTrue(self.callback.called)
+
+    def test_on_commit_after_rollback(self):
+        with self.assertRaises(RuntimeError):
+            with atomic_with_on_commit():
+                on_commit(self.callback)
+                raise RuntimeError
+        self.assertFalse(self.callback.called)
+
+    def test_on_commit_after_rollback_of_nested_block(self):
+        other_callback = mock.Mock(__name__='other_callback')
+        with atomic_with_on_commit():
+            on_commit(other_callback)
+            try:
+                with atomic_with_on_commit():
+                    on_commit(self.callback)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertFalse(self.callback.called)
+        self.assertTrue(other_callback.called)
+
+    @mock.patch('core.utils.logger')
+    def test_on_commit_with_error(self, logger_mock):
+        self.callback.side_effect = RuntimeError
+        other_callback = mock.Mock(__name__='other_callback')
+        with atomic_with_on_commit():
+            on_commit(self.callback)
+            on_commit(other_callback)
+        self.assertTrue(logger_mock.exception.called)
+        self.assertTrue(other_callback.called)
+
+    @mock.patch('sys.argv', ['manage.py', 'runserver'])
+    @mock.patch('core.tasks.update_data_set_node_index.delay')
+    def test_update_data_set_node_index_after_commit(self, delay_mock):
+        data_set = create_dataset_with_necessary_models()
+        investigation = data_set.get_investigation()
+        with atomic_with_on_commit():
+            update_data_set_node_index(data_set, [investigation])
+            self.assertFalse(delay_mock.called)
+        delay_mock.assert_called_once_with(data_set.uuid,
+                                           [investigation.uuid])
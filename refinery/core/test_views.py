@@ -11,9 +11,11 @@ from django.conf import settings
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
+from django.db import connection
 from django.http import Http404
 from django.test import Client, override_settings
 from django.test.testcases import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.utils.functional import SimpleLazyObject
 
@@ -226,6 +228,18 @@ class DataSetApiV2Tests(APIV2TestCase):
         self.assertEqual(get_response.data.get('data_sets')[0].get('uuid'),
                          self.user_2_data_set.uuid)
 
+    def test_get_data_sets_with_constant_number_of_queries(self):
+        get_request = self.factory.get(self.url_root)
+        get_request.user = self.user
+        with CaptureQueriesContext(connection) as queries:
+            self.view(get_request)
+        for _ in range(3):
+            create_dataset_with_necessary_models(user=self.user)
+        with CaptureQueriesContext(connection) as more_queries:
+            get_response = self.view(get_request)
+        self.assertEqual(get_response.data.get('total_data_sets'), 7)
+        self.assertEqual(len(more_queries), len(queries))
+
     def test_total_data_sets_returned_correctly(self):
         create_dataset_with_necessary_models(user=self.user)
         get_request = self.factory.get(self.url_root)
@@ -1,4 +1,8 @@
+from io import StringIO
+import os
 import re
+import shutil
+import tempfile
 
 from django.apps import apps
 from django.contrib.auth.models import Group, User
@@ -9,16 +13,19 @@ from django.db.migrations.executor import MigrationExecutor
 from django.test import TestCase
 from django.utils import timezone
 
+import mock
 import mockcache as memcache
 
 from data_set_manager.models import Assay, Contact, Investigation, Study
 from factory_boy.django_model_factories import GalaxyInstanceFactory
 from factory_boy.utils import create_dataset_with_necessary_models
 
+from .management.commands.rebuild_solr_index import (load_checkpoint,
+                                                     save_checkpoint)
 from .models import (DataSet, ExtendedGroup, WorkflowEngine,
                      invalidate_cached_object)
 from .search_indexes import DataSetIndex
-from .utils import get_aware_local_time
+from .utils import get_aware_local_time, get_cached_object_key
 
 cache = memcache.Client(["127.0.0.1:11211"])
 
@@ -40,10 +47,13 @@ class CachingTest(TestCase):
         for index, item in enumerate(range(0, 6)):
             create_dataset_with_necessary_models(slug="TestSlug%d" % index)
         # Adding to cache
-        cache.add("{}-DataSet".format(self.user.id), DataSet.objects.all())
+        cache.add(self._get_cache_key(), DataSet.objects.all())
 
         # Initial data that is cached, to test against later
-        self.initial_cache = cache.get("{}-DataSet".format(self.user.id))
+        self.initial_cache = cache.get(self._get_cache_key())
+
+    def _get_cache_key(self):
+        return get_cached_object_key(self.user.id, DataSet)
 
     def tearDown(self):
         self.cache = invalidate_cached_object(DataSet.objects.get(
@@ -53,7 +63,7 @@ class CachingTest(TestCase):
         # Grab a DataSet and see if we can invalidate the cache
         ds = DataSet.objects.get(slug="TestSlug5")
         self.cache = invalidate_cached_object(ds, True)
-        self.assertIsNone(self.cache.get("{}-DataSet".format(self.user.id)))
+        self.assertIsNone(self.cache.get(self._get_cache_key()))
 
     def test_verify_data_after_save(self):
         # Grab, alter, and save an object being cached
@@ -65,9 +75,9 @@ class CachingTest(TestCase):
         self.cache = invalidate_cached_object(ds, True)
 
         # Adding to cache again
-        self.cache.add("{}-DataSet".format(self.user.id),
+        self.cache.add(self._get_cache_key(),
                        DataSet.objects.all())
-        new_cache = self.cache.get("{}-DataSet".format(self.user.id))
+        new_cache = self.cache.get(self._get_cache_key())
 
         self.assertTrue(new_cache)
         # Make sure new cache represents the altered data
@@ -83,11 +93,11 @@ class CachingTest(TestCase):
         self.cache = invalidate_cached_object(DataSet.objects.get(
             slug="TestSlug1"), True)
 
-        self.assertFalse(self.cache.get("{}-DataSet".format(self.user.id)))
+        self.assertFalse(self.cache.get(self._get_cache_key()))
         # Adding to cache again
-        self.cache.add("{}-DataSet".format(self.user.id),
+        self.cache.add(self._get_cache_key(),
                        DataSet.objects.all())
-        new_cache = self.cache.get("{}-DataSet".format(self.user.id))
+        new_cache = self.cache.get(self._get_cache_key())
 
         self.assertTrue(new_cache)
         # Make sure new cache represents the altered data
@@ -102,11 +112,11 @@ class CachingTest(TestCase):
         self.cache = invalidate_cached_object(DataSet.objects.get(
             slug="TestSlug1"), True)
 
-        self.assertFalse(self.cache.get("{}-DataSet".format(self.user.id)))
+        self.assertFalse(self.cache.get(self._get_cache_key()))
         # Adding to cache again
-        self.cache.add("{}-DataSet".format(self.user.id),
+        self.cache.add(self._get_cache_key(),
                        DataSet.objects.all())
-        new_cache = self.cache.get("{}-DataSet".format(self.user.id))
+        new_cache = self.cache.get(self._get_cache_key())
 
         self.assertTrue(new_cache)
         # Make sure new cache represents the altered data
@@ -331,6 +341,132 @@ class TestManagementCommands(TestCase):
             )
 
 
+class RebuildSolrIndexCommandTests(TestCase):
+    def setUp(self):
+        self.data_set = create_dataset_with_necessary_models()
+        self.temp_dir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.temp_dir, 'checkpoint.json')
+        self.solr_mock = mock.patch(
+            'core.management.commands.rebuild_solr_index.pysolr.Solr'
+        ).start()
+        self.index_patch = mock.patch(
+            'core.management.commands.rebuild_solr_index.index_partition',
+            side_effect=lambda partition, **kwargs: (partition, 1)
+        )
+        self.index_mock = self.index_patch.start()
+        self.solr_client_mock = mock.patch(
+            'core.management.commands.rebuild_solr_index.get_solr_client'
+        ).start().return_value
+        self.documents = {'core.dataset': [], 'core.project': []}
+        self.solr_client_mock.get.side_effect = self._get_documents
+
+    def _get_documents(self, core, params):
+        response = mock.Mock()
+        content_type = params['q'].split(':')[1].strip('"')
+        response.json.return_value = {
+            'response': {'docs': [
+                {'id': '{}.{}'.format(content_type, object_id),
+                 'django_id': str(object_id)}
+                for object_id in self.documents[content_type]
+            ]},
+            'nextCursorMark': params['cursorMark']
+        }
+        return response
+
+    def tearDown(self):
+        mock.patch.stopall()
+        shutil.rmtree(self.temp_dir)
+
+    def _rebuild(self, **options):
+        call_command('rebuild_solr_index', 'core', workers=1,
+                     checkpoint=self.checkpoint, stdout=StringIO(),
+                     **options)
+
+    def _get_indexed_partitions(self):
+        return [args[0] for args, _ in self.index_mock.call_args_list]
+
+    def test_rebuild(self):
+        self._rebuild()
+        self.assertEqual(
+            self._get_indexed_partitions(),
+            [['data_sets', self.data_set.id, self.data_set.id],
+             ['projects']]
+        )
+        self.assertTrue(self.solr_mock.return_value.commit.called)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_rebuild_indexes_partitions(self):
+        self.index_patch.stop()
+        self._rebuild()
+        solr = self.solr_mock.return_value
+        documents = [document for args, _ in solr.add.call_args_list
+                     for document in args[0]]
+        self.assertIn(
+            ('core.dataset', str(self.data_set.id)),
+            [(document['django_ct'], document['django_id'])
+             for document in documents]
+        )
+        self.assertFalse(solr.add.call_args[1]['commit'])
+        self.assertTrue(solr.commit.called)
+
+    def test_rebuild_removes_stale_documents(self):
+        self.documents['core.dataset'] = [self.data_set.id,
+                                          self.data_set.id + 1]
+        self._rebuild()
+        self.solr_client_mock.post.assert_called_once_with(
+            'core', 'update',
+            json={'delete': ['core.dataset.{}'.format(self.data_set.id + 1)]}
+        )
+
+    def test_rebuild_keeps_current_documents(self):
+        self.documents['core.dataset'] = [self.data_set.id]
+        self._rebuild()
+        self.assertFalse(self.solr_client_mock.post.called)
+
+    def test_interrupted_rebuild_keeps_checkpoint(self):
+        self.index_mock.side_effect = [(['data_sets', 1, 1], 1),
+                                       RuntimeError]
+        with self.assertRaises(RuntimeError):
+            self._rebuild(commit_every=1)
+        self.assertEqual(load_checkpoint(self.checkpoint)['done'],
+                         [['data_sets', 1, 1]])
+
+    def test_resume_skips_completed_partitions(self):
+        save_checkpoint(self.checkpoint,
+                        {'core': 'core', 'staging': None,
+                         'partitions': [['data_sets', 1, 1], ['projects']],
+                         'done': [['projects']]})
+        self._rebuild(resume=True)
+        self.assertEqual(self._get_indexed_partitions(),
+                         [['data_sets', 1, 1]])
+
+    def test_resume_uses_partitions_of_checkpoint(self):
+        save_checkpoint(self.checkpoint,
+                        {'core': 'core', 'staging': None,
+                         'partitions': [['data_sets', 1, 10],
+                                        ['data_sets', 11, 20],
+                                        ['projects']],
+                         'done': [['data_sets', 1, 10]]})
+        self._rebuild(resume=True, batch_size=1)
+        self.assertEqual(self._get_indexed_partitions(),
+                         [['data_sets', 11, 20], ['projects']])
+
+    def test_resume_with_checkpoint_of_other_rebuild(self):
+        save_checkpoint(self.checkpoint,
+                        {'core': 'data_set_manager', 'staging': None,
+                         'partitions': [], 'done': []})
+        with self.assertRaises(CommandError):
+            self._rebuild(resume=True)
+        self.assertFalse(self.index_mock.called)
+
+    def test_resume_with_checkpoint_without_partitions(self):
+        save_checkpoint(self.checkpoint,
+                        {'core': 'core', 'staging': None, 'done': []})
+        with self.assertRaises(CommandError):
+            self._rebuild(resume=True)
+        self.assertFalse(self.index_mock.called)
+
+
 class TestMigrations(TestCase):
     """
     Useful test class for testing Django Data migrations
@@ -1,15 +1,18 @@
 
 
-from functools import wraps
+from contextlib import contextmanager
+from functools import partial, wraps
 import logging
 import sys
+import threading
+import uuid
 
 from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.core.cache import cache
 from django.core.mail import send_mail
+from django.db import transaction
 from django.http import Http404
 from django.utils import timezone
 
@@ -25,6 +28,9 @@ import data_set_manager
 
 logger = logging.getLogger(__name__)
 
+# callbacks registered with on_commit() in the current atomic_with_on_commit()
+_on_commit = threading.local()
+
 
 def skip_if_test_run(func):
     """Decorator to be used on functions that don't necessarily need to
@@ -89,33 +95,139 @@ def delete_analysis_index(node_instance):
         logger.error("Could not delete from NodeIndex: %s", e)
 
 
+@skip_if_test_run
+def update_data_set_node_index(data_set, investigations=None):
+    """Reindexes the nodes of the investigations of a data set (default: the
+    latest one) in the background once the current transaction has been
+    committed (e.g., to update their access field after the data set was
+    shared or unshared)
+    """
+    investigation_uuids = None
+    if investigations is not None:
+        investigation_uuids = [investigation.uuid
+                               for investigation in investigations]
+    on_commit(_start_data_set_node_index_update, data_set.uuid,
+              investigation_uuids)
+
+
+def _start_data_set_node_index_update(data_set_uuid, investigation_uuids):
+    from .tasks import update_data_set_node_index as update_task
+    try:
+        update_task.delay(data_set_uuid, investigation_uuids)
+    except Exception as e:
+        logger.error("Could not start node index update of data set %s: %s",
+                     data_set_uuid, e)
+
+
+def get_cached_object_key(user_id, model):
+    """Returns the cache key of the objects of a model class cached for a
+    user. The key includes the generation of the class so that
+    invalidate_cached_object() invalidates the keys of all users at once.
+    """
+    return '{}-{}-{}'.format(
+        user_id, model.__name__,
+        get_cache_generation('objects-{}'.format(model.__name__))
+    )
+
+
 def invalidate_cached_object(instance, is_test=False):
     """
-        Removes cached objects for all users based on the class name of the
-        instance passed.
+        Invalidates cached objects for all users based on the class name of
+        the instance passed by moving to a new generation of the keys
+        returned by get_cached_object_key().
 
         Ex: Given a DataSet instance, all possible cached objects holding
-        DataSets will be deleted to represent the saving, updating,
+        DataSets will be invalidated to represent the saving, updating,
         deletion, or perms change that was performed upon it.
 
         If the is_test flag is set, a new instance of a mockcache Client
         will be returned
     """
     if not is_test:
-        try:
-            cache.delete_many(['{}-{}'.format(user.id, instance.__class__.
-                                              __name__)
-                               for user in User.objects.all()])
-
-        except Exception as e:
-            logger.debug("Could not delete %s from cache" %
-                         instance.__class__.__name__, e)
+        bump_cache_generation('objects-{}'.format(instance.__class__.__name__))
     else:
         from mockcache import Client
         mc = Client()
         return mc
 
 
+def get_cache_generation(name):
+    """Returns the current generation token of a group of cached objects.
+    Cache keys that include it become unreachable once the group is
+    invalidated with bump_cache_generation(). Tokens are random rather than
+    incremented so that a generation evicted from the cache can never be
+    reissued with stale entries still cached under it.
+    """
+    key = 'generation-{}'.format(name)
+    generation = cache.get(key)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        # keep the token of a concurrent request if it was first
+        if not cache.add(key, generation, None):
+            generation = cache.get(key, generation)
+    return generation
+
+
+def bump_cache_generation(name):
+    """Invalidates all cached objects keyed by the generation of name"""
+    key = 'generation-{}'.format(name)
+    try:
+        cache.set(key, uuid.uuid4().hex, None)
+        # memcached clients don't raise errors: a failed set deletes the key
+        stored = cache.get(key) is not None
+    except (EnvironmentError, ValueError) as exc:
+        logger.error("Could not bump cache generation of '%s': %s", name,
+                     exc)
+    else:
+        if not stored:
+            logger.error("Could not bump cache generation of '%s': cache "
+                         "not available", name)
+
+
+@contextmanager
+def atomic_with_on_commit(using=None):
+    """transaction.atomic() that runs the callbacks registered with
+    on_commit() inside of it once the block has been committed (Django 1.8
+    has no transaction.on_commit()). Nested blocks leave the callbacks to the
+    outermost block and discard the callbacks of their own if rolled back.
+    """
+    callbacks = getattr(_on_commit, 'callbacks', None)
+    if callbacks is not None:
+        start = len(callbacks)
+        try:
+            with transaction.atomic(using):
+                yield
+        except Exception:
+            del callbacks[start:]
+            raise
+        return
+    _on_commit.callbacks = []
+    try:
+        with transaction.atomic(using):
+            yield
+        callbacks = _on_commit.callbacks
+    finally:
+        _on_commit.callbacks = None
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as exc:
+            # the transaction has been committed already
+            logger.exception("Error running %s after commit: %s",
+                             callback.func.__name__, exc)
+
+
+def on_commit(func, *args, **kwargs):
+    """Calls func(*args, **kwargs) after the enclosing
+    atomic_with_on_commit() block has been committed (or right away outside
+    of such a block), e.g., to start tasks that must see the changes
+    """
+    callbacks = getattr(_on_commit, 'callbacks', None)
+    if callbacks is None:
+        return func(*args, **kwargs)
+    callbacks.append(partial(func, *args, **kwargs))
+
+
 def build_absolute_url(string):
     """Creates an absolute URL from a relative URL using the current Site
     domain and REFINERY_URL_SCHEME Django setting
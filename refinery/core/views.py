@@ -14,7 +14,6 @@ from django.contrib.sites.models import RequestSite, Site
 from django.contrib.sites.shortcuts import get_current_site
 from django.core.mail import EmailMessage
 from django.core.urlresolvers import reverse
-from django.db import transaction
 from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
                          HttpResponseForbidden, HttpResponseNotFound,
                          HttpResponseRedirect, HttpResponseServerError,
@@ -25,10 +24,8 @@ from django.utils import timezone
 
 import boto3
 import botocore
-from guardian.shortcuts import (get_groups_with_perms, get_objects_for_user,
-                                get_perms)
-
-from guardian.core import ObjectPermissionChecker
+from guardian.shortcuts import (get_groups_with_perms, get_objects_for_group,
+                                get_objects_for_user, get_perms)
 from registration import signals
 from registration.views import RegistrationView
 import requests
@@ -50,16 +47,19 @@ from data_set_manager.models import Attribute
 
 from .forms import UserForm, UserProfileForm
 from .models import (Analysis, CustomRegistrationProfile, DataSet, Event,
-                     ExtendedGroup, Invitation, SiteProfile, SiteStatistics,
-                     SiteVideo, UserProfile, Workflow)
+                     ExtendedGroup, Invitation, InvestigationLink,
+                     SiteProfile, SiteStatistics, SiteVideo, UserProfile,
+                     Workflow)
 
 from .serializers import (AnalysisSerializer, DataSetSerializer,
                           EventSerializer, ExtendedGroupSerializer,
                           InvitationSerializer, SiteProfileSerializer,
                           SiteVideoSerializer, UserProfileSerializer,
                           WorkflowSerializer)
-from .utils import (api_error_response, get_data_set_for_view_set,
-                    get_group_for_view_set, get_non_manager_groups_for_user)
+from .solr_client import get_solr_client
+from .utils import (api_error_response, atomic_with_on_commit,
+                    get_data_set_for_view_set, get_group_for_view_set,
+                    get_non_manager_groups_for_user)
 
 logger = logging.getLogger(__name__)
 
@@ -293,8 +293,6 @@ def solr_core_search(request):
     server, it's better to prefetch all dataset uuid and send them back
     altogether rather than having to query from the client side twice.
     """
-    url = settings.REFINERY_SOLR_BASE_URL + "core/select"
-
     headers = {
         'Accept': 'application/json'
     }
@@ -312,7 +310,8 @@ def solr_core_search(request):
             ' OR '.join(access))
 
     try:
-        response = requests.get(url, params=params, headers=headers)
+        response = get_solr_client().get('core', params=params,
+                                         headers=headers)
         response.raise_for_status()
     except HTTPError as e:
         logger.error(e)
@@ -590,81 +589,36 @@ class DataSetViewSet(viewsets.ViewSet):
         paginator = LimitOffsetPagination()
         paginator.default_limit = 100
 
-        filters = {
-            'is_owner': params.get('is_owner'),
-            'is_public': params.get('public')
-        }
-        try:
-            filters['group'] = ExtendedGroup.objects.get(
-                id=params.get('group')
-            )
-        except Exception:
-            filters['group'] = None
-
-        user_data_sets = get_objects_for_user(
+        # only valid data sets (with an investigation) are listed
+        data_sets = get_objects_for_user(
             request.user,
             "core.read_meta_dataset",
             accept_global_perms=False
+        ).filter(
+            id__in=InvestigationLink.objects.values('data_set_id')
         ).order_by('-modification_date')
 
-        filtered_data_sets = []
-        check_own = filters.get('is_owner')
-        all_owner_perms = ObjectPermissionChecker(request.user)
-        all_owner_perms.prefetch_perms(user_data_sets)
-
-        check_public = filters.get('is_public')
-        all_public_perms = ObjectPermissionChecker(
-            ExtendedGroup.objects.public_group()
-        )
-        all_public_perms.prefetch_perms(user_data_sets)
-
-        group = filters.get('group')
+        # all given filters have to match
+        if params.get('is_owner'):
+            # anonymous users (without an ID) do not own data sets
+            data_sets = data_sets.filter(owner__isnull=False,
+                                         owner_id=request.user.id)
+        if params.get('public'):
+            data_sets = data_sets.filter(id__in=get_objects_for_group(
+                ExtendedGroup.objects.public_group(),
+                "core.read_meta_dataset", accept_global_perms=False
+            ).values('id'))
+        try:
+            group = ExtendedGroup.objects.get(id=params.get('group'))
+        except Exception:
+            group = None
         if group:
-            all_group_perms = ObjectPermissionChecker(filters.get('group'))
-            all_group_perms.prefetch_perms(user_data_sets)
-
-        for data_set in user_data_sets:
-            is_public = all_public_perms.has_perm('read_meta_dataset',
-                                                  data_set)
-            if request.user.is_superuser:
-                is_owner = data_set.get_owner() == request.user
-            else:
-                is_owner = all_owner_perms.has_perm('share_dataset', data_set)
-            setattr(data_set, 'public', is_public)
-            setattr(data_set, 'is_owner', is_owner)
-
-            if not data_set.is_valid:
-                logger.warning(
-                    "DataSet with UUID: {} is invalid, and most likely is "
-                    "still being created".format(data_set.uuid)
-                )
-                continue
-            elif check_own or check_public or group:
-                if group:
-                    group_perms = all_group_perms.has_perm('read_meta_dataset',
-                                                           data_set)
-                # need to check for filter and then check data set perms
-                if check_own and check_public and group:
-                    if is_owner and is_public and group_perms:
-                        filtered_data_sets.append(data_set)
-                elif check_own and group:
-                    if is_owner and group_perms:
-                        filtered_data_sets.append(data_set)
-                elif check_own and check_public:
-                    if is_owner and is_public:
-                        filtered_data_sets.append(data_set)
-                elif check_public and group:
-                    if is_public and group_perms:
-                        filtered_data_sets.append(data_set)
-                elif check_own and is_owner or check_public and is_public\
-                        or group and group_perms:
-                    filtered_data_sets.append(data_set)
-            else:
-                filtered_data_sets.append(data_set)
+            data_sets = data_sets.filter(id__in=get_objects_for_group(
+                group, "core.read_meta_dataset", accept_global_perms=False
+            ).values('id'))
 
-        total_data_sets = len(filtered_data_sets)
-        paged_data_sets = paginator.paginate_queryset(filtered_data_sets,
-                                                      request)
+        paged_data_sets = paginator.paginate_queryset(data_sets, request)
+        total_data_sets = paginator.count
         serializer = DataSetSerializer(paged_data_sets, many=True,
                                        context={'request': request})
 
@@ -749,7 +703,8 @@ class DataSetViewSet(viewsets.ViewSet):
                     return Response(uuid, status=status.HTTP_404_NOT_FOUND)
 
                 try:
-                    with transaction.atomic():
+                    # reindexes the nodes once the transfer is committed
+                    with atomic_with_on_commit():
                         self.data_set.transfer_ownership(current_owner,
                                                          new_owner)
                         perm_groups = self.update_group_perms(new_owner)
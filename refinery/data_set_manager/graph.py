@@ -0,0 +1,184 @@
+"""
+Compact, read-only representation of the experiment graph of a study
+
+Nodes are addressed by their position in NodeGraph.ids and the parent and
+child relations are stored as adjacency arrays in compressed sparse row (CSR)
+format: the parents of the node at position i are
+parent_indices[parent_offsets[i]:parent_offsets[i + 1]] (same for children).
+"""
+
+from array import array
+from collections import deque
+import logging
+
+from .models import Node
+
+logger = logging.getLogger(__name__)
+
+
+def _build_csr(num_nodes, edges):
+    """Returns offsets and indices arrays for a list of (source, target)
+    position pairs, the targets of each source sorted by position
+    """
+    offsets = array('l', [0] * (num_nodes + 1))
+    for source, _ in edges:
+        offsets[source + 1] += 1
+    for position in range(num_nodes):
+        offsets[position + 1] += offsets[position]
+    indices = array('l', [0] * len(edges))
+    next_free = array('l', offsets[:-1])
+    for source, target in sorted(edges):
+        indices[next_free[source]] = target
+        next_free[source] += 1
+    return offsets, indices
+
+
+class NodeGraph(object):
+    """Experiment graph of all nodes of a study (including the nodes of all
+    of its assays) loaded with one query for the nodes and one for the edges
+    """
+    def __init__(self, nodes, edges, child_edges=None):
+        """nodes: list of (id, uuid, type, assay UUID) tuples
+        edges: list of (child id, parent id) tuples
+        child_edges: list of (parent id, child id) tuples if the children
+        are stored separately from the parents (see Node.add_child()),
+        otherwise the reverse of edges
+        """
+        self.ids = array('l', [node[0] for node in nodes])
+        self.uuids = [node[1] for node in nodes]
+        self.types = [node[2] for node in nodes]
+        # Assay.uuid is a UUIDField: compare UUIDs as strings
+        self.assay_uuids = [None if node[3] is None else str(node[3])
+                            for node in nodes]
+        self._positions = {node_id: position
+                           for position, node_id in enumerate(self.ids)}
+        positions = self._edge_positions(edges)
+        self.parent_offsets, self.parent_indices = _build_csr(
+            len(self.ids), positions
+        )
+        if child_edges is None:
+            child_positions = [(parent, child) for child, parent in positions]
+        else:
+            child_positions = self._edge_positions(child_edges)
+        self.child_offsets, self.child_indices = _build_csr(
+            len(self.ids), child_positions
+        )
+
+    def _edge_positions(self, edges):
+        positions = [
+            (self._positions[source_id], self._positions[target_id])
+            for source_id, target_id in edges
+            if source_id in self._positions and target_id in self._positions
+        ]
+        if len(positions) < len(edges):
+            logger.warning("Ignored %s edges to nodes of other studies",
+                           len(edges) - len(positions))
+        return positions
+
+    @classmethod
+    def load(cls, study_uuid):
+        nodes = Node.objects.filter(study__uuid=study_uuid).order_by(
+            'id'
+        ).values_list('id', 'uuid', 'type', 'assay__uuid')
+        edges = Node.parents.through.objects.filter(
+            from_node__study__uuid=study_uuid
+        ).values_list('from_node_id', 'to_node_id')
+        # the same as Node.get_children()
+        child_edges = Node.children.through.objects.filter(
+            from_node__study__uuid=study_uuid
+        ).values_list('from_node_id', 'to_node_id')
+        return cls(list(nodes), list(edges), list(child_edges))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, node_id):
+        return self._positions[node_id]
+
+    def parents(self, position):
+        return self.parent_indices[
+            self.parent_offsets[position]:self.parent_offsets[position + 1]
+        ]
+
+    def children(self, position):
+        return self.child_indices[
+            self.child_offsets[position]:self.child_offsets[position + 1]
+        ]
+
+    def parent_uuids(self, node_id):
+        return [self.uuids[parent]
+                for parent in self.parents(self.position(node_id))]
+
+    def child_uuids(self, node_id):
+        return [self.uuids[child]
+                for child in self.children(self.position(node_id))]
+
+    def is_leaf(self, position):
+        return self.child_offsets[position] == \
+            self.child_offsets[position + 1]
+
+    def leaves(self, assay_uuid=None):
+        """Returns the positions of all nodes without children that belong
+        to the assay or to the study if assay_uuid is None
+        """
+        if assay_uuid is not None:
+            assay_uuid = str(assay_uuid)
+        return [position for position in range(len(self.ids))
+                if self.assay_uuids[position] == assay_uuid and
+                self.is_leaf(position)]
+
+    def topological_order(self):
+        """Returns the positions of all nodes so that every node comes after
+        its parents (Kahn's algorithm); nodes on cycles are left out
+        """
+        in_degree = array('l', [
+            self.parent_offsets[position + 1] - self.parent_offsets[position]
+            for position in range(len(self.ids))
+        ])
+        queue = deque(position for position in range(len(self.ids))
+                      if in_degree[position] == 0)
+        order = []
+        while queue:
+            position = queue.popleft()
+            order.append(position)
+            for child in self.children(position):
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    queue.append(child)
+        if len(order) < len(self.ids):
+            logger.error("Experiment graph contains %s nodes on cycles",
+                         len(self.ids) - len(order))
+        return order
+
+    def type_sequence(self, position):
+        """Returns the node types on the path from a root to the node,
+        following the first parent of each node (all paths are assumed to
+        have the same sequence of node types)
+        """
+        sequence = []
+        visited = set()
+        while position is not None and position not in visited:
+            visited.add(position)
+            sequence.append(self.types[position])
+            parents = self.parents(position)
+            position = parents[0] if len(parents) else None
+        sequence.reverse()
+        return sequence
+
+    def _traverse(self, positions, neighbours):
+        found = set()
+        queue = deque(positions)
+        while queue:
+            for neighbour in neighbours(queue.popleft()):
+                if neighbour not in found:
+                    found.add(neighbour)
+                    queue.append(neighbour)
+        return found
+
+    def ancestors(self, positions):
+        """Returns the positions of all ancestors of the given nodes"""
+        return self._traverse(positions, self.parents)
+
+    def descendants(self, positions):
+        """Returns the positions of all descendants of the given nodes"""
+        return self._traverse(positions, self.children)
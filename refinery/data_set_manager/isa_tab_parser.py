@@ -4,26 +4,29 @@ Created on May 11, 2012
 @author: nils
 '''
 
-from collections import deque
+from collections import defaultdict, deque
 import csv
+import errno
+import fnmatch
 import glob
+import io
 import itertools
 import logging
 import os
+import posixpath
 import re
-import string
-import tempfile
-from zipfile import ZipFile
+import uuid
+from zipfile import BadZipfile, ZipFile
 
 from django.core.files import File
 
 import botocore
 
-from file_store.models import FileStoreItem
+from file_store.models import FileStoreItem, bulk_create_file_store_items
+from file_store.utils import Checksums
 from .models import (Assay, Attribute, Contact, Design, Factor, Investigation,
                      Node, Ontology, Protocol, ProtocolReference,
                      ProtocolReferenceParameter, Publication, Study)
-from .utils import fix_last_column
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +35,334 @@ class ParserException(Exception):
     pass
 
 
+def _set_checksums(file_store_item, archive):
+    """Stores the checksums of an archive on its FileStoreItem (saved with
+    the data file) so that re-submissions can be compared without reading
+    the stored archive again
+    """
+    checksums = Checksums()
+    checksums.update_from_file(archive)
+    archive.seek(0)
+    file_store_item.md5 = checksums.md5
+    file_store_item.sha256 = checksums.sha256
+
+
+class IsaTabArchive(object):
+    """Read access to the files of an ISArchive: either a ZIP file, which is
+    read member by member without extracting it, or a directory containing
+    an extracted ISArchive. Assumes that the archive extracts into a
+    subdirectory named <archive> if the ISArchive is called <archive>.zip.
+    """
+    INVESTIGATION_FILE_PATTERN = "i*.txt"
+
+    def __init__(self, path):
+        self.path = path
+        self._zip_file = None
+        self._root = ""
+        if os.path.isdir(path):
+            return
+        logger.info(
+            "Supplied path \"" + path + "\" is not a directory. Assuming "
+            "ISArchive file.")
+        try:
+            self._zip_file = ZipFile(path, 'r')
+            names = self._zip_file.namelist()
+            # test if any paths are relative or absolute and outside the
+            # archive
+            for name in names:
+                if name.startswith("..") or name.startswith("/"):
+                    raise ParserException(
+                        "Unable to extract assumed ISArchive file {!r} due "
+                        "to illegal file path: {}".format(path, name)
+                    )
+            # test if first entry in zip file is a path
+            first_name = names[0]
+        except (EnvironmentError, BadZipfile, IndexError, ParserException):
+            self.close()
+            raise ParserException(
+                "Unable to extract assumed ISArchive file {!r}.".format(path)
+            )
+        if "/" in first_name:
+            self._root = first_name[:first_name.index("/")]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._zip_file is not None:
+            self._zip_file.close()
+
+    def find_investigation_file(self):
+        """Return the name of the investigation file or None if there is no
+        investigation file in the top level directory of the archive
+        """
+        if self._zip_file is None:
+            file_names = glob.glob(
+                os.path.join(self.path, self.INVESTIGATION_FILE_PATTERN)
+            )
+        else:
+            file_names = [
+                name for name in self._zip_file.namelist()
+                if posixpath.dirname(name) == self._root and
+                fnmatch.fnmatchcase(posixpath.basename(name),
+                                    self.INVESTIGATION_FILE_PATTERN)
+            ]
+        try:
+            return os.path.basename(file_names.pop())
+        except IndexError:
+            return None
+
+    def open(self, file_name, encoding=None):
+        """Return a text stream for a file in the top level directory of the
+        archive with universal newlines left to the csv module
+        """
+        if self._zip_file is None:
+            return io.open(os.path.join(self.path, file_name),
+                           encoding=encoding, newline='')
+        name = posixpath.join(self._root, file_name)
+        try:
+            member = self._zip_file.open(name)
+        except KeyError:
+            raise IOError(errno.ENOENT, "No such file in ISArchive {!r}"
+                          .format(self.path), name)
+        return io.TextIOWrapper(member, encoding=encoding, newline='')
+
+
+class DatabaseNodeGraph(object):
+    """Writes nodes, edges, attributes and protocol references of an
+    experiment graph to the database as soon as they are parsed
+    """
+    def get_or_create_node(self, study, assay, type, name):
+        return Node.objects.get_or_create(study=study, assay=assay, type=type,
+                                          name=name)
+
+    def create_node(self, study, assay, type, name):
+        return Node.objects.create(study=study, assay=assay, type=type,
+                                   name=name)
+
+    def add_file(self, node, source):
+        node.file_item = FileStoreItem.objects.create(source=source)
+        node.save()
+
+    def add_edge(self, parent, child):
+        # add() ignores existing edges
+        parent.children.add(child)
+        child.parents.add(parent)
+
+    def has_attribute(self, node, type, value, subtype=None):
+        attributes = node.attribute_set.filter(type=type, value=value)
+        if subtype is not None:
+            attributes = attributes.filter(subtype=subtype)
+        return attributes.exists()
+
+    def add_attribute(self, node, **fields):
+        return Attribute.objects.create(node=node, **fields)
+
+    def get_protocol(self, study, name):
+        try:
+            return study.protocol_set.get(name=name)
+        except (Protocol.DoesNotExist, Protocol.MultipleObjectsReturned):
+            return None
+
+    def create_protocol(self, study, name):
+        return Protocol.objects.get_or_create(name=name, study=study)[0]
+
+    def add_protocol_reference(self, node, protocol, parameters, **fields):
+        protocol_reference = ProtocolReference.objects.create(
+            node=node, protocol=protocol, **fields
+        )
+        for parameter in parameters:
+            ProtocolReferenceParameter.objects.create(
+                protocol_reference=protocol_reference, **parameter
+            )
+        return protocol_reference
+
+    def write(self):
+        pass
+
+
+class NodeRecord(object):
+    """In-memory representation of a node parsed from a study or assay file
+    """
+    def __init__(self, study, assay, type, name):
+        self.study = study
+        self.assay = assay
+        self.type = type
+        self.name = name
+        self.file_source = None
+        self.attributes = []
+        self.attribute_keys = set()
+        self.protocol_references = []
+        self.node = None  # Node instance once the graph has been written
+
+    def __str__(self):
+        return "{}: {}".format(self.type, self.name)
+
+
+class InMemoryNodeGraph(object):
+    """Collects the experiment graph parsed from study and assay files in
+    memory, de-duplicating nodes, edges and attributes the same way as
+    DatabaseNodeGraph, and writes it to the database with bulk inserts
+    """
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self._nodes = []
+        self._node_lookup = {}
+        self._edges = []
+        self._edge_lookup = set()
+        self._protocols = {}
+
+    def get_or_create_node(self, study, assay, type, name):
+        key = (study.id, assay.id if assay else None, type, name)
+        try:
+            return self._node_lookup[key], False
+        except KeyError:
+            node = self.create_node(study, assay, type, name)
+            self._node_lookup[key] = node
+            return node, True
+
+    def create_node(self, study, assay, type, name):
+        node = NodeRecord(study, assay, type, name)
+        self._nodes.append(node)
+        return node
+
+    def add_file(self, node, source):
+        node.file_source = source
+
+    def add_edge(self, parent, child):
+        if (parent, child) not in self._edge_lookup:
+            self._edge_lookup.add((parent, child))
+            self._edges.append((parent, child))
+
+    def has_attribute(self, node, type, value, subtype=None):
+        return (type, value, subtype) in node.attribute_keys
+
+    def add_attribute(self, node, **fields):
+        node.attributes.append(fields)
+        # attributes without subtype match existing attributes regardless of
+        # their subtype
+        node.attribute_keys.add((fields["type"], fields["value"], None))
+        if fields.get("subtype") is not None:
+            node.attribute_keys.add(
+                (fields["type"], fields["value"], fields["subtype"])
+            )
+        return fields
+
+    def get_protocol(self, study, name):
+        if study.id not in self._protocols:
+            self._protocols[study.id] = {}
+            for protocol in study.protocol_set.all():
+                self._protocols[study.id].setdefault(protocol.name, protocol)
+        return self._protocols[study.id].get(name)
+
+    def create_protocol(self, study, name):
+        protocol = Protocol.objects.create(name=name, study=study)
+        self._protocols[study.id][name] = protocol
+        return protocol
+
+    def add_protocol_reference(self, node, protocol, parameters, **fields):
+        fields["protocol"] = protocol
+        node.protocol_references.append((fields, parameters))
+        return fields
+
+    def write(self):
+        """Insert all collected nodes, edges, attributes and protocol
+        references with a constant number of queries per batch
+        """
+        file_nodes = [node for node in self._nodes
+                      if node.file_source is not None]
+        file_items = bulk_create_file_store_items(
+            [node.file_source for node in file_nodes],
+            batch_size=self.batch_size
+        )
+        file_item_lookup = dict(zip(file_nodes, file_items))
+
+        for node in self._nodes:
+            node.node = Node(uuid=str(uuid.uuid4()), study=node.study,
+                             assay=node.assay, type=node.type,
+                             name=node.name,
+                             file_item=file_item_lookup.get(node))
+        Node.objects.bulk_create([node.node for node in self._nodes],
+                                 batch_size=self.batch_size)
+        # bulk_create() does not set primary keys
+        node_ids = {}
+        for start in range(0, len(self._nodes), self.batch_size):
+            node_ids.update(Node.objects.filter(uuid__in=[
+                node.node.uuid
+                for node in self._nodes[start:start + self.batch_size]
+            ]).values_list('uuid', 'id'))
+        for node in self._nodes:
+            node.node.id = node_ids[node.node.uuid]
+
+        # edges are stored in both directions (see Node.add_child())
+        Node.parents.through.objects.bulk_create([
+            Node.parents.through(from_node_id=child.node.id,
+                                 to_node_id=parent.node.id)
+            for parent, child in self._edges
+        ], batch_size=self.batch_size)
+        Node.children.through.objects.bulk_create([
+            Node.children.through(from_node_id=parent.node.id,
+                                  to_node_id=child.node.id)
+            for parent, child in self._edges
+        ], batch_size=self.batch_size)
+
+        Attribute.objects.bulk_create([
+            Attribute(node_id=node.node.id, **fields)
+            for node in self._nodes for fields in node.attributes
+        ], batch_size=self.batch_size)
+
+        protocol_references = [
+            (ProtocolReference(node_id=node.node.id, **fields), parameters)
+            for node in self._nodes
+            for fields, parameters in node.protocol_references
+        ]
+        ProtocolReference.objects.bulk_create(
+            [protocol_reference for protocol_reference, _
+             in protocol_references],
+            batch_size=self.batch_size
+        )
+        if any(parameters for _, parameters in protocol_references):
+            # the nodes have been created by this graph so all of their
+            # protocol references are new: match them by node and protocol
+            # (and in insert order if a node references a protocol twice)
+            node_ids = sorted({protocol_reference.node_id
+                               for protocol_reference, parameters
+                               in protocol_references if parameters})
+            protocol_reference_ids = defaultdict(deque)
+            for start in range(0, len(node_ids), self.batch_size):
+                for protocol_reference_id, node_id, protocol_id in \
+                        ProtocolReference.objects.filter(
+                            node_id__in=node_ids[start:start + self.batch_size]
+                        ).order_by('id').values_list('id', 'node_id',
+                                                     'protocol_id'):
+                    protocol_reference_ids[(node_id, protocol_id)].append(
+                        protocol_reference_id
+                    )
+            protocol_reference_parameters = []
+            for protocol_reference, parameters in protocol_references:
+                key = (protocol_reference.node_id,
+                       protocol_reference.protocol_id)
+                if key not in protocol_reference_ids:
+                    continue
+                protocol_reference_id = protocol_reference_ids[key].popleft()
+                protocol_reference_parameters.extend(
+                    ProtocolReferenceParameter(
+                        protocol_reference_id=protocol_reference_id,
+                        **parameter
+                    )
+                    for parameter in parameters
+                )
+            ProtocolReferenceParameter.objects.bulk_create(
+                protocol_reference_parameters, batch_size=self.batch_size
+            )
+        logger.info("Created %s nodes, %s edges and %s protocol references",
+                    len(self._nodes), len(self._edges),
+                    len(protocol_references))
+
+
 class IsaTabParser:
     # TODO: use these where appropriate
     SEPARATOR_CHARACTER = "\t"
@@ -255,7 +586,11 @@ class IsaTabParser:
     }
 
     def __init__(self, file_source_translator,
-                 additional_raw_data_file_extension=None):
+                 additional_raw_data_file_extension=None, bulk_create=True):
+        """bulk_create: collect the experiment graph in memory and write it
+        with bulk inserts once all study and assay files have been parsed
+        instead of writing every node, edge and attribute as it is parsed
+        """
         self.file_source_translator = file_source_translator
         # TODO: remove this temporary fix to deal with ISA-Tab from
         # ArrayExpress (see also _parse_node)
@@ -271,10 +606,18 @@ class IsaTabParser:
         self._current_node = None
         self._previous_node = None
         self._current_attribute = None
-        self._current_protocol_reference = None
+        self._current_protocol_reference_parameters = None
         self._current_reader = None
         self._current_file = None
         self._current_file_name = None
+        self._archive = None
+        self.bulk_create = bulk_create
+        self._graph = self._create_graph()
+
+    def _create_graph(self):
+        if self.bulk_create:
+            return InMemoryNodeGraph()
+        return DatabaseNodeGraph()
 
     def _split_header(self, header):
         return [x.strip() for x in header.replace("]", "").strip().split("[")]
@@ -309,36 +652,32 @@ class IsaTabParser:
                 len(node_name) > 0) or \
                 (header_components[0] in Node.FILES and len(node_name) > 0):
             if header_components[0] in {Node.SAMPLE, Node.SOURCE}:
-                node, is_new = Node.objects.get_or_create(
-                    study=self._current_study,
-                    type=header_components[0],
-                    name=node_name)
+                node, is_new = self._graph.get_or_create_node(
+                    self._current_study, None, header_components[0],
+                    node_name)
             else:
-                node, is_new = Node.objects.get_or_create(
-                    study=self._current_study,
-                    assay=self._current_assay,
-                    type=header_components[0],
-                    name=node_name)
+                node, is_new = self._graph.get_or_create_node(
+                    self._current_study, self._current_assay,
+                    header_components[0], node_name)
             # this node represents a file - add the file to the file store and
             # store the file UUID in the node
             if (is_new and
                     header_components[0] in Node.FILES and
                     node_name is not ""):
                 # create the nodes for the data file in this row
-                node.file_item = FileStoreItem.objects.create(
-                    source=self.file_source_translator(node_name)
+                self._graph.add_file(
+                    node, self.file_source_translator(node_name)
                 )
-                node.save()
             if is_new:
                 logger.info("New node %s created", str(node))
             else:
                 logger.info("Node %s retrieved", str(node))
         else:
             if len(node_name) > 0:
-                node = Node.objects.create(study=self._current_study,
-                                           assay=self._current_assay,
-                                           type=header_components[0],
-                                           name=node_name)
+                node = self._graph.create_node(self._current_study,
+                                               self._current_assay,
+                                               header_components[0],
+                                               node_name)
             else:
                 # do not create empty nodes!
                 node = None
@@ -346,15 +685,7 @@ class IsaTabParser:
         self._current_node = node
 
         if self._previous_node is not None and self._current_node is not None:
-            try:
-                # test if the node has already been created (??? why not use an
-                # if statement ???)
-                node.parents.get(to_node_id=self._previous_node.id)
-            except:
-                self._previous_node.children.add(node)
-                node.parents.add(self._previous_node)
-                node.save()
-                self._previous_node.save()
+            self._graph.add_edge(self._previous_node, node)
         else:
             # TODO: look up parent nodes in DB
             pass
@@ -381,7 +712,6 @@ class IsaTabParser:
                 # can't be attached to anything
                 row.popleft()
         if self._current_node is not None:
-            node.save()
             self._previous_node = node
             self._current_node = None
 
@@ -402,30 +732,19 @@ class IsaTabParser:
 
         # test if the current node already has an attribute with these
         # properties
-        has_attribute = False
-
-        if len(header_components) > 1:
-            if self._current_node.attribute_set.filter(
-                    type=header_components[0],
-                    value=row[0],
-                    subtype=header_components[1]
-            ).count() > 0:
-                has_attribute = True
-        else:
-            if self._current_node.attribute_set.filter(
-                    type=header_components[0],
-                    value=row[0]
-            ).count() > 0:
-                has_attribute = True
+        has_attribute = self._graph.has_attribute(
+            self._current_node, header_components[0], row[0],
+            header_components[1] if len(header_components) > 1 else None
+        )
         # add attribute if it does not exist yet
         if not has_attribute:
-            attribute = Attribute.objects.create(node=self._current_node)
-            attribute.study = self._current_study
-            attribute.type = header_components[0]
-            attribute.value = row[0]
+            attribute = {
+                "type": header_components[0],
+                "value": row[0]
+            }
 
             if len(header_components) > 1:
-                attribute.subtype = header_components[1]
+                attribute["subtype"] = header_components[1]
 
             # TODO: deal with the "order" case (see ISA-Tab Spec 5.4.2)
 
@@ -435,8 +754,8 @@ class IsaTabParser:
         if self.is_term_information(headers[-len(row)]):
             if not has_attribute:
                 term_information = self._parse_term_information(headers, row)
-                attribute.value_accession = term_information["accession"]
-                attribute.value_source = term_information["source"]
+                attribute["value_accession"] = term_information["accession"]
+                attribute["value_source"] = term_information["source"]
             else:
                 row.popleft()
                 row.popleft()
@@ -444,9 +763,9 @@ class IsaTabParser:
         if self.is_unit(headers[-len(row)]):
             if not has_attribute:
                 unit_information = self._parse_unit_information(headers, row)
-                attribute.value_unit = unit_information["unit"]
-                attribute.value_accession = unit_information["accession"]
-                attribute.value_source = unit_information["source"]
+                attribute["value_unit"] = unit_information["unit"]
+                attribute["value_accession"] = unit_information["accession"]
+                attribute["value_source"] = unit_information["source"]
             else:
                 row.popleft()
                 if (len(row) > 1 and
@@ -456,8 +775,7 @@ class IsaTabParser:
 
         if not has_attribute:
             # done
-            attribute.save()
-            return attribute
+            return self._graph.add_attribute(self._current_node, **attribute)
 
         # remove the attribute from the row
         return None
@@ -466,14 +784,11 @@ class IsaTabParser:
 
         if self.is_protocol_reference(headers[-len(row)]):
 
-            try:
-                protocol = self._current_study.protocol_set.get(name=row[0])
-                # if protocol is None:
-            except:
+            protocol = self._graph.get_protocol(self._current_study, row[0])
+            if protocol is None:
                 if self.ignore_missing_protocols:
-                    protocol, is_created = Protocol.objects.get_or_create(
-                        name=row[0],
-                        study=self._current_study)
+                    protocol = self._graph.create_protocol(
+                        self._current_study, row[0])
                     logger.info(
                         "Undeclared protocol " + row[0] + " when parsing term "
                         "protocol in line " +
@@ -492,10 +807,9 @@ class IsaTabParser:
                         )
                     )
 
-            protocol_reference = ProtocolReference.objects.create(
-                node=self._current_node,
-                protocol=protocol)
-            self._current_protocol_reference = protocol_reference
+            protocol_reference = {}
+            parameters = []
+            self._current_protocol_reference_parameters = parameters
 
             row.popleft()
 
@@ -504,18 +818,19 @@ class IsaTabParser:
                 if self.is_protocol_reference_parameter(headers[-len(row)]):
                     self._parse_protocol_reference_parameter(headers, row)
                 elif self.is_protocol_reference_performer(headers[-len(row)]):
-                    protocol_reference.performer = row[0]
+                    protocol_reference["performer"] = row[0]
                     row.popleft()
                     # TODO: lookup performer uuid from user database
                 elif self.is_protocol_reference_date(headers[-len(row)]):
-                    protocol_reference.date = row[0]
+                    protocol_reference["date"] = row[0]
                     row.popleft()
                     # TODO: lookup performer uuid from user database
                 else:
                     pass
 
-            protocol_reference.save()
-            return protocol_reference
+            return self._graph.add_protocol_reference(
+                self._current_node, protocol, parameters, **protocol_reference
+            )
 
     def _parse_protocol_reference_parameter(self, headers, row):
         header_components = self._split_header(headers[-len(row)])
@@ -525,10 +840,10 @@ class IsaTabParser:
         # ISA-Tab Spec 5.4.2)
         # assert(len(header_components)) > 1 and <= 3
 
-        parameter = ProtocolReferenceParameter.objects.create(
-            protocol_reference=self._current_protocol_reference)
-        parameter.name = header_components[1]
-        parameter.value = row[0]
+        parameter = {
+            "name": header_components[1],
+            "value": row[0]
+        }
 
         # TODO: deal with the "order" case (see ISA-Tab Spec 5.4.2)
 
@@ -537,15 +852,15 @@ class IsaTabParser:
 
         if self.is_term_information(headers[-len(row)]):
             term_information = self._parse_term_information(headers, row)
-            parameter.value_accession = term_information["accession"]
-            parameter.value_source = term_information["source"]
+            parameter["value_accession"] = term_information["accession"]
+            parameter["value_source"] = term_information["source"]
         if self.is_unit(headers[-len(row)]):
             unit_information = self._parse_unit_information(headers, row)
-            parameter.value_unit = unit_information["unit"]
-            parameter.value_accession = unit_information["accession"]
-            parameter.value_source = unit_information["source"]
+            parameter["value_unit"] = unit_information["unit"]
+            parameter["value_accession"] = unit_information["accession"]
+            parameter["value_source"] = unit_information["source"]
         # done
-        parameter.save()
+        self._current_protocol_reference_parameters.append(parameter)
         return parameter
 
     def _parse_term_information(self, headers, row):
@@ -638,28 +953,60 @@ class IsaTabParser:
     def _parse_study_file(self, study, file_name):
         self._current_file_name = file_name
         self._current_study = study
-        self._current_file = open(file_name, "rU")
-        self._current_reader = csv.reader(self._current_file,
-                                          dialect="excel-tab")
-        # read column headers
-        headers = []
-        headers = next(self._current_reader)
+        with self._archive.open(file_name) as self._current_file:
+            self._current_reader = csv.reader(self._current_file,
+                                              dialect="excel-tab")
+            rows = self._trim_empty_columns(self._current_reader)
+            # read column headers
+            headers = next(rows)
 
-        try:
-            headers.remove("")
-        except:
-            pass
+            try:
+                headers.remove("")
+            except:
+                pass
 
-        # TODO: check if all factor values used in this file have been declared
+            # TODO: check if all factor values used in this file have been
+            # declared
 
-        for row in self._current_reader:
+            for row in rows:
 
-            row = deque(row)
-            self._previous_node = None
+                row = deque(row)
+                self._previous_node = None
 
-            while len(row) > 0:
-                self._current_node = None
-                self._parse_node(headers, row)
+                while len(row) > 0:
+                    self._current_node = None
+                    self._parse_node(headers, row)
+
+    def _trim_empty_columns(self, reader):
+        """Yields the header and rows of a study or assay file without the
+        empty columns at the end of the header (e.g. from trailing tabs) and
+        the corresponding cells of each row
+        """
+        header = next(reader)
+        num_empty_columns = len([item for item in header if not item.strip()])
+        if num_empty_columns == 0:
+            yield header
+            for row in reader:
+                yield row
+            return
+        logger.info("Empty columns in header of %s present, trimming",
+                    self._current_file_name)
+        num_columns = len(header) - num_empty_columns
+        yield header[:num_columns]
+        for row in reader:
+            if len(row) < num_columns:
+                raise ParserException(
+                    "Line {} in {} has fewer fields than the header.".format(
+                        reader.line_num, self._current_file_name
+                    )
+                )
+            if any(item.strip() for item in row[num_columns:]):
+                raise ParserException(
+                    "Found a value in line {} of {} where an empty column "
+                    "was expected.".format(reader.line_num,
+                                           self._current_file_name)
+                )
+            yield row[:num_columns]
 
     def _create_investigation_file_section_model(self, section_title, fields):
         try:
@@ -748,13 +1095,9 @@ class IsaTabParser:
         while True:
             # 1. try to read the next line from the file
             try:
-                start_position = self._current_file.tell()
-                line = (
-                    self._current_file.readline().rstrip("\n")
-                )
-                end_position = self._current_file.tell()
+                line = self._current_file.readline()
 
-                if end_position - start_position == 0:
+                if not line:
                     # the EOF was found, stop reading and create model for
                     # section
                     self._create_investigation_file_section_model(
@@ -762,6 +1105,7 @@ class IsaTabParser:
                         fields
                     )
                     return None
+                line = line.rstrip("\n")
             except:
                 return None
             # 2. skip empty lines (ignoring all whitespace characters)
@@ -838,15 +1182,12 @@ class IsaTabParser:
         multiline_field = ""
         while True:
             try:
-                start_position = self._current_file.tell()
-                line = (
-                    self._current_file.readline().rstrip("\n")
-                )
-                end_position = self._current_file.tell()
+                line = self._current_file.readline()
 
-                if end_position - start_position == 0:
+                if not line:
                     # EOF reached
                     return None
+                line = line.rstrip("\n")
             except:
                 raise ParserException(
                     "End of file reached in multiline field in " +
@@ -861,27 +1202,24 @@ class IsaTabParser:
                 return multiline_field, multiline_columns[1:]
 
     def _parse_investigation_file(self, file_name):
-
         self._current_file_name = file_name
-        self._current_file = open(file_name, 'r',
-                                  newline='', encoding='latin-1')
+        with self._archive.open(file_name,
+                                encoding='latin-1') as self._current_file:
+            self._parse_investigation_sections()
 
+    def _parse_investigation_sections(self):
         section_title = None
 
         # read lines from the file until a section title is found
         while True:
             # 1. try to read the next line from the file
             try:
-                start_position = self._current_file.tell()
-                line = (
-                    self._current_file.readline().rstrip("\n")
-                )
-                end_position = self._current_file.tell()
+                line = self._current_file.readline()
 
-                if end_position - start_position == 0:
+                if not line:
                     # EOF reached
                     return None
-
+                line = line.rstrip("\n")
             except:
                 return None
 
@@ -920,89 +1258,45 @@ class IsaTabParser:
         the archive extracts into a subdirectory named <archive> if the
         ISArchive is called <archive>.zip.
         """
-        # 1. test if archive needs to be extracted and extract if necessary
+        # 1. open the archive (ZIP members are read without extracting them)
         if not os.path.isdir(path):
             # assign to isa_archive if it's an archive anyway
             isa_archive = path
-            logger.info(
-                "Supplied path \"" + path + "\" is not a directory. Assuming "
-                "ISArchive file.")
-            try:
-                # TODO: do we need a random subdirectory here?
-                extract_path = tempfile.mkdtemp()
-                with ZipFile(path, 'r') as zip:
-                    # test if any paths are relative or absolute and outside
-                    # the extract path
-                    for name in zip.namelist():
-                        if name.startswith("..") or name.startswith("/"):
-                            raise ParserException(
-                                "Unable to extract assumed ISArchive "
-                                "file {!r} due to illegal file path: {}"
-                                .format(path, name)
-                            )
-                    # extract archive
-                    zip.extractall(extract_path)
-                    first_file = zip.namelist()[0]
-                    # test if first entry in zip file is a path
-                    if first_file.endswith("/"):
-                        # add archive subdirectory to path
-                        extract_path = os.path.join(extract_path, first_file)
-                    elif re.search(r'/', first_file):
-                        ind = string.find(first_file, '/')
-                        extract_path = os.path.join(
-                            extract_path,
-                            first_file[:ind]
-                        )
-
-                    logger.info(
-                        "ISArchive extracted to \"" + extract_path + "\"."
-                    )
-                    path = extract_path
-            except:
+        with IsaTabArchive(path) as self._archive:
+            # 2. identify investigation file
+            investigation_file_name = self._archive.find_investigation_file()
+            if investigation_file_name is None:
                 raise ParserException(
-                    "Unable to extract assumed ISArchive file {!r}."
-                    .format(path)
+                    "Unable to identify ISArchive file in {!r}.".format(path)
                 )
-        # 2. identify investigation file
-        try:
-            investigation_file_name = glob.glob("%s/i*.txt" % path).pop()
-        except IndexError as exception:
-            raise ParserException(
-                "Unable to identify ISArchive file in {!r} {}.".format(
-                    path,
-                    exception
+            # 3. parse investigation file and identify study files and
+            # corresponding assay files
+            self._parse_investigation_file(investigation_file_name)
+            # 4. parse all study files and corresponding assay files
+            if self._current_investigation is None:
+                raise ParserException(
+                    "No investigation was identified when parsing "
+                    "investigation file \"" + investigation_file_name + "\""
                 )
-            )
-        # 3. parse investigation file and identify study files and
-        # corresponding assay files
-        self._parse_investigation_file(investigation_file_name)
-        # 4. parse all study files and corresponding assay files
-        if self._current_investigation is not None:
+            self._graph = self._create_graph()
             # identify studies associated with this investigation
             for study in self._current_investigation.study_set.all():
                 # parse study file
                 self._current_assay = None
-                study_file_name = os.path.join(path, study.file_name)
-                if fix_last_column(study_file_name):
-                    self._parse_study_file(study, study_file_name)
-                    for assay in study.assay_set.all():
-                        # parse assay file
-                        self._previous_node = None
-                        assay_file_name = os.path.join(path, assay.file_name)
-                        if fix_last_column(assay_file_name):
-                            self._parse_assay_file(study, assay,
-                                                   assay_file_name)
-        else:
-            raise ParserException(
-                "No investigation was identified when parsing investigation "
-                "file \"" + investigation_file_name + "\""
-            )
+                self._parse_study_file(study, study.file_name)
+                for assay in study.assay_set.all():
+                    # parse assay file
+                    self._previous_node = None
+                    self._parse_assay_file(study, assay, assay.file_name)
+            self._graph.write()
+        self._archive = None
         # 5. assign ISA-Tab archive and pre-ISA-Tab archive if present
         if isa_archive:
             file_store_item = FileStoreItem.objects.create(source=isa_archive)
             self._current_investigation.isarchive_file = file_store_item.uuid
             try:
                 with open(isa_archive, 'rb') as isa_archive_obj:
+                    _set_checksums(file_store_item, isa_archive_obj)
                     file_store_item.datafile.save(
                         os.path.basename(isa_archive), File(isa_archive_obj)
                     )
@@ -1020,6 +1314,7 @@ class IsaTabParser:
                 file_store_item.uuid
             try:
                 with open(isa_archive, 'rb') as preisa_archive_obj:
+                    _set_checksums(file_store_item, preisa_archive_obj)
                     file_store_item.datafile.save(
                         os.path.basename(isa_archive), File(preisa_archive_obj)
                     )
@@ -1109,58 +1404,22 @@ class IsaTabParser:
         return self.is_term_accession(string) or self.is_term_source(string)
 
     def get_dataset_name(self, path):
-        if not os.path.isdir(path):
-            logger.info(
-                "Supplied path \"" + path + "\" is not a directory. Assuming "
-                "ISArchive file.")
-            try:
-                # TODO: do we need a random subdirectory here?
-                extract_path = tempfile.mkdtemp()
-                with ZipFile(path, 'r') as zip:
-                    # test if any paths are relative or absolute and outside
-                    # the extract path
-                    for name in zip.namelist():
-                        if name.startswith("..") or name.startswith("/"):
-                            raise ParserException(
-                                "Unable to extract assumed ISArchive "
-                                "file {!r} due to illegal file path: {!r}"
-                                .format(path, name)
-                            )
-                    # extract archive
-                    zip.extractall(extract_path)
-
-                    first_file = zip.namelist()[0]
-                    # test if first entry in zip file is a path
-                    if first_file.endswith("/"):
-                        # add archive subdirectory to path
-                        extract_path = os.path.join(extract_path, first_file)
-                    elif re.search(r'/', first_file):
-                        ind = string.find(first_file, '/')
-                        extract_path = os.path.join(
-                            extract_path,
-                            first_file[:ind]
-                        )
-
-                    logger.info(
-                        "ISArchive extracted to \"" + extract_path + "\"."
-                    )
-                    path = extract_path
-            except:
+        with IsaTabArchive(path) as archive:
+            investigation_file_name = archive.find_investigation_file()
+            if investigation_file_name is None:
                 raise ParserException(
-                    "Unable to extract assumed ISArchive file {!r}."
-                    .format(path)
+                    "Unable to identify ISArchive file in {!r}.".format(path)
                 )
-
-        # 2. identify investigation file
-        try:
-            investigation_file_name = glob.glob("%s/i*.txt" % path).pop()
-        except IndexError:
-            raise ParserException(
-                "Unable to identify ISArchive file in {!r}.".format(path)
-            )
-
-        logger.info("Investigation file path: %s", investigation_file_name)
-
+            logger.info("Investigation file path: %s",
+                        investigation_file_name)
+            with archive.open(investigation_file_name,
+                              encoding='latin-1') as f:
+                return self._get_dataset_name(f)
+
+    def _get_dataset_name(self, investigation_file):
+        """Returns the identifier and title of the investigation or of the
+        first study if the investigation has none
+        """
         identifier = None
         study_id = True
         investigation_id = True
@@ -1168,49 +1427,48 @@ class IsaTabParser:
         investigation_title = True
         title = None
 
-        with open(investigation_file_name, 'r', encoding='latin-1') as f:
-            for line in f:
-                line = line.strip('\n')
-                if not identifier and \
-                   investigation_id and \
-                   line.startswith("Investigation Identifier"):
-                    try:
-                        identifier = line.split('\t')[1].strip(' "')
-                    except IndexError:
-                        pass
-                    investigation_id = False
-                if not identifier and \
-                   not investigation_id and \
-                   study_id and \
-                   line.startswith("Study Identifier"):
-                    try:
-                        identifier = line.split('\t')[1].strip(' "')
-                    except IndexError:
-                        pass
-                    study_id = False
-                if not title and \
-                   investigation_title and \
-                   line.startswith("Investigation Title"):
-                    try:
-                        title = line.split('\t')[1].strip(' "')
-                    except IndexError:
-                        pass
-                    investigation_title = False
-                if not title and \
-                   not investigation_title and \
-                   line.startswith("Study Title"):
-                    try:
-                        title = line.split('\t')[1].strip(' "')
-                    except IndexError:
-                        pass
-                    study_title = False
-                if ((identifier and title) or
-                    (not (
-                        study_id or
-                        study_title or
-                        investigation_id or
-                        investigation_title))):
-                    return (identifier, title)
+        for line in investigation_file:
+            line = line.strip('\n')
+            if not identifier and \
+               investigation_id and \
+               line.startswith("Investigation Identifier"):
+                try:
+                    identifier = line.split('\t')[1].strip(' "')
+                except IndexError:
+                    pass
+                investigation_id = False
+            if not identifier and \
+               not investigation_id and \
+               study_id and \
+               line.startswith("Study Identifier"):
+                try:
+                    identifier = line.split('\t')[1].strip(' "')
+                except IndexError:
+                    pass
+                study_id = False
+            if not title and \
+               investigation_title and \
+               line.startswith("Investigation Title"):
+                try:
+                    title = line.split('\t')[1].strip(' "')
+                except IndexError:
+                    pass
+                investigation_title = False
+            if not title and \
+               not investigation_title and \
+               line.startswith("Study Title"):
+                try:
+                    title = line.split('\t')[1].strip(' "')
+                except IndexError:
+                    pass
+                study_title = False
+            if ((identifier and title) or
+                (not (
+                    study_id or
+                    study_title or
+                    investigation_id or
+                    investigation_title))):
+                return (identifier, title)
         return (None, None)
 
     def _adjust_string_case(self, string):
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import (Assay, _get_facet_attributes, _is_facet_attribute,
+                       _is_ignored_attribute, _query_solr)
+
+
+class Command(BaseCommand):
+    help = """Benchmarks the Solr queries used to decide which attributes of
+    an indexed assay are used as facets by default: one faceted query per
+    attribute versus a single JSON facet query for all attributes
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('assay_uuid')
+
+    def handle(self, assay_uuid, **options):
+        try:
+            assay = Assay.objects.get(uuid=assay_uuid)
+        except (Assay.DoesNotExist, Assay.MultipleObjectsReturned,
+                ValueError) as exc:
+            raise CommandError("Couldn't fetch Assay {}: {}".format(
+                assay_uuid, exc))
+        study = assay.study
+
+        try:
+            results = _query_solr(study=study, assay=assay)
+        except ValueError as exc:
+            raise CommandError("Assay {} is not indexed: {}".format(
+                assay_uuid, exc))
+        attributes = [key for key in results['response']['docs'][0]
+                      if not _is_ignored_attribute(key)]
+        self.stdout.write("{} attributes of {} indexed nodes".format(
+            len(attributes), results['response']['numFound']))
+
+        start = time.time()
+        per_attribute = set(attribute for attribute in attributes
+                            if _is_facet_attribute(attribute, study, assay))
+        per_attribute_time = time.time() - start
+        self.stdout.write("{} requests: {:.3f} sec".format(
+            len(attributes), per_attribute_time))
+
+        start = time.time()
+        single_request = _get_facet_attributes(
+            attributes, study, assay, results['response']['numFound'])
+        single_request_time = time.time() - start
+        self.stdout.write("1 request: {:.3f} sec".format(single_request_time))
+
+        for attribute in sorted(per_attribute ^ single_request):
+            self.stdout.write(
+                "Facet decision differs for '{}' (values that only occur in "
+                "other assays are counted by the per attribute "
+                "query)".format(attribute)
+            )
@@ -0,0 +1,136 @@
+import random
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...utils import (_get_unique_parent_attributes,
+                      _propagate_parent_attributes)
+
+
+def generate_synthetic_nodes(num_nodes, num_layers=6, fan_in=2,
+                             attributes_per_node=3, seed=0):
+    """Generates an experiment graph in the format returned by
+    _retrieve_nodes(): num_layers layers of nodes (Source -> ... -> files)
+    where each node below the first layer has up to fan_in randomly chosen
+    parents in the layer above, which creates diamond-shaped ancestries
+    """
+    rng = random.Random(seed)
+    layer_size = max(num_nodes // num_layers, 1)
+    nodes = {}
+    layers = []
+    attribute_id = 0
+    node_id = 0
+    for layer in range(num_layers):
+        layer_ids = []
+        for _ in range(layer_size):
+            node_id += 1
+            attributes = []
+            for index in range(attributes_per_node):
+                attribute_id += 1
+                attributes.append((
+                    attribute_id, 'Characteristics',
+                    'layer {} attribute {}'.format(layer, index),
+                    'value {}'.format(rng.randint(0, 9)), None, None, None,
+                    node_id
+                ))
+            parents = []
+            if layers:
+                parents = list(set(
+                    rng.choice(layers[-1])
+                    for _ in range(min(fan_in, len(layers[-1])))
+                ))
+            nodes[node_id] = {
+                'id': node_id,
+                'uuid': None,
+                'attributes': attributes,
+                'parents': parents,
+                'name': 'node {}'.format(node_id),
+                'type': 'Layer {}'.format(layer),
+                'file_uuid': None
+            }
+            layer_ids.append(node_id)
+        layers.append(layer_ids)
+    return nodes, layers[-1]
+
+
+class Command(BaseCommand):
+    help = """Benchmarks the memoized attribute propagation used to generate
+    AnnotatedNodes against the recursive implementation on synthetic
+    experiment graphs
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--nodes',
+            action='store',
+            default='10000,100000,1000000',
+            help='Comma-separated list of graph sizes'
+        )
+        parser.add_argument(
+            '--layers',
+            action='store',
+            type=int,
+            default=6
+        )
+        parser.add_argument(
+            '--fan_in',
+            action='store',
+            type=int,
+            default=2
+        )
+        parser.add_argument(
+            '--attributes_per_node',
+            action='store',
+            type=int,
+            default=3
+        )
+        parser.add_argument(
+            '--recursive_limit',
+            action='store',
+            type=int,
+            default=100000,
+            help='Skip the recursive implementation for larger graphs'
+        )
+
+    def handle(self, *args, **options):
+        for num_nodes in [int(n) for n in options['nodes'].split(',')]:
+            nodes, leaf_ids = generate_synthetic_nodes(
+                num_nodes, num_layers=options['layers'],
+                fan_in=options['fan_in'],
+                attributes_per_node=options['attributes_per_node']
+            )
+
+            start = time.time()
+            inherited = _propagate_parent_attributes(nodes, leaf_ids)
+            memoized_time = time.time() - start
+            self.stdout.write(
+                "{} nodes: memoized propagation of {} leaves in {:.3f} "
+                "sec".format(len(nodes), len(leaf_ids), memoized_time)
+            )
+
+            if len(nodes) > options['recursive_limit']:
+                self.stdout.write("{} nodes: skipped recursive propagation "
+                                  "(--recursive_limit)".format(len(nodes)))
+                continue
+
+            recursion_limit = sys.getrecursionlimit()
+            sys.setrecursionlimit(max(recursion_limit,
+                                      10 * options['layers']))
+            try:
+                start = time.time()
+                for leaf_id in leaf_ids:
+                    if (_get_unique_parent_attributes(nodes, leaf_id) !=
+                            inherited[leaf_id]):
+                        self.stderr.write("Results differ for node {}".format(
+                            leaf_id))
+                recursive_time = time.time() - start
+            finally:
+                sys.setrecursionlimit(recursion_limit)
+            self.stdout.write(
+                "{} nodes: recursive propagation of {} leaves in {:.3f} sec "
+                "({:.1f}x)".format(
+                    len(nodes), len(leaf_ids), recursive_time,
+                    recursive_time / memoized_time if memoized_time else 0
+                )
+            )
@@ -0,0 +1,125 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...utils import (_customize_attributes, customize_attribute_response,
+                      format_solr_response, solr_json)
+
+
+def generate_synthetic_solr_response(num_facets, num_buckets, num_docs,
+                                     seed=0):
+    """Returns the requested fields and the body of a Solr JSON facet
+    response in the format requested by generate_solr_params()
+    """
+    rng = random.Random(seed)
+    fields = ['attribute_{}_Characteristics_generic_s'.format(index)
+              for index in range(num_facets)]
+    facets = {'count': num_docs}
+    for field in fields:
+        counts = sorted((rng.randint(1, num_docs) for _ in range(num_buckets)),
+                        reverse=True)
+        facets[field] = {'buckets': [
+            {'val': 'value {}'.format(index), 'count': count}
+            for index, count in enumerate(counts)
+        ]}
+    docs = [{field: 'value {}'.format(rng.randint(0, num_buckets))
+             for field in fields} for _ in range(num_docs)]
+    body = json.dumps({
+        'responseHeader': {
+            'status': 0,
+            'params': {'json': json.dumps({'fields': fields})}
+        },
+        'response': {'numFound': num_docs, 'start': 0, 'docs': docs},
+        'facets': facets
+    }).encode()
+    return fields, body
+
+
+class Command(BaseCommand):
+    help = """Benchmarks the formatting of Solr responses with large facet
+    payloads by format_solr_response()
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--facets',
+            action='store',
+            default='10,100,500',
+            help='Comma-separated list of facet counts'
+        )
+        parser.add_argument(
+            '--buckets',
+            action='store',
+            type=int,
+            default=1000,
+            help='Number of buckets per facet'
+        )
+        parser.add_argument(
+            '--docs',
+            action='store',
+            type=int,
+            default=100
+        )
+        parser.add_argument(
+            '--repeat',
+            action='store',
+            type=int,
+            default=5
+        )
+
+    def _time(self, function, repeat):
+        """Returns the best time of repeated calls in seconds"""
+        times = []
+        for _ in range(repeat):
+            start = time.time()
+            function()
+            times.append(time.time() - start)
+        return min(times)
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        for num_facets in [int(n) for n in options['facets'].split(',')]:
+            fields, body = generate_synthetic_solr_response(
+                num_facets, options['buckets'], options['docs']
+            )
+            label = "{} facets x {} buckets ({:.1f} MB)".format(
+                num_facets, options['buckets'], len(body) / 1024.0 ** 2
+            )
+
+            json_time = self._time(lambda: json.loads(body.decode()), repeat)
+            decoder_time = self._time(
+                lambda: solr_json.loads(body.decode()), repeat
+            )
+            self.stdout.write(
+                "{}: decoding in {:.3f} sec with json, {:.3f} sec with "
+                "{}".format(label, json_time, decoder_time,
+                            solr_json.__name__)
+            )
+
+            def parse_attributes():
+                _customize_attributes.cache_clear()
+                customize_attribute_response(fields)
+
+            parse_time = self._time(parse_attributes, repeat)
+            cached_time = self._time(
+                lambda: customize_attribute_response(fields), repeat
+            )
+            self.stdout.write(
+                "{}: attributes parsed in {:.3f} sec, cached in {:.3f} "
+                "sec".format(label, parse_time, cached_time)
+            )
+
+            header_time = self._time(
+                lambda: format_solr_response(body), repeat
+            )
+            request_time = self._time(
+                lambda: format_solr_response(body, fields=fields), repeat
+            )
+            self.stdout.write(
+                "{}: formatted in {:.3f} sec with fields from the response "
+                "header, {:.3f} sec with fields from the request".format(
+                    label, header_time, request_time
+                )
+            )
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_set_manager', '0009_node_file_uuid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='investigation',
+            name='annotation_date',
+            field=models.DateTimeField(null=True, editable=False, blank=True),
+        ),
+    ]
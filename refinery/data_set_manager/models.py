@@ -5,22 +5,25 @@ Created on May 10, 2012
 '''
 import os
 from datetime import datetime
+import json
 import logging
+import math
 import uuid as uuid_lib
 
 from django.conf import settings
 from django.db import models
-from django.db.models.signals import pre_delete
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 
 from celery.result import AsyncResult
 from celery import chain
 from django_extensions.db.fields import UUIDField
-import requests
 from requests.exceptions import HTTPError
 
 import core
-from core.utils import delete_analysis_index, skip_if_test_run
+from core.solr_client import get_solr_client
+from core.utils import (bump_cache_generation, delete_analysis_index,
+                        get_cache_generation, skip_if_test_run)
 import data_set_manager
 from file_store.models import FileStoreItem
 from file_store.tasks import FileImportTask
@@ -155,6 +158,9 @@ class Contact(models.Model):
 class Investigation(NodeCollection):
     isarchive_file = UUIDField(blank=True, null=True, auto=False)
     pre_isarchive_file = UUIDField(blank=True, null=True, auto=False)
+    # set when all assays have been annotated by annotate_nodes()
+    annotation_date = models.DateTimeField(blank=True, null=True,
+                                           editable=False)
 
     """easily retrieves the proper NodeCollection fields"""
 
@@ -380,6 +386,21 @@ class Assay(models.Model):
         ).count()
 
 
+def get_assay_index_generation(assay_uuid):
+    """Returns the generation of the Solr documents and attribute order of an
+    assay that cached Solr responses of the assay are keyed by
+    """
+    return get_cache_generation('assay-index-{}'.format(assay_uuid))
+
+
+def bump_assay_index_generations(assay_uuids):
+    """Invalidates the cached Solr responses of assays after their nodes were
+    reindexed or their attribute order changed
+    """
+    for assay_uuid in set(assay_uuids):
+        bump_cache_generation('assay-index-{}'.format(assay_uuid))
+
+
 class Protocol(models.Model):
     """Study Protocol (ISA-Tab Spec 4.1.3.6)"""
     study = models.ForeignKey(Study)
@@ -767,6 +788,16 @@ class AttributeOrder(models.Model):
         ) + str(self.rank)
 
 
+@receiver(post_save, sender=AttributeOrder)
+@receiver(post_delete, sender=AttributeOrder)
+def _attribute_order_changed(sender, instance, **kwargs):
+    if instance.assay_id is None:
+        assays = Assay.objects.filter(study_id=instance.study_id)
+    else:
+        assays = Assay.objects.filter(id=instance.assay_id)
+    bump_assay_index_generations(assays.values_list('uuid', flat=True))
+
+
 class AnnotatedNodeRegistry(models.Model):
     study = models.ForeignKey(Study)
     assay = models.ForeignKey(Assay, blank=True, null=True)
@@ -840,15 +871,11 @@ def _is_ignored_attribute(attribute):
     return attribute in ["django_ct", "django_id", "id"]
 
 
-def _query_solr(study, assay, attribute=None):
+def _query_solr(study, assay, attribute=None, json_facet=None):
     types = ' OR '.join(
         '"{0}"'.format(type) for type in Node.FILES
     )
 
-    url = '{base_url}data_set_manager/select'.format(
-        base_url=settings.REFINERY_SOLR_BASE_URL
-    )
-
     params = {
         'fq': 'study_uuid:{study_uuid} AND '
               'assay_uuid: {assay_uuid} AND '
@@ -872,13 +899,22 @@ def _query_solr(study, assay, attribute=None):
             'facet.limit': '-1'
         })
 
+    if json_facet is not None:
+        params.update({
+            'json.facet': json.dumps(json_facet),
+            'rows': 0
+        })
+
     # This log tends to be massive and spams the log file. Turn on only when
     # needed.
     # logger.debug('Query parameters: %s', params)
 
     headers = {'Accept': 'application/json'}
     try:
-        response = requests.get(url, params=params, headers=headers)
+        # form data: a JSON facet of every attribute of an assay exceeds the
+        # maximum URL length
+        response = get_solr_client().post('data_set_manager', data=params,
+                                          headers=headers)
         response.raise_for_status()
     except HTTPError as e:
         logger.error(e)
@@ -917,6 +953,51 @@ def _is_facet_attribute(attribute, study, assay):
     return (attribute_values / items) < ratio
 
 
+def _get_facet_attributes(attributes, study, assay, items):
+    """Tests which attributes should be used as facets by default with a
+    single Solr request (see _is_facet_attribute()): the JSON facet API
+    returns the values of all attributes at once and the number of values is
+    capped at the threshold, so that attributes with many unique values (e.g.
+    UUIDs) don't inflate the response.
+    :param attributes: The names of the attributes.
+    :type attributes: list
+    :param items: The number of items in the data set.
+    :type items: int
+    :returns: The set of attributes that should be used as facets.
+    """
+    ratio = 0.5
+    # an attribute is a facet if it has fewer values than this
+    max_values = int(math.ceil(ratio * items))
+    # download_url custom attribute which should not be treated as a facet
+    candidates = [
+        attribute for attribute in attributes
+        if attribute != data_set_manager.search_indexes.NodeIndex.DOWNLOAD_URL
+    ]
+    if not candidates or max_values < 1:
+        return set()
+
+    # attribute names are replaced with aliases since they can contain
+    # characters that aren't allowed in facet names
+    json_facet = {}
+    for index, attribute in enumerate(candidates):
+        json_facet['attribute_{}'.format(index)] = {
+            'type': 'terms',
+            'field': attribute,
+            'limit': max_values,
+            'mincount': 1
+        }
+    results = _query_solr(study=study, assay=assay, json_facet=json_facet)
+    facets = results.get('facets', {})
+
+    facet_attributes = set()
+    for index, attribute in enumerate(candidates):
+        buckets = facets.get('attribute_{}'.format(index), {}).get('buckets',
+                                                                   [])
+        if len(buckets) < max_values:
+            facet_attributes.add(attribute)
+    return facet_attributes
+
+
 @skip_if_test_run
 def initialize_attribute_order(study, assay):
     """Initializes the AttributeOrder table after all nodes for the given study
@@ -928,10 +1009,15 @@ def initialize_attribute_order(study, assay):
     :returns: Number of attributes that were indexed.
     """
     results = _query_solr(study=study, assay=assay)
+    facet_attributes = _get_facet_attributes(
+        [key for key in results['response']['docs'][0]
+         if not _is_ignored_attribute(key)],
+        study, assay, results['response']['numFound']
+    )
 
     attribute_order_objects = []
     for key in results['response']['docs'][0]:
-        is_facet = _is_facet_attribute(key, study, assay)
+        is_facet = key in facet_attributes
         is_exposed = _is_exposed_attribute(key)
         is_internal = _is_internal_attribute(key)
         is_active = _is_active_attribute(key)
@@ -950,6 +1036,8 @@ def initialize_attribute_order(study, assay):
             )
     # insert AttributeOrder objects into database
     AttributeOrder.objects.bulk_create(attribute_order_objects)
+    # bulk_create() doesn't send post_save signals
+    bump_assay_index_generations([assay.uuid])
 
     return len(attribute_order_objects)
 
@@ -4,24 +4,74 @@ Created on Jul 2, 2012
 @author: nils
 '''
 
+from collections import defaultdict
 import logging
 import re
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 
 import celery
+from guardian.models import GroupObjectPermission, UserObjectPermission
 from haystack import indexes
 from haystack.exceptions import SkipDocument
+from pysolr import SolrError
 
 import constants
 import core
 from core.utils import build_absolute_url
 
-from .models import AnnotatedNode, Assay, Node
+from .models import Assay, Node, bump_assay_index_generations
 
 logger = logging.getLogger(__name__)
 
 
+def get_study_access(study_ids):
+    """Returns a dict of study ID: list of access tokens of the users
+    ('u_<id>') and groups ('g_<id>') that can read the data set of the study
+    (empty unless the study belongs to the latest investigation of its data
+    set)
+    """
+    access = {study_id: [] for study_id in study_ids}
+    study_data_sets = dict(
+        (study_id, (data_set_id, investigation_id))
+        for study_id, data_set_id, investigation_id
+        in core.models.InvestigationLink.objects.filter(
+            investigation__study__id__in=study_ids
+        ).values_list('investigation__study__id', 'data_set_id',
+                      'investigation_id')
+    )
+    if not study_data_sets:
+        return access
+    data_set_ids = set(data_set_id
+                       for data_set_id, _ in study_data_sets.values())
+    # like DataSet.get_latest_investigation_link(): the latest link wins
+    latest_investigations = dict(
+        core.models.InvestigationLink.objects.filter(
+            data_set_id__in=data_set_ids
+        ).order_by('date').values_list('data_set_id', 'investigation_id')
+    )
+    object_pks = [str(data_set_id) for data_set_id in data_set_ids]
+    permission_filter = {
+        'content_type': ContentType.objects.get_for_model(
+            core.models.DataSet
+        ),
+        'permission__codename': 'read_dataset',
+        'object_pk__in': object_pks
+    }
+    tokens = defaultdict(list)
+    for object_pk, user_id in UserObjectPermission.objects.filter(
+            **permission_filter).values_list('object_pk', 'user_id'):
+        tokens[int(object_pk)].append('u_{}'.format(user_id))
+    for object_pk, group_id in GroupObjectPermission.objects.filter(
+            **permission_filter).values_list('object_pk', 'group_id'):
+        tokens[int(object_pk)].append('g_{}'.format(group_id))
+    for study_id, (data_set_id, investigation_id) in study_data_sets.items():
+        if latest_investigations.get(data_set_id) == investigation_id:
+            access[study_id] = sorted(tokens[data_set_id])
+    return access
+
+
 class NodeIndex(indexes.SearchIndex, indexes.Indexable):
     TYPE_PREFIX = "REFINERY_TYPE"
     NAME_PREFIX = "REFINERY_NAME"
@@ -47,8 +97,18 @@ class NodeIndex(indexes.SearchIndex, indexes.Indexable):
     subanalysis = indexes.IntegerField(model_attr='subanalysis', null=True)
     workflow_output = indexes.CharField(model_attr='workflow_output',
                                         null=True)
+    # users ('u_<id>') and groups ('g_<id>') with read permission on the data
+    # set, only set for the nodes of its latest investigation
+    access = indexes.MultiValueField(null=True)
     # TODO: add modification date (based on registry)
 
+    def __init__(self):
+        super(NodeIndex, self).__init__()
+        # caches filled by prefetch() to avoid per node queries
+        self._data_set_uuids = {}  # study ID: data set UUID
+        self._analyses = {}  # analysis UUID: Analysis
+        self._access = {}  # study ID: list of access tokens
+
     def get_model(self):
         return Node
 
@@ -72,23 +132,165 @@ class NodeIndex(indexes.SearchIndex, indexes.Indexable):
                     data[key].add(assay_attr)
         return data
 
+    @staticmethod
+    def get_batch_queryset(queryset):
+        """Adds the relations required by prepare() to a Node queryset"""
+        return queryset.select_related(
+            'study', 'assay', 'file_item', 'file_item__filetype'
+        ).prefetch_related('annotatednode_set', 'workflow_node_connections')
+
+    def prefetch(self, nodes):
+        """Fetches the data sets and analyses of a batch of nodes with one
+        query each so that preparing their documents doesn't require any
+        per node queries
+        """
+        study_ids = set(node.study_id for node in nodes)
+        study_ids.difference_update(self._data_set_uuids)
+        if study_ids:
+            self._data_set_uuids.update((study_id, None)
+                                        for study_id in study_ids)
+            # ordered by version so that the latest data set wins
+            investigation_links = core.models.InvestigationLink.objects.filter(
+                investigation__study__id__in=study_ids
+            ).order_by('version').values_list('investigation__study__id',
+                                              'data_set__uuid')
+            self._data_set_uuids.update(investigation_links)
+
+        study_ids = set(node.study_id for node in nodes)
+        study_ids.difference_update(self._access)
+        if study_ids:
+            self._access.update(get_study_access(study_ids))
+
+        analysis_uuids = set(node.analysis_uuid for node in nodes
+                             if node.analysis_uuid is not None)
+        analysis_uuids.difference_update(self._analyses)
+        if analysis_uuids:
+            analyses = {}
+            for analysis in core.models.Analysis.objects.filter(
+                    uuid__in=analysis_uuids):
+                # like Node.get_analysis(): ignore ambiguous UUIDs
+                analyses[analysis.uuid] = (
+                    None if analysis.uuid in analyses else analysis
+                )
+            self._analyses.update((analysis_uuid, analyses.get(analysis_uuid))
+                                  for analysis_uuid in analysis_uuids)
+
+    def _get_data_set_uuid(self, node):
+        try:
+            return self._data_set_uuids[node.study_id]
+        except KeyError:
+            pass
+        try:
+            return node.study.get_dataset().uuid
+        except RuntimeError as e:
+            logger.warn(e)
+            return None
+
+    def prepare_access(self, node):
+        try:
+            return self._access[node.study_id]
+        except KeyError:
+            return get_study_access([node.study_id])[node.study_id]
+
+    def _get_analysis(self, node):
+        if node.analysis_uuid is None:
+            return None
+        try:
+            return self._analyses[node.analysis_uuid]
+        except KeyError:
+            return node.get_analysis()
+
+    @staticmethod
+    def get_assay_uuids(nodes):
+        """Returns the UUIDs of the assays that include nodes in their file
+        listings (study nodes are part of all assays of their study)
+        """
+        assay_uuids = set()
+        study_ids = set()
+        for node in nodes:
+            if node.assay_id is None:
+                study_ids.add(node.study_id)
+            else:
+                assay_uuids.add(node.assay.uuid)
+        if study_ids:
+            assay_uuids.update(Assay.objects.filter(
+                study_id__in=study_ids
+            ).values_list('uuid', flat=True))
+        return assay_uuids
+
+    def update_object(self, instance, using=None, **kwargs):
+        super(NodeIndex, self).update_object(instance, using=using, **kwargs)
+        bump_assay_index_generations(self.get_assay_uuids([instance]))
+
+    def remove_object(self, instance, using=None, **kwargs):
+        super(NodeIndex, self).remove_object(instance, using=using, **kwargs)
+        bump_assay_index_generations(self.get_assay_uuids([instance]))
+
+    def update_objects(self, nodes, using='data_set_manager',
+                       batch_size=None, backend=None, commit=True):
+        """Indexes nodes in batches: the relations of each batch are
+        prefetched, its documents are prepared in memory and sent to Solr with
+        a single request. The index is committed once after all batches.
+        :param nodes: Node queryset
+        :param using: name of the Haystack connection
+        :param batch_size: number of documents per request
+        :param backend: Haystack backend to send the documents with (default:
+        the backend of using)
+        :param commit: commit the index and invalidate the cached responses
+        of the assays after all batches (callers that don't commit have to
+        invalidate them once they commit)
+        :returns: number of nodes processed
+        """
+        if batch_size is None:
+            batch_size = settings.REFINERY_SOLR_INDEXING_BATCH_SIZE
+        if backend is None:
+            backend = self.get_backend(using)
+        nodes = self.get_batch_queryset(nodes.order_by('id'))
+        # don't reuse data prefetched by earlier calls
+        self._data_set_uuids = {}
+        self._analyses = {}
+        self._access = {}
+        counter = 0
+        last_id = 0
+        assay_uuids = set()
+        while True:
+            # keyset pagination keeps each batch query cheap
+            batch = list(nodes.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            self.prefetch(batch)
+            backend.update(self, batch, commit=False)
+            counter += len(batch)
+            last_id = batch[-1].id
+            assay_uuids.update(self.get_assay_uuids(batch))
+        if not commit:
+            return counter
+        if counter:
+            try:
+                backend.conn.commit()
+            except (IOError, SolrError) as exc:
+                if not backend.silently_fail:
+                    raise
+                logger.error("Failed to commit Solr index '%s': %s", using,
+                             exc)
+        # only after the commit so that no stale responses are cached under
+        # the new generation
+        bump_assay_index_generations(assay_uuids)
+        return counter
+
     @staticmethod
     def _check_skip_indexing_conditions(node):
         if node.type not in Node.INDEXED_FILES:
             raise SkipDocument()
 
-        try:
-            core.models.AnalysisNodeConnection.objects.get(
-                node=node,
-                is_refinery_file=False,
-                direction=core.models.OUTPUT_CONNECTION
-            )
-        except (core.models.AnalysisNodeConnection.DoesNotExist,
-                core.models.AnalysisNodeConnection.MultipleObjectsReturned):
-            # Not all Nodes will have an AnalysisNodeConnection
-            # and that's okay
-            pass
-        else:
+        # not all Nodes will have an AnalysisNodeConnection and that's okay
+        # (uses prefetched connections if available)
+        output_connections = [
+            connection for connection in node.workflow_node_connections.all()
+            if not connection.is_refinery_file and
+            connection.direction == core.models.OUTPUT_CONNECTION
+        ]
+        if len(output_connections) == 1:
             raise SkipDocument()
 
     # dynamic fields:
@@ -98,14 +300,13 @@ class NodeIndex(indexes.SearchIndex, indexes.Indexable):
         self._check_skip_indexing_conditions(node)
 
         data = super(NodeIndex, self).prepare(node)
-        annotations = AnnotatedNode.objects.filter(node=node)
+        # uses prefetched annotations if available
+        annotations = node.annotatednode_set.all()
         id_suffix = str(node.study.id)
 
-        try:
-            data_set = node.study.get_dataset()
-            data['data_set_uuid'] = data_set.uuid
-        except RuntimeError as e:
-            logger.warn(e)
+        data_set_uuid = self._get_data_set_uuid(node)
+        if data_set_uuid is not None:
+            data['data_set_uuid'] = data_set_uuid
 
         if node.assay is not None:
             id_suffix += "_" + str(node.assay.id)
@@ -157,6 +358,8 @@ class NodeIndex(indexes.SearchIndex, indexes.Indexable):
             datafile = node.file_item.datafile.name
             filetype = node.file_item.filetype
 
+        analysis = self._get_analysis(node)
+
         data.update({
             NodeIndex.DATAFILE: datafile,
             NodeIndex.DOWNLOAD_URL:
@@ -166,8 +369,8 @@ class NodeIndex(indexes.SearchIndex, indexes.Indexable):
             'filetype_Characteristics' + NodeIndex.GENERIC_SUFFIX: filetype,
             NodeIndex.FILETYPE_PREFIX + id_suffix: filetype,
             NodeIndex.ANALYSIS_UUID_PREFIX + id_suffix:
-                constants.NOT_AVAILABLE if node.get_analysis() is None
-                else node.get_analysis().name,
+                constants.NOT_AVAILABLE if analysis is None
+                else analysis.name,
             NodeIndex.SUBANALYSIS_PREFIX + id_suffix:
                 (-1 if node.subanalysis is None  # TODO: upgrade flake8
                  else node.subanalysis),         # and remove parentheses
@@ -46,11 +46,18 @@ class NodeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Node
 
+    # a NodeGraph of the study in the context avoids two queries per node
     def get_children(self, node):
-        return node.get_children()
+        node_graph = self.context.get('node_graph')
+        if node_graph is None:
+            return node.get_children()
+        return node_graph.child_uuids(node.id)
 
     def get_parents(self, node):
-        return node.get_parents()
+        node_graph = self.context.get('node_graph')
+        if node_graph is None:
+            return node.get_parents()
+        return node_graph.parent_uuids(node.id)
 
 
 class StudySerializer(serializers.ModelSerializer):
@@ -6,6 +6,7 @@ import time
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import transaction
+from django.utils import timezone
 
 import botocore
 import celery
@@ -14,13 +15,15 @@ import pysam
 import tempfile
 
 from core.models import DataSet, ExtendedGroup, FileStoreItem
+from core.utils import atomic_with_on_commit, on_commit
 from file_store.models import generate_file_source_translator
 from file_store.tasks import FileImportTask, download_s3_object
-from file_store.utils import delete_file
+from file_store.utils import Checksums, delete_file
 
 from .isa_tab_parser import IsaTabParser
-from .models import Investigation, Node, initialize_attribute_order
-from .utils import (calculate_checksum, get_node_types, index_annotated_nodes,
+from .models import (Assay, AttributeOrder, Investigation, Node, Study,
+                     initialize_attribute_order)
+from .utils import (get_node_types, index_annotated_nodes,
                     update_annotated_nodes)
 
 logger = logging.getLogger(__name__)
@@ -95,7 +98,8 @@ def create_dataset(investigation_uuid, username, identifier=None, title=None,
     if public:
         public_group = ExtendedGroup.objects.public_group()
         dataset.share(public_group)
-    annotate_nodes(investigation_uuid)
+    # workers only see the nodes once they have been committed
+    on_commit(annotate_nodes, investigation_uuid)
     # set dataset slug
     dataset.slug = slug
     # calculate total number of files and total number of bytes
@@ -108,42 +112,93 @@ def create_dataset(investigation_uuid, username, identifier=None, title=None,
 @task()
 def annotate_nodes(investigation_uuid):
     """Adds all nodes in this investigation to the annotated nodes table for
-    faster lookup
+    faster lookup: runs annotate_assay for each assay, spread over at most
+    REFINERY_ANNOTATION_CONCURRENCY chains of subtasks, followed by
+    finish_annotation. The annotation date of the investigation stays empty
+    if the annotation fails.
     """
     try:
         investigation = Investigation.objects.get(uuid=investigation_uuid)
-    # will fail immediately after this if DNE or MOR
     except (Investigation.DoesNotExist,
             Investigation.MultipleObjectsReturned) as e:
         logger.error(
             'Did not get Investigation for uuid %s:  %s',
             investigation_uuid, e)
+        return None
 
-    studies = investigation.study_set.all()
+    Investigation.objects.filter(uuid=investigation_uuid).update(
+        annotation_date=None
+    )
+    assays = list(
+        Assay.objects.filter(
+            study__investigation=investigation
+        ).order_by('id').values_list('study__uuid', 'uuid')
+    )
+
+    if transaction.get_connection().in_atomic_block or not assays:
+        # workers would not see nodes created in the current transaction
+        results = [annotate_assay(study_uuid, assay_uuid)
+                   for study_uuid, assay_uuid in assays]
+        return finish_annotation(results, investigation_uuid, len(assays))
+
+    chains = [[] for _ in range(
+        min(max(settings.REFINERY_ANNOTATION_CONCURRENCY, 1), len(assays))
+    )]
+    for index, (study_uuid, assay_uuid) in enumerate(assays):
+        chains[index % len(chains)].append(
+            annotate_assay.si(study_uuid, assay_uuid)
+        )
+    return celery.chord(
+        celery.group(celery.chain(*subtasks) for subtasks in chains),
+        finish_annotation.s(investigation_uuid, len(assays))
+    ).apply_async()
 
-    for study in studies:
-        assays = study.assay_set.all()
 
-        for assay in assays:
-            node_types = get_node_types(
+@task()
+def annotate_assay(study_uuid, assay_uuid):
+    """Creates and indexes the annotated nodes of all file node types of an
+    assay and initializes its attribute order. Safe to retry: annotated nodes
+    are replaced and an existing attribute order is kept.
+    Returns the number of node types annotated.
+    """
+    study = Study.objects.get(uuid=study_uuid)
+    assay = Assay.objects.get(uuid=assay_uuid)
+    node_types = get_node_types(
+        study.uuid,
+        assay.uuid,
+        files_only=True,
+        filter_set=Node.FILES
+    ) or []
+
+    with transaction.atomic():
+        for node_type in node_types:
+            update_annotated_nodes(
+                node_type,
                 study.uuid,
                 assay.uuid,
-                files_only=True,
-                filter_set=Node.FILES
+                update=True
             )
 
-            for node_type in node_types:
-                update_annotated_nodes(
-                    node_type,
-                    study.uuid,
-                    assay.uuid,
-                    update=True
-                )
+    for node_type in node_types:
+        index_annotated_nodes(node_type, study.uuid, assay.uuid)
 
-                index_annotated_nodes(node_type, study.uuid, assay.uuid)
+    # initialize attribute order for this assay
+    if not AttributeOrder.objects.filter(study=study, assay=assay).exists():
+        initialize_attribute_order(study, assay)
+    return len(node_types)
 
-            # initialize attribute order for this assay
-            initialize_attribute_order(study, assay)
+
+@task()
+def finish_annotation(results, investigation_uuid, assay_count):
+    """Records the completion of annotate_nodes() in the annotation date of
+    the investigation
+    """
+    Investigation.objects.filter(uuid=investigation_uuid).update(
+        annotation_date=timezone.now()
+    )
+    logger.info("Annotated nodes of %s assays of investigation %s",
+                assay_count, investigation_uuid)
+    return assay_count
 
 
 @task()
@@ -216,40 +271,34 @@ def parse_isatab(username, public, path, identity_id=None,
                             file_store_item = FileStoreItem.objects.get(
                                 uuid=investigation.isarchive_file
                             )
-                            logger.info("Get file: %s", file_store_item)
-                        # will fail later on when the .datafile is accessed
                         except (FileStoreItem.DoesNotExist,
                                 FileStoreItem.MultipleObjectsReturned) as e:
                             logger.error(
-                                'Did not get FileStoreItem for uuid %s',
+                                'Did not get FileStoreItem for uuid %s: %s',
                                 str(investigation.isarchive_file), e)
-
-                        try:
-                            checksum = calculate_checksum(
-                                file_store_item.datafile
-                            )
-                        except (EnvironmentError,
-                                botocore.exceptions.BotoCoreError,
-                                botocore.exceptions.ClientError) as exc:
-                            logger.error(
-                                "Original ISA-tab archive was not found: %s",
-                                exc
-                            )
+                        else:
+                            logger.info("Get file: %s", file_store_item)
+                            # archives imported without checksums are
+                            # read once
+                            if file_store_item.md5 or \
+                                    file_store_item.update_checksums():
+                                checksum = file_store_item.md5
         # 4. Finally if we got a checksum for an existing file, we calculate
         # the checksum for the new file and compare them
         if checksum:
-            new_checksum = None
+            new_checksums = Checksums()
             # TODO: error handling
             with open(path, 'rb') as f:
-                new_checksum = calculate_checksum(f)
-            if checksum == new_checksum:
+                new_checksums.update_from_file(f)
+            if checksum == new_checksums.md5:
                 # Checksums are identical so we can skip this file.
                 logger.info("The checksum of both files is the same: %s",
                             checksum)
                 return \
                     investigation.investigationlink_set.all()[0].data_set.uuid
 
-    with transaction.atomic():
+    # nodes are annotated (in parallel) once the import has been committed
+    with atomic_with_on_commit():
         investigation = parser.run(
             path, isa_archive=isa_archive, preisa_archive=pre_isa_archive
         )
@@ -1,3 +1,4 @@
+from io import StringIO
 import logging
 import os
 
@@ -103,3 +104,18 @@ class TestManagementCommands(TestCase):
         self.assertIn("custom_delimiter_string was not specified",
                       str(context.exception))
         self.assertEqual(DataSet.objects.count(), 0)
+
+    def test_benchmark_attribute_propagation(self):
+        out = StringIO()
+        call_command("benchmark_attribute_propagation", nodes="120",
+                     stdout=out, stderr=out)
+        self.assertIn("memoized propagation", out.getvalue())
+        self.assertIn("recursive propagation", out.getvalue())
+        self.assertNotIn("Results differ", out.getvalue())
+
+    def test_benchmark_solr_response_formatting(self):
+        out = StringIO()
+        call_command("benchmark_solr_response_formatting", facets="5",
+                     buckets=10, docs=3, repeat=1, stdout=out)
+        self.assertIn("5 facets x 10 buckets", out.getvalue())
+        self.assertIn("with fields from the request", out.getvalue())
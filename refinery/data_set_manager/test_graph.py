@@ -0,0 +1,141 @@
+from django.test import SimpleTestCase, TestCase
+
+from .graph import NodeGraph, _build_csr
+from .models import Assay, Investigation, Node, Study
+from .serializers import NodeSerializer
+from .utils import get_node_types
+
+
+class NodeGraphTests(SimpleTestCase):
+    def setUp(self):
+        # source -> sample -> extract1 -> file1
+        #                  -> extract2 -> file2
+        # ids are deliberately not contiguous
+        self.graph = NodeGraph(
+            [
+                (10, 'source', Node.SOURCE, None),
+                (20, 'sample', Node.SAMPLE, None),
+                (30, 'extract1', Node.EXTRACT, 'assay'),
+                (31, 'extract2', Node.EXTRACT, 'assay'),
+                (40, 'file1', Node.RAW_DATA_FILE, 'assay'),
+                (41, 'file2', Node.RAW_DATA_FILE, 'assay'),
+            ],
+            [(20, 10), (30, 20), (31, 20), (41, 31), (40, 30), (40, 99)]
+        )
+
+    def test_build_csr(self):
+        offsets, indices = _build_csr(3, [(2, 1), (0, 2), (0, 1)])
+        self.assertEqual(list(offsets), [0, 2, 2, 3])
+        self.assertEqual(list(indices), [1, 2, 1])
+
+    def test_edges_to_unknown_nodes_are_ignored(self):
+        self.assertEqual(self.graph.parent_uuids(40), ['extract1'])
+
+    def test_parents_and_children(self):
+        self.assertEqual(self.graph.parent_uuids(30), ['sample'])
+        self.assertEqual(self.graph.child_uuids(20),
+                         ['extract1', 'extract2'])
+        self.assertEqual(self.graph.parent_uuids(10), [])
+
+    def test_leaves(self):
+        self.assertEqual(
+            [self.graph.uuids[position]
+             for position in self.graph.leaves('assay')],
+            ['file1', 'file2']
+        )
+        self.assertEqual(self.graph.leaves(), [])
+
+    def test_topological_order(self):
+        order = self.graph.topological_order()
+        self.assertEqual(len(order), len(self.graph))
+        for position in order:
+            for parent in self.graph.parents(position):
+                self.assertLess(order.index(parent), order.index(position))
+
+    def test_type_sequence(self):
+        self.assertEqual(
+            self.graph.type_sequence(self.graph.position(41)),
+            [Node.SOURCE, Node.SAMPLE, Node.EXTRACT, Node.RAW_DATA_FILE]
+        )
+
+    def test_ancestors_and_descendants(self):
+        position = self.graph.position
+        self.assertEqual(
+            self.graph.ancestors([position(40)]),
+            {position(30), position(20), position(10)}
+        )
+        self.assertEqual(
+            self.graph.descendants([position(31)]), {position(41)}
+        )
+
+    def test_cycles_are_left_out_of_topological_order(self):
+        graph = NodeGraph(
+            [(1, 'a', Node.SOURCE, None), (2, 'b', Node.SAMPLE, None)],
+            [(1, 2), (2, 1)]
+        )
+        self.assertEqual(graph.topological_order(), [])
+        self.assertEqual(graph.type_sequence(0), [Node.SAMPLE, Node.SOURCE])
+
+    def test_separate_child_edges(self):
+        graph = NodeGraph(
+            [(1, 'a', Node.SOURCE, None), (2, 'b', Node.SAMPLE, None),
+             (3, 'c', Node.SAMPLE, None)],
+            [(2, 1), (3, 1)], [(1, 2)]
+        )
+        self.assertEqual(graph.child_uuids(1), ['b'])
+        self.assertEqual(graph.parent_uuids(3), ['a'])
+        self.assertTrue(graph.is_leaf(graph.position(3)))
+
+
+class NodeGraphQueryTests(TestCase):
+    def setUp(self):
+        self.study = Study.objects.create(
+            investigation=Investigation.objects.create()
+        )
+        self.assay = Assay.objects.create(study=self.study)
+        source = Node.objects.create(study=self.study, type=Node.SOURCE,
+                                     name='source')
+        sample = Node.objects.create(study=self.study, type=Node.SAMPLE,
+                                     name='sample')
+        source.add_child(sample)
+        for index in range(5):
+            data_file = Node.objects.create(
+                study=self.study, assay=self.assay, type=Node.RAW_DATA_FILE,
+                name='file{}.fastq'.format(index)
+            )
+            sample.add_child(data_file)
+
+    def test_get_node_types(self):
+        with self.assertNumQueries(3):
+            self.assertEqual(
+                get_node_types(self.study.uuid, self.assay.uuid),
+                [Node.SOURCE, Node.SAMPLE, Node.RAW_DATA_FILE]
+            )
+
+    def test_get_node_types_with_assay_uuid_string(self):
+        self.assertEqual(
+            get_node_types(self.study.uuid, str(self.assay.uuid)),
+            [Node.SOURCE, Node.SAMPLE, Node.RAW_DATA_FILE]
+        )
+
+    def test_get_node_types_with_filter_set(self):
+        self.assertEqual(
+            get_node_types(self.study.uuid, self.assay.uuid,
+                           filter_set=Node.FILES),
+            [Node.RAW_DATA_FILE]
+        )
+
+    def test_get_node_types_without_nodes(self):
+        self.assertIsNone(get_node_types('missing'))
+
+    def test_node_serializer_with_node_graph(self):
+        nodes = self.study.node_set.order_by('id')
+        expected = NodeSerializer(nodes, many=True).data
+        graph = NodeGraph.load(self.study.uuid)
+        with self.assertNumQueries(1):
+            data = NodeSerializer(nodes.select_related('file_item'),
+                                  many=True,
+                                  context={'node_graph': graph}).data
+        for node_data in list(data) + list(expected):
+            node_data['children'] = sorted(node_data['children'])
+        self.assertEqual(data, expected)
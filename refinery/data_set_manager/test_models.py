@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 
@@ -9,11 +10,13 @@ from celery.states import PENDING, STARTED, SUCCESS
 
 from factory_boy.utils import (create_dataset_with_necessary_models,
                                make_analyses_with_single_dataset)
+import mock
 
 from core.models import Analysis, DataSet, InvestigationLink
 from file_store.models import FileStoreItem
 
-from .models import (Assay, Investigation, Node, Study)
+from .models import (Assay, Investigation, Node, Study,
+                     _get_facet_attributes, _query_solr)
 from .tests import IsaTabTestBase
 
 TEST_DATA_BASE_PATH = "data_set_manager/test-data/"
@@ -52,6 +55,66 @@ class AssayClassTests(TestCase):
         self.assertEqual(self.assay.get_file_count(), 2)
 
 
+class FacetAttributeTests(TestCase):
+    def setUp(self):
+        self.investigation = Investigation.objects.create()
+        self.study = Study.objects.create(investigation=self.investigation)
+        self.assay = Assay.objects.create(study=self.study)
+        self.solr_results = {
+            'response': {'numFound': 4, 'docs': []},
+            'facets': {
+                'count': 4,
+                'attribute_0': {'buckets': [{'val': 'Human', 'count': 4}]},
+                'attribute_1': {'buckets': [{'val': 'a', 'count': 1},
+                                            {'val': 'b', 'count': 1}]}
+            }
+        }
+
+    def test_get_facet_attributes_uses_single_request(self):
+        with mock.patch('data_set_manager.models._query_solr',
+                        return_value=self.solr_results) as query_mock:
+            _get_facet_attributes(['organism_s', 'name'], self.study,
+                                  self.assay, 4)
+        self.assertEqual(query_mock.call_count, 1)
+        json_facet = query_mock.call_args[1]['json_facet']
+        self.assertEqual(json_facet['attribute_0']['field'], 'organism_s')
+        self.assertEqual(json_facet['attribute_1']['limit'], 2)
+
+    def test_get_facet_attributes(self):
+        with mock.patch('data_set_manager.models._query_solr',
+                        return_value=self.solr_results):
+            facet_attributes = _get_facet_attributes(
+                ['organism_s', 'name'], self.study, self.assay, 4
+            )
+        self.assertEqual(facet_attributes, {'organism_s'})
+
+    @mock.patch('data_set_manager.models.get_solr_client')
+    def test_query_solr_posts_json_facet(self, get_solr_client_mock):
+        solr = get_solr_client_mock.return_value
+        solr.post.return_value.json.return_value = self.solr_results
+        json_facet = {
+            'attribute_{}'.format(index): {
+                'type': 'terms', 'field': 'attribute_{}_s'.format(index)
+            } for index in range(500)
+        }
+        self.assertEqual(
+            _query_solr(self.study, self.assay, json_facet=json_facet),
+            self.solr_results
+        )
+        self.assertFalse(solr.get.called)
+        params = solr.post.call_args[1]['data']
+        self.assertEqual(json.loads(params['json.facet']), json_facet)
+        self.assertNotIn('params', solr.post.call_args[1])
+
+    def test_get_facet_attributes_excludes_download_url(self):
+        with mock.patch('data_set_manager.models._query_solr') as query_mock:
+            facet_attributes = _get_facet_attributes(
+                ['REFINERY_DOWNLOAD_URL_s'], self.study, self.assay, 4
+            )
+        self.assertEqual(facet_attributes, set())
+        self.assertFalse(query_mock.called)
+
+
 class NodeClassMethodTests(TestCase):
     def setUp(self):
         self.username = 'coffee_tester'
@@ -1,12 +1,17 @@
 import contextlib
+import hashlib
 import logging
 import os
 import shutil
 import tempfile
+import zipfile
 
+from django.db import connection
+from django.db.models.fields.files import FieldFile
 from django.test import TestCase
 
 import mock
+from override_storage import override_storage
 
 from core.models import DataSet
 from file_store.models import FileStoreItem, generate_file_source_translator
@@ -40,15 +45,51 @@ class IsaTabParserTests(IsaTabTestBase):
         self.assertEqual(FileStoreItem.objects.count(), 0)
         self.assertEqual(Investigation.objects.count(), 0)
 
-    def parse(self, dir_name):
+    def parse(self, dir_name, **kwargs):
         file_source_translator = generate_file_source_translator(
             username=self.user.username
         )
         dir = os.path.join(TEST_DATA_BASE_PATH, dir_name)
         return IsaTabParser(
-            file_source_translator=file_source_translator
+            file_source_translator=file_source_translator, **kwargs
         ).run(dir)
 
+    def get_graph(self, investigation):
+        """Returns a comparable summary of the experiment graph of an
+        investigation that does not depend on IDs or UUIDs
+        """
+        def node_key(node):
+            return (node.assay.file_name if node.assay else None, node.type,
+                    node.name)
+
+        nodes = Node.objects.filter(
+            study__investigation=investigation
+        ).select_related('assay', 'file_item')
+        graph = {}
+        for node in nodes:
+            graph.setdefault(node_key(node), []).append({
+                'file_source':
+                    node.file_item.source if node.file_item else None,
+                'parents': sorted(node_key(parent)
+                                  for parent in node.parents.all()),
+                'children': sorted(node_key(child)
+                                   for child in node.children.all()),
+                'attributes': sorted(node.attribute_set.values_list(
+                    'type', 'subtype', 'value', 'value_unit',
+                    'value_accession', 'value_source'
+                )),
+                'protocol_references': sorted(
+                    (protocol_reference.protocol.name,
+                     protocol_reference.performer,
+                     protocol_reference.date,
+                     sorted(protocol_reference.protocolreferenceparameter_set
+                            .values_list('name', 'value', 'value_unit',
+                                         'value_accession', 'value_source')))
+                    for protocol_reference in node.protocolreference_set.all()
+                )
+            })
+        return graph
+
     def test_empty(self):
         with temporary_directory() as tmp:
             with self.assertRaises(ParserException):
@@ -104,6 +145,100 @@ class IsaTabParserTests(IsaTabTestBase):
         assays = studies[0].assay_set.all()
         self.assertEqual(len(assays), 2)
 
+    def test_bulk_create_graph_matches_per_row_graph(self):
+        for dir_name in ['multiple-assay', 'rfc-test.zip']:
+            per_row_graph = self.get_graph(
+                self.parse(dir_name, bulk_create=False)
+            )
+            bulk_graph = self.get_graph(self.parse(dir_name))
+            self.assertTrue(per_row_graph)
+            self.assertEqual(bulk_graph, per_row_graph)
+
+    def test_bulk_create_file_store_items(self):
+        investigation = self.parse('rfc-test.zip')
+        file_nodes = Node.objects.filter(study__investigation=investigation,
+                                         type__in=Node.FILES)
+        self.assertTrue(file_nodes.exists())
+        for node in file_nodes:
+            self.assertIsNotNone(node.file_item)
+            self.assertEqual(node.file_item.source,
+                             generate_file_source_translator(
+                                 username=self.user.username
+                             )(node.name))
+
+    def write_archive(self, archive_path, dir_name, edit_study=None):
+        """Zips a test ISA-Tab directory without directory entries and
+        optionally modifies the lines of its study file"""
+        dir = os.path.join(TEST_DATA_BASE_PATH, dir_name)
+        with zipfile.ZipFile(archive_path, 'w') as archive:
+            for file_name in os.listdir(dir):
+                with open(os.path.join(dir, file_name)) as f:
+                    lines = f.read().splitlines()
+                if file_name.startswith('s_') and edit_study:
+                    lines = [edit_study(line) for line in lines]
+                archive.writestr(os.path.join(dir_name, file_name),
+                                 '\n'.join(lines) + '\n')
+
+    def test_archive_is_read_without_extraction(self):
+        with temporary_directory() as tmp:
+            archive_path = os.path.join(tmp, 'minimal.zip')
+            self.write_archive(archive_path, 'minimal')
+            with mock.patch('tempfile.mkdtemp') as mkdtemp_mock:
+                investigation = self.parse(archive_path)
+        self.assertFalse(mkdtemp_mock.called)
+        self.assertEqual(self.get_graph(investigation),
+                         self.get_graph(self.parse('minimal')))
+
+    def test_trailing_empty_columns_are_trimmed(self):
+        with temporary_directory() as tmp:
+            archive_path = os.path.join(tmp, 'minimal.zip')
+            self.write_archive(archive_path, 'minimal',
+                               edit_study=lambda line: line + '\t\t')
+            investigation = self.parse(archive_path)
+        self.assertEqual(self.get_graph(investigation),
+                         self.get_graph(self.parse('minimal')))
+
+    def test_rows_with_fewer_trailing_empty_columns_than_header(self):
+        lines = iter(range(100))
+
+        def edit_study(line):
+            # two empty trailing columns in the header, one in the rows
+            return line + ('\t\t' if next(lines) == 0 else '\t')
+
+        with temporary_directory() as tmp:
+            archive_path = os.path.join(tmp, 'minimal.zip')
+            self.write_archive(archive_path, 'minimal', edit_study=edit_study)
+            investigation = self.parse(archive_path)
+        self.assertEqual(self.get_graph(investigation),
+                         self.get_graph(self.parse('minimal')))
+
+    def test_value_in_trailing_empty_column(self):
+        lines = iter(range(100))
+
+        def edit_study(line):
+            # empty trailing column in the header, value in the first row
+            return line + ('\t' if next(lines) == 0 else '\tvalue')
+
+        with temporary_directory() as tmp:
+            archive_path = os.path.join(tmp, 'minimal.zip')
+            self.write_archive(archive_path, 'minimal', edit_study=edit_study)
+            with self.assertRaises(ParserException):
+                self.parse(archive_path)
+
+    def test_get_dataset_name_from_archive(self):
+        file_source_translator = generate_file_source_translator(
+            username=self.user.username
+        )
+        parser = IsaTabParser(file_source_translator=file_source_translator)
+        self.assertEqual(
+            parser.get_dataset_name(
+                os.path.join(TEST_DATA_BASE_PATH, 'rfc-test.zip')
+            ),
+            parser.get_dataset_name(
+                os.path.join(TEST_DATA_BASE_PATH, 'minimal')
+            )
+        )
+
     def test_bad_isatab_rollback_from_parser_exception_a(self):
         with self.assertRaises(IOError):
             parse_isatab(self.user.username, False,
@@ -118,6 +253,52 @@ class IsaTabParserTests(IsaTabTestBase):
                                       "HideLabBrokenB.zip"))
         self.failed_isatab_assertions()
 
+    def test_annotation_exception_keeps_import(self):
+        with mock.patch('data_set_manager.tasks.annotate_assay',
+                        side_effect=RuntimeError):
+            data_set_uuid = parse_isatab(
+                self.user.username, False,
+                os.path.join(TEST_DATA_BASE_PATH, "rfc-test.zip")
+            )
+        investigation = DataSet.objects.get(
+            uuid=data_set_uuid
+        ).get_investigation()
+        self.assertIsNone(investigation.annotation_date)
+        self.assertEqual(AnnotatedNode.objects.count(), 0)
+
+    def test_parse_isatab_annotates_after_commit(self):
+        # the import is committed when its savepoint has been released
+        savepoints = []
+        with mock.patch('data_set_manager.tasks.annotate_nodes') as \
+                annotate_nodes_mock:
+            annotate_nodes_mock.side_effect = lambda investigation_uuid: \
+                savepoints.append(len(connection.savepoint_ids))
+            parse_isatab(self.user.username, False,
+                         os.path.join(TEST_DATA_BASE_PATH, "rfc-test.zip"))
+        self.assertEqual(savepoints, [len(connection.savepoint_ids)])
+
+    @override_storage()
+    def test_parse_isatab_twice_compares_stored_checksum(self):
+        path = os.path.join(TEST_DATA_BASE_PATH, 'rfc-test.zip')
+        data_set_uuid = parse_isatab(self.user.username, False, path,
+                                     isa_archive=path)
+        investigation = DataSet.objects.get(
+            uuid=data_set_uuid
+        ).get_investigation()
+        file_store_item = FileStoreItem.objects.get(
+            uuid=investigation.isarchive_file
+        )
+        with open(path, 'rb') as archive:
+            self.assertEqual(file_store_item.md5,
+                             hashlib.md5(archive.read()).hexdigest())
+        with mock.patch.object(FieldFile, 'open') as open_mock:
+            self.assertEqual(
+                parse_isatab(self.user.username, False, path,
+                             isa_archive=path),
+                data_set_uuid
+            )
+        self.assertFalse(open_mock.called)
+
 
 class SingleFileColumnParserTests(TestCase):
     def setUp(self):
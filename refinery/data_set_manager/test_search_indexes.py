@@ -15,7 +15,8 @@ from rest_framework.test import APITestCase
 
 import constants
 from core.models import (INPUT_CONNECTION, OUTPUT_CONNECTION, Analysis,
-                         AnalysisNodeConnection, DataSet, InvestigationLink)
+                         AnalysisNodeConnection, DataSet, ExtendedGroup,
+                         InvestigationLink)
 from file_store.models import FileStoreItem
 
 from .models import Assay, Investigation, Node, Study
@@ -261,3 +262,81 @@ class NodeIndexTests(APITestCase):
                 ),
                 expected_datafile=self.file_store_item.datafile
             )
+
+    def test_update_objects_sends_batches_and_commits_once(self):
+        for index in range(2):
+            Node.objects.create(assay=self.assay, study=self.assay.study,
+                                name='fake{}.txt'.format(index),
+                                type='Raw Data File')
+        backend = mock.Mock()
+        with mock.patch.object(NodeIndex, 'get_backend',
+                               return_value=backend):
+            counter = NodeIndex().update_objects(Node.objects.all(),
+                                                 batch_size=2)
+        self.assertEqual(counter, 3)
+        self.assertEqual(backend.update.call_count, 2)
+        for call in backend.update.call_args_list:
+            self.assertFalse(call[1]['commit'])
+        backend.conn.commit.assert_called_once_with()
+
+    def test_update_objects_without_nodes_does_not_commit(self):
+        backend = mock.Mock()
+        with mock.patch.object(NodeIndex, 'get_backend',
+                               return_value=backend):
+            counter = NodeIndex().update_objects(Node.objects.none())
+        self.assertEqual(counter, 0)
+        self.assertFalse(backend.conn.commit.called)
+
+    @mock.patch(
+        'data_set_manager.search_indexes.bump_assay_index_generations'
+    )
+    def test_update_objects_bumps_assay_index_generations(self, bump_mock):
+        other_assay = Assay.objects.create(study=self.assay.study)
+        Node.objects.create(study=self.assay.study, name='source',
+                            type=Node.SOURCE)
+        backend = mock.Mock()
+        with mock.patch.object(NodeIndex, 'get_backend',
+                               return_value=backend):
+            NodeIndex().update_objects(Node.objects.filter(assay=self.assay))
+            bump_mock.assert_called_once_with({self.assay.uuid})
+            bump_mock.reset_mock()
+            NodeIndex().update_objects(
+                Node.objects.filter(assay__isnull=True)
+            )
+            bump_mock.assert_called_once_with({self.assay.uuid,
+                                               other_assay.uuid})
+
+    def test_prepare_access(self):
+        user = User.objects.create_user('owner', '', 'password')
+        group = ExtendedGroup.objects.create(name='readers')
+        data_set = DataSet.objects.get(uuid=self.data_set_uuid)
+        data_set.set_owner(user)
+        data_set.share(group)
+        self.assertEqual(
+            NodeIndex().prepare_access(self.node),
+            sorted(['u_{}'.format(user.id), 'g_{}'.format(group.id)])
+        )
+
+    def test_prepare_access_of_previous_version(self):
+        data_set = DataSet.objects.get(uuid=self.data_set_uuid)
+        data_set.set_owner(User.objects.create_user('owner', '', 'password'))
+        InvestigationLink.objects.create(
+            investigation=Investigation.objects.create(), data_set=data_set,
+            version=2
+        )
+        self.assertEqual(NodeIndex().prepare_access(self.node), [])
+
+    def test_prepare_prefetched_node_without_queries(self):
+        node_index = NodeIndex()
+        node = NodeIndex.get_batch_queryset(
+            Node.objects.filter(uuid=self.node_uuid)
+        )[0]
+        node_index.prefetch([node])
+        with mock.patch(
+            'data_set_manager.search_indexes.'
+            '_get_download_url_or_import_state',
+            return_value=constants.NOT_AVAILABLE
+        ):
+            with self.assertNumQueries(0):
+                data = node_index.prepare(node)
+        self.assertEqual(data['data_set_uuid'], self.data_set_uuid)
@@ -0,0 +1,104 @@
+from django.test import TestCase, override_settings
+
+import mock
+
+from .models import (AnnotatedNode, Assay, Attribute, AttributeOrder,
+                     Investigation, Node, Study)
+from .tasks import annotate_assay, annotate_nodes
+
+
+class AnnotateNodesTests(TestCase):
+    def setUp(self):
+        self.investigation = Investigation.objects.create()
+        self.study = Study.objects.create(investigation=self.investigation)
+        self.assays = [Assay.objects.create(study=self.study)
+                       for _ in range(3)]
+
+    @mock.patch('data_set_manager.tasks.annotate_assay')
+    def test_annotate_nodes_in_transaction_runs_in_process(
+            self, annotate_assay_mock
+    ):
+        with mock.patch('celery.chord') as chord_mock:
+            self.assertEqual(annotate_nodes(self.investigation.uuid), 3)
+        self.assertFalse(chord_mock.called)
+        self.assertEqual(
+            [call[0][1] for call in annotate_assay_mock.call_args_list],
+            [assay.uuid for assay in self.assays]
+        )
+        self.assertIsNotNone(
+            Investigation.objects.get(uuid=self.investigation.uuid)
+            .annotation_date
+        )
+
+    @override_settings(REFINERY_ANNOTATION_CONCURRENCY=2)
+    @mock.patch('data_set_manager.tasks.finish_annotation')
+    @mock.patch('data_set_manager.tasks.annotate_assay')
+    @mock.patch('celery.chain')
+    @mock.patch('celery.group')
+    @mock.patch('celery.chord')
+    def test_annotate_nodes_fans_out_per_assay(
+            self, chord_mock, group_mock, chain_mock, annotate_assay_mock,
+            finish_annotation_mock
+    ):
+        with mock.patch('django.db.transaction.get_connection') as \
+                get_connection_mock:
+            get_connection_mock.return_value.in_atomic_block = False
+            annotate_nodes(self.investigation.uuid)
+        # list() consumes the generator passed to group()
+        self.assertEqual(len(list(group_mock.call_args[0][0])), 2)
+        self.assertEqual(
+            sorted(len(call[0]) for call in chain_mock.call_args_list), [1, 2]
+        )
+        self.assertEqual(annotate_assay_mock.si.call_count, 3)
+        finish_annotation_mock.s.assert_called_once_with(
+            self.investigation.uuid, 3
+        )
+        chord_mock.return_value.apply_async.assert_called_once_with()
+
+    def test_annotate_nodes_with_missing_investigation(self):
+        self.assertIsNone(annotate_nodes('missing'))
+
+
+class AnnotateAssayTests(TestCase):
+    def setUp(self):
+        investigation = Investigation.objects.create()
+        self.study = Study.objects.create(investigation=investigation)
+        self.assay = Assay.objects.create(study=self.study)
+        source = Node.objects.create(study=self.study, type=Node.SOURCE,
+                                     name='source')
+        Attribute.objects.create(node=source, type='Characteristics',
+                                 subtype='organism', value='mouse')
+        data_file = Node.objects.create(study=self.study, assay=self.assay,
+                                        type=Node.RAW_DATA_FILE,
+                                        name='file.fastq')
+        source.add_child(data_file)
+        mock.patch('data_set_manager.tasks.index_annotated_nodes').start()
+        mock.patch('data_set_manager.tasks.get_node_types',
+                   return_value=[Node.RAW_DATA_FILE]).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_annotate_assay_is_idempotent(self):
+        def create_attribute_order(study, assay):
+            AttributeOrder.objects.create(study=study, assay=assay,
+                                          solr_field='organism')
+
+        with mock.patch(
+            'data_set_manager.tasks.initialize_attribute_order',
+            side_effect=create_attribute_order
+        ) as initialize_attribute_order_mock:
+            annotate_assay(self.study.uuid, self.assay.uuid)
+            annotated_nodes = list(AnnotatedNode.objects.values_list(
+                'node_name', 'attribute_value'
+            ))
+            annotate_assay(self.study.uuid, self.assay.uuid)
+
+        self.assertEqual(annotated_nodes, [('file.fastq', 'mouse')])
+        self.assertEqual(
+            list(AnnotatedNode.objects.values_list('node_name',
+                                                   'attribute_value')),
+            annotated_nodes
+        )
+        self.assertEqual(initialize_attribute_order_mock.call_count, 1)
+        self.assertEqual(AttributeOrder.objects.count(), 1)
@@ -1,10 +1,12 @@
 from io import StringIO
 import logging
 import json
+from unittest import skipUnless
 import uuid
 
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.db import connection
 from django.db.models import Q
 from django.http import QueryDict
 from django.test import TestCase
@@ -18,11 +20,15 @@ import constants
 from core.models import DataSet, InvestigationLink
 from file_store.models import FileStoreItem
 
-from .models import (AnnotatedNode, Assay, AttributeOrder, Investigation, Node,
-                     Study)
+from .models import (AnnotatedNode, Assay, Attribute, AttributeOrder,
+                     Investigation, Node, Study)
 from .serializers import AttributeOrderSerializer
 from .utils import (_create_solr_params_from_node_uuids,
-                    create_facet_field_counts, create_facet_filter_query,
+                    _get_unique_parent_attributes,
+                    _materialize_annotated_nodes,
+                    _propagate_parent_attributes, _retrieve_nodes,
+                    add_annotated_nodes_selection, create_facet_field_counts,
+                    create_facet_filter_query,
                     cull_attributes_from_list, customize_attribute_response,
                     escape_character_solr, format_solr_response,
                     generate_filtered_facet_fields,
@@ -31,6 +37,7 @@ from .utils import (_create_solr_params_from_node_uuids,
                     get_first_annotated_node_from_solr_name,
                     hide_fields_from_list, initialize_attribute_order_ranks,
                     is_field_in_hidden_list, update_annotated_nodes,
+                    update_annotated_nodes_for_attribute,
                     update_attribute_order_ranks)
 
 TEST_DATA_BASE_PATH = "data_set_manager/test-data/"
@@ -512,6 +519,25 @@ class UtilitiesTests(TestCase):
                                   'wt': 'json'
                               })
 
+    def test_generate_solr_params_for_assay_with_first_cursor(self):
+        parameter_qdict = QueryDict('', mutable=True)
+        parameter_qdict.update({'offset': 20, 'cursor': '',
+                                'facets': 'cats'})
+        query = generate_solr_params_for_assay(parameter_qdict,
+                                               self.valid_uuid)
+        self.assertEqual(query['params']['cursorMark'], '*')
+        self.assertEqual(query['params']['start'], '0')
+        self.assertEqual(query['params']['sort'], 'id asc')
+
+    def test_generate_solr_params_for_assay_with_cursor_and_sort(self):
+        parameter_qdict = QueryDict('', mutable=True)
+        parameter_qdict.update({'cursor': 'AoEjMTI=', 'facets': 'cats',
+                                'sort': 'name desc'})
+        query = generate_solr_params_for_assay(parameter_qdict,
+                                               self.valid_uuid)
+        self.assertEqual(query['params']['cursorMark'], 'AoEjMTI=')
+        self.assertEqual(query['params']['sort'], 'name desc, id asc')
+
     def test_generate_solr_params_params_returns_json_facet(self):
         parameter_dict = {'limit': 7, 'offset': 2,
                           'facets': 'cats,mouse,dog,horse',
@@ -732,12 +758,56 @@ class UtilitiesTests(TestCase):
             }
         )
 
+    def _get_cursor_solr_response(self, cursor, next_cursor):
+        return json.dumps({
+            "responseHeader": {
+                "params": {
+                    "json": '{"fields": ["name"]}',
+                    "cursorMark": cursor
+                }
+            },
+            "response": {"numFound": 1, "start": 0, "docs": []},
+            "nextCursorMark": next_cursor
+        })
+
+    def test_format_solr_response_with_next_cursor(self):
+        formatted_response = format_solr_response(
+            self._get_cursor_solr_response('*', 'AoEjMTI=')
+        )
+        self.assertEqual(formatted_response['next_cursor'], 'AoEjMTI=')
+        self.assertNotIn('nextCursorMark', formatted_response)
+
+    def test_format_solr_response_after_last_cursor_page(self):
+        formatted_response = format_solr_response(
+            self._get_cursor_solr_response('AoEjMTI=', 'AoEjMTI=')
+        )
+        self.assertIsNone(formatted_response['next_cursor'])
+
+    def test_format_solr_response_with_requested_fields(self):
+        formatted_response = format_solr_response(
+            self._get_cursor_solr_response('*', '*'),
+            fields=['REFINERY_FILETYPE_6_3_s']
+        )
+        self.assertEqual(
+            [attribute['internal_name']
+             for attribute in formatted_response['attributes']],
+            ['REFINERY_FILETYPE_6_3_s']
+        )
+
     def test_format_solr_response_invalid(self):
         # invalid input, do not mask error
         solr_response = {"test_object": "not a string"}
         with self.assertRaises(TypeError):
             format_solr_response(solr_response)
 
+    def test_customize_attribute_response_returns_copies(self):
+        attributes = ['REFINERY_FILETYPE_6_3_s']
+        customize_attribute_response(attributes)[0]['display_name'] = 'X'
+        self.assertEqual(
+            customize_attribute_response(attributes)[0]['display_name'],
+            'File Type'
+        )
+
     def test_customize_attribute_response_for_generics(self):
         attributes = ['technology_Characteristics_generic_s',
                       'antibody_Factor_Value_generic_s']
@@ -1191,6 +1261,129 @@ class UtilitiesTests(TestCase):
         self.assertEqual(len(nodes_after), 0)
         # TODO: Is this the behavior we expect?
 
+    @skipUnless(connection.vendor == 'postgresql', 'requires PostgreSQL')
+    def test_materialize_annotated_nodes_matches_propagation(self):
+        study = self.isatab_9909_data_set.get_latest_study()
+        assay = self.isatab_9909_data_set.get_latest_assay()
+        AnnotatedNode.objects.all().delete()
+        nodes = _retrieve_nodes(study.uuid, assay.uuid, True)
+        node_ids = [node_id for node_id, node in nodes.items()
+                    if node['type'] == Node.ARRAY_DATA_FILE]
+        inherited = _propagate_parent_attributes(nodes, node_ids)
+        expected = set((node_id, attribute_id) for node_id in node_ids
+                       for attribute_id in inherited[node_id])
+
+        created = _materialize_annotated_nodes(Node.ARRAY_DATA_FILE, study,
+                                               assay)
+        self.assertEqual(created, len(expected))
+        self.assertEqual(
+            set(AnnotatedNode.objects.values_list('node_id', 'attribute_id')),
+            expected
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', 'requires PostgreSQL')
+    def test_materialize_annotated_nodes_with_node_uuids(self):
+        study = self.isatab_9909_data_set.get_latest_study()
+        assay = self.isatab_9909_data_set.get_latest_assay()
+        node = Node.objects.filter(assay=assay,
+                                   type=Node.ARRAY_DATA_FILE).first()
+        AnnotatedNode.objects.all().delete()
+        _materialize_annotated_nodes(Node.ARRAY_DATA_FILE, study, assay,
+                                     [node.uuid])
+        self.assertEqual(
+            set(AnnotatedNode.objects.values_list('node_uuid', flat=True)),
+            {node.uuid}
+        )
+
+    @mock.patch('data_set_manager.utils.index_annotated_nodes_selection')
+    def test_update_annotated_nodes_for_attribute(self, index_selection_mock):
+        annotated_node = AnnotatedNode.objects.filter(
+            study=self.isatab_9909_data_set.get_latest_study(),
+            attribute_subtype='organism part'
+        )[0]
+        attribute = annotated_node.attribute
+        attribute.value = 'cell'
+        attribute.save()
+        unaffected_count = AnnotatedNode.objects.exclude(
+            attribute=attribute
+        ).exclude(attribute_value='cell').count()
+
+        node_uuids = update_annotated_nodes_for_attribute(attribute)
+
+        annotated_node.refresh_from_db()
+        self.assertEqual(annotated_node.attribute_value, 'cell')
+        self.assertEqual(
+            sorted(node_uuids),
+            sorted(set(AnnotatedNode.objects.filter(
+                attribute=attribute
+            ).values_list('node_uuid', flat=True)))
+        )
+        self.assertEqual(
+            AnnotatedNode.objects.exclude(attribute=attribute).exclude(
+                attribute_value='cell'
+            ).count(),
+            unaffected_count
+        )
+        index_selection_mock.assert_called_once_with(node_uuids)
+
+    @mock.patch('data_set_manager.utils.index_annotated_nodes_selection')
+    def test_update_annotated_nodes_for_unused_attribute(
+            self, index_selection_mock
+    ):
+        attribute = Attribute.objects.create(
+            node=self.isatab_9909_data_set.get_nodes()[0], type='Comment',
+            value='unused'
+        )
+        self.assertEqual(update_annotated_nodes_for_attribute(attribute), [])
+        self.assertFalse(index_selection_mock.called)
+
+    def test_add_annotated_nodes_selection_replaces_annotated_nodes(self):
+        study = self.isatab_9909_data_set.get_latest_study()
+        assay = self.isatab_9909_data_set.get_latest_assay()
+        node = Node.objects.filter(assay=assay,
+                                   type=Node.ARRAY_DATA_FILE).first()
+        AnnotatedNode.objects.all().delete()
+        add_annotated_nodes_selection([node.uuid], Node.ARRAY_DATA_FILE,
+                                      study.uuid, assay.uuid)
+        annotated_nodes = sorted(AnnotatedNode.objects.values_list(
+            'node_uuid', 'attribute_id'
+        ))
+        self.assertTrue(annotated_nodes)
+        add_annotated_nodes_selection([node.uuid], Node.ARRAY_DATA_FILE,
+                                      study.uuid, assay.uuid)
+        self.assertEqual(sorted(AnnotatedNode.objects.values_list(
+            'node_uuid', 'attribute_id'
+        )), annotated_nodes)
+
+    def test_retrieve_nodes_only_includes_attributes_of_assay(self):
+        study = self.hg_19_data_set.get_latest_study()
+        assay = self.hg_19_data_set.get_latest_assay()
+        nodes = _retrieve_nodes(study.uuid, assay.uuid, True)
+        attribute_ids = set(
+            attribute[0] for node in nodes.values()
+            for attribute in node['attributes']
+        )
+        self.assertEqual(
+            attribute_ids,
+            set(Attribute.objects.filter(node__assay=assay)
+                .values_list('id', flat=True))
+        )
+
+    def test_retrieve_nodes_query_count_independent_of_other_data_sets(self):
+        study = self.hg_19_data_set.get_latest_study()
+        assay = self.hg_19_data_set.get_latest_assay()
+        # node and attribute queries
+        with self.assertNumQueries(2):
+            nodes = _retrieve_nodes(study.uuid, assay.uuid, True)
+        for _ in range(3):
+            create_dataset_with_necessary_models()
+        self.assertGreater(
+            Attribute.objects.exclude(node__study=study).count(), 0
+        )
+        with self.assertNumQueries(2):
+            self.assertEqual(_retrieve_nodes(study.uuid, assay.uuid, True),
+                             nodes)
+
     def test_update_existing_dataset_with_revised_investigation(self):
         existing_data_set = create_dataset_with_necessary_models()
         new_data_set = create_dataset_with_necessary_models()
@@ -1297,3 +1490,35 @@ class UtilitiesTests(TestCase):
                                              annotated_node.attribute_type)
         first_node = get_first_annotated_node_from_solr_name(solr_name, node)
         self.assertEqual(annotated_node, first_node)
+
+
+class AttributePropagationTests(TestCase):
+    def setUp(self):
+        # diamond: source -> (sample a, sample b) -> file
+        self.nodes = {
+            1: {'id': 1, 'parents': [], 'attributes': [(10, 'a')]},
+            2: {'id': 2, 'parents': [1], 'attributes': [(20, 'b')]},
+            3: {'id': 3, 'parents': [1], 'attributes': []},
+            4: {'id': 4, 'parents': [2, 3], 'attributes': [(40, 'd')]}
+        }
+
+    def test_propagate_parent_attributes_includes_all_ancestors(self):
+        inherited = _propagate_parent_attributes(self.nodes, [4])
+        self.assertEqual(sorted(inherited[4].keys()), [10, 20, 40])
+
+    def test_propagate_parent_attributes_matches_recursion(self):
+        inherited = _propagate_parent_attributes(self.nodes)
+        for node_id in self.nodes:
+            self.assertEqual(
+                inherited[node_id],
+                _get_unique_parent_attributes(self.nodes, node_id)
+            )
+
+    def test_propagate_parent_attributes_visits_only_ancestors(self):
+        inherited = _propagate_parent_attributes(self.nodes, [3])
+        self.assertEqual(sorted(inherited.keys()), [1, 3])
+
+    def test_propagate_parent_attributes_ignores_unknown_parents(self):
+        self.nodes[5] = {'id': 5, 'parents': [99], 'attributes': []}
+        inherited = _propagate_parent_attributes(self.nodes, [5])
+        self.assertEqual(inherited[5], {})
@@ -606,6 +606,34 @@ class AssayFileAPITests(APITestCase):
                                               self.non_meta_attributes)
         self.assertEqual(response.status_code, 200)
 
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }})
+    @mock.patch('data_set_manager.views.generate_solr_params_for_assay',
+                return_value={'json': {'query': '*:*'}, 'params': {}})
+    @mock.patch('data_set_manager.views.search_solr')
+    @mock.patch('data_set_manager.views.format_solr_response',
+                side_effect=lambda *args: {'status': 200})
+    def test_get_cached_until_attribute_order_changes(
+            self, mock_format, mock_search, mock_generate
+    ):
+        self.client.login(username=self.user_owner,
+                          password=self.fake_password)
+        params = {'limit': '0',
+                  'data_set_uuid': self.data_set.uuid}
+        url = self.url.format(self.valid_uuid)
+        self.client.get(url, params)
+        response = self.client.get(url, params)
+        self.assertEqual(mock_search.call_count, 1)
+        self.assertEqual(response.data,
+                         {'status': 200, 'assay_nodes_count': 0})
+
+        assay = Assay.objects.get(uuid=self.valid_uuid)
+        AttributeOrder.objects.create(study=assay.study, assay=assay,
+                                      solr_field='organism')
+        self.client.get(url, params)
+        self.assertEqual(mock_search.call_count, 2)
+
 
 class CheckDataFilesViewTests(MetadataImportTestBase):
     def setUp(self):
@@ -1099,8 +1127,8 @@ class NodeViewAPIV2Tests(APIV2TestCase):
         annotated_node.refresh_from_db()
         self.assertEqual(annotated_node.attribute_value, new_value)
 
-    @mock.patch('data_set_manager.models.Node.update_solr_index')
-    def test_patch_edit_calls_update_solr_index(self, update_solr_index_mock):
+    @mock.patch('data_set_manager.utils.index_annotated_nodes_selection')
+    def test_patch_edit_calls_update_solr_index(self, index_selection_mock):
         node = self.hg_19_data_set.get_nodes().filter(
             type=Node.RAW_DATA_FILE
         )[0]
@@ -1116,7 +1144,13 @@ class NodeViewAPIV2Tests(APIV2TestCase):
         )
         force_authenticate(patch_request, user=self.user)
         self.patch_view(patch_request, node.uuid)
-        self.assertTrue(update_solr_index_mock.called)
+        # only the nodes inheriting the attribute are reindexed
+        self.assertEqual(
+            sorted(index_selection_mock.call_args[0][0]),
+            sorted(set(AnnotatedNode.objects.filter(
+                attribute=annotated_node.attribute
+            ).values_list('node_uuid', flat=True)))
+        )
 
     @mock.patch('data_set_manager.models.Node.update_solr_index')
     def test_patch_return_405_for_derived(self, update_solr_index_mock):
@@ -4,27 +4,33 @@ Created on May 29, 2012
 @author: nils
 '''
 import copy
-import csv
+from functools import lru_cache
 import hashlib
 import json
 import logging
-import shutil
-import tempfile
+from operator import itemgetter
 import time
-from urllib.parse import urljoin
 
 from django.conf import settings
+from django.db import connection
 from django.db.models import Q
 from django.utils.http import urlquote, urlunquote
 
-import requests
+try:
+    # decodes large Solr responses several times faster than json
+    import ujson as solr_json
+except ImportError:
+    solr_json = json
 
 import constants
 import core
+from core.solr_client import get_solr_client
+from file_store.models import FileStoreItem
 
+from .graph import NodeGraph
 from .models import (
     AnnotatedNode, AnnotatedNodeRegistry, Assay, Attribute, AttributeOrder,
-    Node, Study
+    Node, Study, get_assay_index_generation
 )
 from .search_indexes import NodeIndex
 from .serializers import AttributeOrderSerializer
@@ -50,39 +56,18 @@ def get_node_types(study_uuid, assay_uuid=None, files_only=False,
     The order of the returned list is the order of the node types in the
     experiment graph.
     """
-    try:
-        # 1. find a node without children
-        nodes = Node.objects.filter(study__uuid=study_uuid,
-                                    assay__uuid=assay_uuid)
-
-        for n in nodes:
-            if n.children_set.count() == 0:
-                node = n
-                break
-
-        # 2. recursively follow until reaching a source node
-        sequence = _get_node_types_recursion(node)
-        sequence.reverse()
-
-        if filter_set is None:
-            return sequence
-        else:
-            return [item for item in sequence if item in filter_set]
-    except:
+    graph = NodeGraph.load(study_uuid)
+    # 1. find a node without children
+    leaves = graph.leaves(assay_uuid)
+    if not leaves:
         return None
+    # 2. follow the first parents until reaching a source node
+    sequence = graph.type_sequence(leaves[0])
 
-
-def _get_node_types_recursion(node):
-    sequence = [node.type]
-    # 1. get the first child (the assumption is that all node type sequences
-    # are the same)
-    try:
-        parent = node.parents.all()[0]
-        sequence.extend(_get_node_types_recursion(parent))
-    except:
-        pass
-
-    return sequence
+    if filter_set is None:
+        return sequence
+    else:
+        return [item for item in sequence if item in filter_set]
 
 
 def _get_unique_parent_attributes(nodes, node_id):
@@ -107,6 +92,62 @@ def _get_unique_parent_attributes(nodes, node_id):
     return attributes
 
 
+def _propagate_parent_attributes(nodes, node_ids=None):
+    """Collects the unique attributes of each node and all of its ancestors.
+    Nodes are visited in topological order (parents before children) so that
+    the attributes of a shared ancestor are collected once and reused by all
+    of its descendants instead of being collected again for every path through
+    the experiment graph.
+    Returns a dict that maps node IDs to dicts of attributes keyed on attribute
+    ID, which may be shared between nodes and must not be modified.
+    Parameters:
+    nodes: dict of nodes as returned by _retrieve_nodes()
+    node_ids: IDs of the nodes of interest (all nodes if None); only these
+    nodes and their ancestors are visited
+    """
+    if node_ids is None:
+        node_ids = list(nodes.keys())
+
+    inherited = {}
+    visiting = set()
+    for root_id in node_ids:
+        if root_id in inherited:
+            continue
+        # iterative post-order traversal to avoid recursion limits
+        stack = [(root_id, False)]
+        while stack:
+            node_id, expanded = stack.pop()
+            if node_id in inherited:
+                continue
+            # parents outside of the retrieved nodes can't contribute anything
+            parent_ids = [parent_id for parent_id in nodes[node_id]['parents']
+                          if parent_id in nodes]
+            if not expanded:
+                if node_id in visiting:
+                    logger.error("Cycle detected at node with ID %s", node_id)
+                    continue
+                visiting.add(node_id)
+                stack.append((node_id, True))
+                stack.extend((parent_id, False) for parent_id in parent_ids
+                             if parent_id not in inherited)
+                continue
+
+            visiting.discard(node_id)
+            own_attributes = nodes[node_id]['attributes']
+            if len(parent_ids) == 1 and not own_attributes:
+                # nothing to add: share the attributes of the parent
+                inherited[node_id] = inherited.get(parent_ids[0], {})
+            else:
+                attributes = {}
+                for parent_id in parent_ids:
+                    attributes.update(inherited.get(parent_id, {}))
+                for attr in own_attributes:
+                    attributes[attr[0]] = attr
+                inherited[node_id] = attributes
+
+    return inherited
+
+
 def _retrieve_nodes(study_uuid, assay_uuid=None,
                     ontology_attribute_fields=False, node_uuids=None):
     """Retrieve all nodes associated to a study and optionally associated to an
@@ -127,62 +168,44 @@ def _retrieve_nodes(study_uuid, assay_uuid=None,
         q_filters.append(q_filters_1)
 
     # Query for notes
-    node_list = Node.objects.filter(*q_filters, **filters)\
-        .prefetch_related('attribute_set', 'file_item')\
-        .order_by('id', 'attribute').values('id', 'uuid', 'file_item__uuid',
-                                            'type', 'name', 'parents',
-                                            'attribute')
+    node_query = Node.objects.filter(*q_filters, **filters)
+    # one row per (node, parent) pair: joining the attributes as well would
+    # multiply the rows by the number of attributes of each node
+    node_list = node_query.order_by('id').values(
+        'id', 'uuid', 'file_item__uuid', 'type', 'name', 'parents'
+    )
     if ontology_attribute_fields:
         attribute_fields = Attribute.ALL_FIELDS
     else:
         attribute_fields = Attribute.NON_ONTOLOGY_FIELDS
 
-    attribute_list = Attribute.objects.filter().order_by('id').\
-        values_list(*attribute_fields)
+    # only stream the attributes of the retrieved nodes (the node query is
+    # inlined as a subquery) instead of loading every attribute in the database
+    attribute_list = Attribute.objects.filter(
+        node__in=node_query.values('id')
+    ).order_by('id').values_list(*attribute_fields).iterator()
 
+    # the last attribute field is the ID of the node
     attributes = {}
-    current_id = None
-    current_node = None
-    nodes = {}
-
     for attribute in attribute_list:
-        attributes[attribute[0]] = attribute
+        attributes.setdefault(attribute[-1], []).append(attribute)
 
+    nodes = {}
     for node in node_list:
-        if current_id is None or current_id != node["id"]:
-            # save current node
-            if current_node is not None:
-                current_node['parents'] = list(set(current_node['parents']))
-                nodes[current_id] = current_node
-            # new node, start merging
-            current_id = node['id']
-            current_node = {
+        current_node = nodes.get(node['id'])
+        if current_node is None:
+            current_node = nodes[node['id']] = {
                 'id': node['id'],
                 'uuid': node['uuid'],
-                'attributes': [],
+                'attributes': attributes.get(node['id'], []),
                 'parents': [],
                 'name': node['name'],
                 'type': node['type'],
                 'file_uuid': node['file_item__uuid']
             }
-
-        # Fritz: Do the parents really differ or is this overhead?
         if node['parents'] is not None:
             current_node['parents'].append(node['parents'])
 
-        if node['attribute'] is not None:
-            try:
-                current_node['attributes'].append(
-                    attributes[node['attribute']]
-                )
-            except:
-                pass
-
-    # save last node
-    if current_node is not None:
-        current_node['parents'] = list(set(current_node['parents']))
-        nodes[current_id] = current_node
-
     return nodes
 
 
@@ -216,6 +239,79 @@ def _create_annotated_node_objs(bulk_list=[], node=None, study=None,
     return bulk_list, counter
 
 
+def _materialize_annotated_nodes(node_type, study, assay=None,
+                                 node_uuids=None):
+    """Creates the AnnotatedNode rows for all nodes of node_type in a study
+    (and assay) with a single INSERT ... SELECT statement: a recursive CTE
+    collects the distinct (node, ancestor) pairs of the experiment graph and
+    joins them to the attributes of the ancestors. Requires PostgreSQL.
+    Returns the number of AnnotatedNode rows created.
+    Parameters:
+    node_type: type of the nodes to annotate
+    study: Study of the nodes
+    assay: Assay of the nodes (only study nodes are annotated if None)
+    node_uuids: optional list of UUIDs to restrict the nodes to annotate
+    """
+    parents_meta = Node.parents.through._meta
+    if assay is None:
+        scope = "study_id = %s AND assay_id IS NULL"
+        scope_params = [study.id]
+    else:
+        scope = "study_id = %s AND (assay_id IS NULL OR assay_id = %s)"
+        scope_params = [study.id, assay.id]
+    if node_uuids is None:
+        node_filter = ""
+        node_params = []
+    else:
+        node_filter = " AND uuid = ANY(%s)"
+        node_params = [[str(node_uuid) for node_uuid in node_uuids]]
+
+    query = """
+        WITH RECURSIVE scoped_node AS (
+            SELECT id FROM {node} WHERE {scope}
+        ), ancestry (node_id, ancestor_id) AS (
+            SELECT id, id FROM {node}
+            WHERE {scope} AND type = %s{node_filter}
+          UNION
+            SELECT ancestry.node_id, parents.{to_node}
+            FROM ancestry
+            JOIN {parents} parents
+              ON parents.{from_node} = ancestry.ancestor_id
+            JOIN scoped_node ON scoped_node.id = parents.{to_node}
+        )
+        INSERT INTO {annotated_node} (
+            node_id, attribute_id, study_id, assay_id, node_uuid,
+            node_file_uuid, node_type, node_name, attribute_type,
+            attribute_subtype, attribute_value, attribute_value_unit,
+            is_annotation
+        )
+        SELECT node.id, attribute.id, %s, %s, node.uuid, file_item.uuid,
+               node.type, node.name, attribute.type, attribute.subtype,
+               attribute.value, attribute.value_unit, FALSE
+        FROM ancestry
+        JOIN {node} node ON node.id = ancestry.node_id
+        JOIN {attribute} attribute
+          ON attribute.node_id = ancestry.ancestor_id
+        LEFT OUTER JOIN {file_store_item} file_item
+          ON file_item.id = node.file_item_id
+    """.format(
+        node=Node._meta.db_table,
+        parents=parents_meta.db_table,
+        from_node=parents_meta.get_field('from_node').column,
+        to_node=parents_meta.get_field('to_node').column,
+        annotated_node=AnnotatedNode._meta.db_table,
+        attribute=Attribute._meta.db_table,
+        file_store_item=FileStoreItem._meta.db_table,
+        scope=scope,
+        node_filter=node_filter
+    )
+    params = (scope_params + scope_params + [node_type] + node_params +
+              [study.id, None if assay is None else assay.id])
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+        return cursor.rowcount
+
+
 def update_annotated_nodes(
         node_type,
         study_uuid,
@@ -270,6 +366,13 @@ def update_annotated_nodes(
             Q(study__uuid=study_uuid, assay__uuid=assay_uuid),
             node_type=node_type).delete()
 
+    if connection.vendor == 'postgresql':
+        start = time.time()
+        total_attrs = _materialize_annotated_nodes(node_type, study, assay)
+        logger.info("Created %s annotated nodes in %s sec", str(total_attrs),
+                    str(time.time() - start))
+        return
+
     # Retrieve _all_ annotated nodes associated to the given study and assay
     nodes = _retrieve_nodes(study_uuid, assay_uuid, True)
 
@@ -279,6 +382,13 @@ def update_annotated_nodes(
     # Holds AnnotatedNodes objects for bulk db entry creation
     bulk_list = []
 
+    # Unique attributes of all nodes of the given type (inherited from all of
+    # their ancestors)
+    inherited_attributes = _propagate_parent_attributes(
+        nodes, [node_id for node_id, node in nodes.items()
+                if node["type"] == node_type]
+    )
+
     # Total number of associated nodes of the given node type.
     num_nodes_of_type = 0
 
@@ -296,8 +406,7 @@ def update_annotated_nodes(
         )
         if node["type"] == node_type:
             num_nodes_of_type += 1
-            attrs = _get_unique_parent_attributes(nodes, node_id)
-            u_len = len(attrs)
+            u_len = len(inherited_attributes[node_id])
             total_attrs += u_len
     if total_attrs == total_unique_attrs * num_nodes_of_type \
             and len([
@@ -319,7 +428,7 @@ def update_annotated_nodes(
                 node,
                 study,
                 assay,
-                _get_unique_parent_attributes(nodes, node_id)
+                inherited_attributes[node_id]
             )
 
     _create_annotated_node_objs(bulk_list)
@@ -334,30 +443,38 @@ def update_annotated_nodes(
     )
 
 
-def calculate_checksum(f, algorithm='md5', bufsize=8192):
-    """Calculate the checksum of the datafile"""
-    hasher = hashlib.new(algorithm)
-    try:
-        block = f.read(bufsize)
-        while len(block) > 0:
-            hasher.update(block)
-            block = f.read(bufsize)
-    except AttributeError:
-        logger.debug(
-            'Checksum couldn\'t be calculated because the file was not '
-            'available.'
-        )
-    return hasher.hexdigest()
-
-
 def add_annotated_nodes_selection(
         node_uuids,
         node_type,
         study_uuid,
         assay_uuid=None):
+    # replace annotated nodes that were added for these nodes before
+    AnnotatedNode.objects.filter(node_uuid__in=node_uuids,
+                                 node_type=node_type).delete()
     _add_annotated_nodes(node_type, study_uuid, assay_uuid, node_uuids)
 
 
+def update_annotated_nodes_for_attribute(attribute):
+    """Updates the AnnotatedNode rows of all nodes that inherit the given
+    attribute after it has been edited and reindexes only these nodes
+    Returns the UUIDs of the updated nodes.
+    """
+    annotated_nodes = AnnotatedNode.objects.filter(attribute=attribute)
+    node_uuids = list(
+        annotated_nodes.order_by().values_list('node_uuid', flat=True)
+                       .distinct()
+    )
+    annotated_nodes.update(
+        attribute_type=attribute.type,
+        attribute_subtype=attribute.subtype,
+        attribute_value=attribute.value,
+        attribute_value_unit=attribute.value_unit
+    )
+    if node_uuids:
+        index_annotated_nodes_selection(node_uuids)
+    return node_uuids
+
+
 def _add_annotated_nodes(
         node_type,
         study_uuid,
@@ -389,6 +506,14 @@ def _add_annotated_nodes(
     else:
         assay = None
 
+    if connection.vendor == 'postgresql':
+        start = time.time()
+        counter = _materialize_annotated_nodes(node_type, study, assay,
+                                               node_uuids)
+        logger.info("Added %s annotated nodes in %s sec", str(counter),
+                    str(time.time() - start))
+        return
+
     # Retrieve annotated nodes
     nodes = _retrieve_nodes(study_uuid, assay_uuid, True)
     logger.info("%s retrieved from data set", str(len(nodes)))
@@ -399,22 +524,26 @@ def _add_annotated_nodes(
     counter = 0
     bulk_list = []
 
-    for node_id, node in nodes.items():
-        if node["type"] == node_type:
-            if node["uuid"] in node_uuids:
-                bulk_list, num_created = _create_annotated_node_objs(
-                    bulk_list,
-                    node,
-                    study,
-                    assay,
-                    _get_unique_parent_attributes(nodes, node_id)
-                )
-                counter += num_created
+    selected_node_ids = [
+        node_id for node_id, node in nodes.items()
+        if node["type"] == node_type and node["uuid"] in node_uuids
+    ]
+    inherited_attributes = _propagate_parent_attributes(
+        nodes, selected_node_ids
+    )
 
-    _create_annotated_node_objs(bulk_list)
+    for node_id in selected_node_ids:
+        bulk_list, num_created = _create_annotated_node_objs(
+            bulk_list,
+            nodes[node_id],
+            study,
+            assay,
+            inherited_attributes[node_id]
+        )
+        counter += num_created
 
-    if len(bulk_list) > 0:
-        AnnotatedNode.objects.bulk_create(bulk_list)
+    # create remaining annotated nodes
+    _create_annotated_node_objs(bulk_list)
 
     end = time.time()
 
@@ -451,10 +580,7 @@ def _index_annotated_nodes(node_type, study_uuid, assay_uuid=None,
     logger.info("%s nodes for indexing", str(nodes.count()))
     # index nodes
     start = time.time()
-    counter = 0
-    for node in nodes:
-        node.update_solr_index()
-        counter += 1
+    counter = NodeIndex().update_objects(nodes, using='data_set_manager')
     end = time.time()
     logger.info("%s nodes indexed in %s", str(counter), str(end - start))
 
@@ -475,8 +601,10 @@ def generate_solr_params_for_assay(params, assay_uuid, exclude_facets=[]):
 
 
 def generate_solr_params(params, assay_uuids, facets_from_config=False,
-                         exclude_facets=[]):
+                         exclude_facets=[], access=None):
     """Either returns a solr parameters obj, or None if assay_uuids is empty
+    If a list of access tokens (e.g., ['u_1', 'g_2']) is given, documents are
+    filtered by their access field instead of by assay_uuids.
     """
     if len(assay_uuids) == 0:
         return None
@@ -496,9 +624,12 @@ def generate_solr_params(params, assay_uuids, facets_from_config=False,
         "wt": "json"
     }
 
-    filter_arr = [
-        'assay_uuid:({})'.format(' OR '.join([str(u) for u in assay_uuids]))
-    ]
+    if access is None:
+        filter_arr = ['assay_uuid:({})'.format(
+            ' OR '.join([str(u) for u in assay_uuids])
+        )]
+    else:
+        filter_arr = ['access:({})'.format(' OR '.join(access))]
     field_limit = []  # limit attributes to return
     facet_fields_obj = {}  # requested facets formatted for solr
     if facets_from_config:
@@ -556,6 +687,17 @@ def generate_solr_params(params, assay_uuids, facets_from_config=False,
             facet_fields_obj[facet]['excludeTags'] = facet.upper()
         filter_arr.extend(create_facet_filter_query(facet_filter))
 
+    cursor = params.get('cursor')
+    if cursor is not None:
+        # deep paging: Solr requires start=0 and a sort on its uniqueKey
+        # (id) to break ties so that every document is returned exactly once
+        fixed_solr_params['cursorMark'] = cursor or '*'
+        fixed_solr_params['start'] = '0'
+        sort_fields = [field.split()[0] for field in sort.split(',')
+                       if field.strip()] if sort else []
+        if 'id' not in sort_fields:
+            sort = '{}, id asc'.format(sort) if sort else 'id asc'
+
     if sort:
         fixed_solr_params['sort'] = sort
 
@@ -666,17 +808,30 @@ def generate_filtered_facet_fields(attributes):
             'field_limit': field_limit_list}
 
 
+def get_solr_response_cache_key(assay_uuid, solr_params, *args):
+    """Returns the cache key of a formatted Solr response of an assay:
+    solr_params (and any other arguments the response depends on) are
+    normalized by sorting their keys and the key changes with the index
+    generation of the assay so that cached responses are never stale
+    """
+    digest = hashlib.md5(json.dumps(
+        [solr_params] + list(args), sort_keys=True, default=str
+    ).encode()).hexdigest()
+    return 'assay-files-{}-{}-{}'.format(
+        assay_uuid, get_assay_index_generation(assay_uuid), digest
+    )
+
+
 def search_solr(encoded_params, core):
     """Returns solr full_response content by making a solr request
     Parameters:
         encoded_params:  Expect the params to be url-ready (using urlquote)
         core: Specify which node
     """
-    url_portion = '/'.join([core, "select"])
-    url = urljoin(settings.REFINERY_SOLR_BASE_URL, url_portion)
-    full_response = requests.post(url,
-                                  json=encoded_params.get('json'),
-                                  params=encoded_params.get('params'))
+    full_response = get_solr_client().post(
+        core, json=encoded_params.get('json'),
+        params=encoded_params.get('params')
+    )
     if not full_response.ok:
         try:
             response_obj = json.loads(full_response.content.decode())
@@ -719,19 +874,27 @@ def get_owner_from_assay(uuid):
     return data_set.get_owner()
 
 
-def format_solr_response(solr_response, include_facet_count=True):
-    # Returns a reformatted solr response FROM BYTES
-    if type(solr_response) == bytes:
-        solr_response_json = json.loads(solr_response.decode())
-    else:
-        solr_response_json = json.loads(solr_response)
+def format_solr_response(solr_response, include_facet_count=True,
+                         fields=None):
+    """Returns a reformatted solr response FROM BYTES
+    fields: the requested Solr fields (solr_params['json']['fields']) in the
+    order of the attributes, read from the echoed request in the response
+    header if not given
+    """
+    if isinstance(solr_response, bytes):
+        solr_response = solr_response.decode()
+    solr_response_json = solr_json.loads(solr_response)
 
-        # Reorganizes solr response into easier to digest objects.
-    try:
-        order_facet_fields = json.loads(solr_response_json['responseHeader']
-                                        ['params']['json']).get('fields')
-    except KeyError:
-        order_facet_fields = []
+    # Reorganizes solr response into easier to digest objects.
+    if fields is not None:
+        order_facet_fields = fields
+    else:
+        try:
+            order_facet_fields = solr_json.loads(
+                solr_response_json['responseHeader']['params']['json']
+            ).get('fields')
+        except KeyError:
+            order_facet_fields = []
 
     if solr_response_json.get('facets') and include_facet_count != 'false':
         solr_response_json['facet_field_counts'] = create_facet_field_counts(
@@ -750,6 +913,19 @@ def format_solr_response(solr_response, include_facet_count=True):
     solr_response_json["nodes"] = facet_field_docs
     solr_response_json["nodes_count"] = facet_field_docs_count
 
+    # cursor paging: Solr returns the requested cursor after the last page
+    if 'nextCursorMark' in solr_response_json:
+        next_cursor = solr_response_json.pop('nextCursorMark')
+        try:
+            cursor = solr_response_json['responseHeader']['params'][
+                'cursorMark'
+            ]
+        except KeyError:
+            cursor = None
+        solr_response_json['next_cursor'] = (
+            None if next_cursor == cursor else next_cursor
+        )
+
     # Remove unused fields from solr response
     del solr_response_json['responseHeader']
     del solr_response_json['response']
@@ -766,13 +942,12 @@ def create_facet_field_counts(facet_fields):
         if field_name == 'count':
             continue
         count_array = count_obj.get('buckets')
-        for field_obj in count_array:
-            field_obj['name'] = field_obj.get('val')
-            del field_obj['val']
-
         if count_array:
-            # sort fields depending on count
-            count_array.sort(key=lambda x: x['count'], reverse=True)
+            for field_obj in count_array:
+                field_obj['name'] = field_obj.pop('val')
+            # sort fields depending on count (Solr returns the buckets
+            # sorted already which makes this a linear pass)
+            count_array.sort(key=itemgetter('count'), reverse=True)
             facet_field_counts[field_name] = count_array
 
     return facet_field_counts
@@ -781,10 +956,17 @@ def create_facet_field_counts(facet_fields):
 def customize_attribute_response(facet_fields):
     # Returns an array of attribute objects based on parsing the title
     try:
-        iter(facet_fields)
+        facet_fields = tuple(facet_fields)
     except TypeError:
         return facet_fields
+    # parsed attributes are shared by requests for the same fields, so
+    # callers get copies they can modify
+    return [dict(attribute)
+            for attribute in _customize_attributes(facet_fields)]
+
 
+@lru_cache(maxsize=256)
+def _customize_attributes(facet_fields):
     attribute_array = []
     for field in facet_fields:
         # For fields with filters, they need to be trimmed
@@ -959,59 +1141,6 @@ def get_file_url_from_node_uuid(node_uuid, require_valid_url=False):
             raise
 
 
-def fix_last_column(file):
-    """If the header has empty columns in it, then it will delete this and
-    corresponding columns in the rows; returns 0 or 1 based on whether it
-    failed or was successful, respectively
-    Parameters:
-    file: name of file to fix
-    """
-    # TODO: exception handling for file operations (IOError)
-    logger.info("trying to fix the last column if necessary")
-    # FIXME: use context manager to handle file opening and closing
-    reader = csv.reader(open(file, newline=''), dialect='excel-tab')
-    tempfilename = tempfile.NamedTemporaryFile().name
-    writer = csv.writer(open(tempfilename, 'w'), dialect='excel-tab')
-    # check that all rows have the same length
-    header = next(reader)
-    header_length = len(header)
-    num_empty_cols = 0  # number of empty header columns
-    # TODO: throw exception if there is an empty field in the header between
-    # two non-empty fields
-    for item in header:
-        if not item.strip():
-            num_empty_cols += 1
-    # write the file
-    writer.writerow(header[:-num_empty_cols])
-    if num_empty_cols > 0:  # if there are empty header columns
-        logger.info("Empty columns in header present, attempting to fix...")
-        # check that all the rows are the same length
-        line = 0
-        for row in reader:
-            line += 1
-            if len(row) < header_length - num_empty_cols:
-                logger.error(
-                    "Line " + str(line) + " in the file had fewer fields than "
-                    "the header.")
-                return False
-            # check that all the end columns that are supposed to be empty are
-            i = 0
-            if len(row) > len(header) - num_empty_cols:
-                while i < num_empty_cols:
-                    i += 1
-                    check_item = row[-i].strip()
-                    if check_item:  # item not empty
-                        logger.error(
-                            "Found a value in " + str(line) +
-                            " where an empty column was expected.")
-                        return False
-                writer.writerow(row[:-num_empty_cols])
-            else:
-                writer.writerow(row)
-        shutil.move(tempfilename, file)
-    return True
-
-
 def _create_solr_params_from_node_uuids(node_uuids):
     """
     Create and return a dict containing the proper Solr params to query
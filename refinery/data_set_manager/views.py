@@ -15,6 +15,7 @@ import tempfile
 
 from django import forms
 from django.conf import settings
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
                          HttpResponseForbidden, HttpResponseNotFound,
@@ -40,6 +41,7 @@ from file_store.models import generate_file_source_translator
 from file_store.tasks import FileImportTask, download_file
 from file_store.utils import parse_s3_url
 
+from .graph import NodeGraph
 from .models import (AnnotatedNode, Assay, Attribute, AttributeOrder, Node,
                      Study)
 from .search_indexes import NodeIndex
@@ -50,8 +52,9 @@ from .tasks import parse_isatab
 from .utils import (
     customize_attribute_response, format_solr_response,
     generate_solr_params_for_assay, get_first_annotated_node_from_solr_name,
-    get_owner_from_assay, initialize_attribute_order_ranks,
-    is_field_in_hidden_list, search_solr, update_attribute_order_ranks
+    get_owner_from_assay, get_solr_response_cache_key,
+    initialize_attribute_order_ranks, is_field_in_hidden_list, search_solr,
+    update_annotated_nodes_for_attribute, update_attribute_order_ranks
 )
 
 logger = logging.getLogger(__name__)
@@ -877,6 +880,12 @@ class AssayFileAPIView(APIView):
               description: Order node response with field name asc/desc
               type: string
               paramType: query
+            - name: cursor
+              description: Page with a Solr cursor instead of offset (empty
+                for the first page, then the next_cursor of the previous
+                response, which is null after the last page)
+              type: string
+              paramType: query
             - name: data_set_uuid
               description: data set uuid required to check for perms
               type: string
@@ -912,12 +921,22 @@ class AssayFileAPIView(APIView):
                 message = 'User does not have read permissions.'
                 return Response(message, status=status.HTTP_401_UNAUTHORIZED)
 
-            solr_response = search_solr(solr_params, 'data_set_manager')
-            solr_response_json = format_solr_response(
-                solr_response, params.get('include_facet_count', True)
-            )
-            solr_response_json['assay_nodes_count'] = self.get_object(uuid)\
-                .get_file_count()
+            include_facet_count = params.get('include_facet_count', True)
+            # identical requests share the response until the assay is
+            # reindexed or its attribute order changes
+            cache_key = get_solr_response_cache_key(uuid, solr_params,
+                                                    include_facet_count)
+            solr_response_json = cache.get(cache_key)
+            if solr_response_json is None:
+                solr_response = search_solr(solr_params, 'data_set_manager')
+                solr_response_json = format_solr_response(
+                    solr_response, include_facet_count,
+                    solr_params['json'].get('fields')
+                )
+                solr_response_json['assay_nodes_count'] = \
+                    self.get_object(uuid).get_file_count()
+                cache.set(cache_key, solr_response_json,
+                          settings.REFINERY_SOLR_RESPONSE_CACHE_TIMEOUT)
 
             return Response(solr_response_json)
         else:
@@ -1287,7 +1306,11 @@ class NodeViewSet(viewsets.ViewSet):
 
         return Response(
             NodeSerializer(
-                study.node_set.filter(is_auxiliary_node=False), many=True
+                study.node_set.filter(
+                    is_auxiliary_node=False
+                ).select_related('file_item'),
+                many=True,
+                context={'node_graph': NodeGraph.load(study.uuid)}
             ).data
         )
 
@@ -1368,14 +1391,8 @@ class NodeViewSet(viewsets.ViewSet):
 
             source_attribute.value = attribute_value
             source_attribute.save()
-            # update all the hard coded annotated nodes attribute_value
-            children_annotated_nodes_query = AnnotatedNode.objects.filter(
-                attribute=source_attribute
-            )
-            for ann_node in children_annotated_nodes_query:
-                ann_node.attribute_value = source_attribute.value
-                ann_node.save()
-                ann_node.node.update_solr_index()
+            # update the annotated nodes inheriting the attribute
+            update_annotated_nodes_for_attribute(source_attribute)
 
             return Response(
                 NodeSerializer(node).data, status=status.HTTP_200_OK
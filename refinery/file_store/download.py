@@ -0,0 +1,501 @@
+"""
+Resumable, parallel HTTP downloads for file imports
+
+If the server accepts range requests, a file is downloaded in parts by a
+pool of threads into a preallocated partial file in the file store
+(FileDownload) or into the parts of an S3 multipart upload (S3Download). The
+completed parts are recorded in a state file so that a download interrupted
+by a worker restart continues with the missing parts the next time the same
+URL is imported. remove_abandoned_downloads() cleans up after downloads that
+are never continued.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import fcntl
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+import botocore
+import requests
+
+from .utils import (S3_WRITE_ARGS, delete_file, get_s3_client, make_dir,
+                    move_file)
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024  # 1MB
+FILE_PREFIX = 'refinery-download-'
+# in the file store so that completed files are renamed into place
+PARTIAL_DIR_NAME = '.downloads'
+
+
+class IncompletePart(IOError):
+    """Connection closed before all bytes of a part were received"""
+
+
+def get_download_dir():
+    """Returns the directory of the partial files of FileDownloads"""
+    return os.path.join(settings.REFINERY_FILE_STORE_ROOT, PARTIAL_DIR_NAME)
+
+
+def get_state_path(*keys, directory=None):
+    """Returns the path of the state file of a download identified by keys
+    (e.g., the URL) in directory (default: the temp dir)
+    """
+    digest = hashlib.sha1('\n'.join(keys).encode('utf-8')).hexdigest()
+    return os.path.join(directory or tempfile.gettempdir(),
+                        '{}{}.json'.format(FILE_PREFIX, digest))
+
+
+def save_state(path, state):
+    """Replaces the state file atomically"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(temp_path, path)
+
+
+def load_state(path):
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except (IOError, ValueError):
+        return None
+
+
+def lock(path):
+    """Takes an exclusive lock on the file at path (created if necessary)
+    :returns: the open lock file or None if another process holds the lock
+    """
+    while True:
+        lock_file = open(path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        try:
+            if os.stat(path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                return lock_file
+        except FileNotFoundError:
+            pass
+        # the lock file was removed by remove_abandoned_downloads() while
+        # waiting for the lock
+        lock_file.close()
+
+
+def remove_abandoned_downloads(max_age):
+    """Removes the state and partial files of downloads that have not made
+    any progress for max_age seconds (e.g., of imports that failed and were
+    never retried) and aborts their S3 multipart uploads
+    :returns: number of downloads removed
+    """
+    removed = 0
+    for directory in [tempfile.gettempdir(), get_download_dir()]:
+        # group the state, partial, lock and temporary state files of each
+        # download by their name without extensions
+        names = {os.path.basename(path).split('.', 1)[0] for path
+                 in glob.glob(os.path.join(directory, FILE_PREFIX + '*'))}
+        for name in sorted(names):
+            if _remove_abandoned_download(os.path.join(directory, name),
+                                          max_age):
+                removed += 1
+    return removed
+
+
+def _remove_abandoned_download(base_path, max_age):
+    state_path = base_path + '.json'
+    data_paths = [state_path, state_path + '.tmp', base_path + '.part']
+
+    def is_abandoned():
+        modification_times = [os.path.getmtime(path) for path in data_paths
+                              if os.path.exists(path)]
+        # without data files only the lock file is left
+        return time.time() - max(modification_times or [0]) >= max_age
+
+    if not is_abandoned():
+        return False
+    lock_path = state_path + '.lock'
+    lock_file = lock(lock_path)
+    if lock_file is None:  # the download is running again
+        return False
+    try:
+        if not is_abandoned():  # continued in the meantime
+            return False
+        state = load_state(state_path)
+        if state and state.get('upload_id'):
+            _abort_multipart_upload(state)
+        for path in data_paths + [lock_path]:
+            delete_file(path)
+    finally:
+        lock_file.close()
+    logger.info("Removed abandoned download '%s'",
+                state['url'] if state else base_path)
+    return True
+
+
+def _abort_multipart_upload(state):
+    if not state.get('bucket'):
+        logger.warning("Can't abort upload of '%s' to unknown bucket "
+                       "(key: '%s')", state['url'], state['key'])
+        return
+    try:
+        get_s3_client().abort_multipart_upload(
+            Bucket=state['bucket'], Key=state['key'],
+            UploadId=state['upload_id']
+        )
+    except (botocore.exceptions.BotoCoreError,
+            botocore.exceptions.ClientError) as exc:
+        logger.warning("Error aborting upload to 's3://%s/%s': %s",
+                       state['bucket'], state['key'], exc)
+
+
+class RangedDownload(object):
+    """Downloads a URL in parts of part_size bytes with up to concurrency
+    threads (subclasses store the parts)
+    """
+    max_parts = None
+    min_part_size = 1
+
+    def __init__(self, url, state_path, concurrency=None, part_size=None,
+                 timeout=None, retries=None):
+        self.url = url
+        self.state_path = state_path
+        self.concurrency = (concurrency or
+                            settings.REFINERY_DOWNLOAD_CONCURRENCY)
+        self.part_size = (part_size or
+                          settings.REFINERY_DOWNLOAD_PART_SIZE * 1024 * 1024)
+        self.timeout = timeout or settings.REFINERY_DOWNLOAD_TIMEOUT
+        if retries is None:
+            retries = settings.REFINERY_DOWNLOAD_RETRIES
+        self.retries = retries
+        self.size = None
+        self.validator = None
+        self.state = None
+        self._progress_report = None
+        self._lock = threading.Lock()
+        self._failed = threading.Event()
+        self._local = threading.local()
+        self._sessions = []
+
+    def _session(self):
+        """Returns the requests.Session of the current thread"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            # sizes and ranges have to refer to the file itself
+            session.headers['Accept-Encoding'] = 'identity'
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def probe(self):
+        """Looks up the size and version of the file
+        :returns: True if the server accepts range requests for the file
+        """
+        if urlparse(self.url).scheme not in ('http', 'https'):
+            return False
+        response = self._session().head(self.url, allow_redirects=True,
+                                        timeout=self.timeout)
+        if not response.ok:  # not all servers support HEAD requests
+            response = self._session().get(self.url, stream=True,
+                                           timeout=self.timeout)
+            response.close()
+        response.raise_for_status()
+        try:
+            self.size = int(response.headers['Content-Length'])
+        except (KeyError, ValueError):
+            self.size = None
+        # If-Range requires a strong validator
+        etag = response.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            self.validator = etag
+        else:
+            self.validator = response.headers.get('Last-Modified')
+        accepts_ranges = response.headers.get('Accept-Ranges', '').lower()
+        return bool(self.size) and accepts_ranges == 'bytes'
+
+    def run(self, progress_report=lambda _: None):
+        """Downloads the file or the parts missing after an interrupted
+        download of the same file
+        :returns: False without downloading anything if the server doesn't
+        accept range requests or another process is downloading the file
+        """
+        make_dir(os.path.dirname(self.state_path))
+        lock_file = lock(self.state_path + '.lock')
+        if lock_file is None:
+            logger.info("'%s' is being downloaded by another process",
+                        self.url)
+            return False
+        try:
+            if not self.probe():
+                logger.debug("Range requests not supported for '%s'",
+                             self.url)
+                return False
+            self._download(progress_report)
+            return True
+        finally:
+            self.close()
+            for session in self._sessions:
+                session.close()
+            lock_file.close()
+
+    def _download(self, progress_report):
+        previous_state = load_state(self.state_path)
+        if (previous_state and self.validator and
+                previous_state['url'] == self.url and
+                previous_state['size'] == self.size and
+                previous_state['validator'] == self.validator and
+                self.resume(previous_state)):
+            self.state = previous_state
+            self.part_size = self.state['part_size']
+            logger.info("Resuming download of '%s' (%s of %s parts done)",
+                        self.url, len(self.state['parts']),
+                        self._num_parts())
+        else:
+            if self.max_parts:
+                self.part_size = max(self.part_size,
+                                     -(-self.size // self.max_parts))
+            self.part_size = max(self.part_size, self.min_part_size)
+            self.state = {
+                'url': self.url, 'size': self.size,
+                'validator': self.validator, 'part_size': self.part_size,
+                'parts': {}
+            }
+            self.state.update(self.start(previous_state))
+        save_state(self.state_path, self.state)
+
+        self._progress_report = progress_report
+        remaining = [index for index in range(self._num_parts())
+                     if str(index) not in self.state['parts']]
+        done_bytes = sum(self._part_range(int(index))[1]
+                         for index in self.state['parts'])
+        if done_bytes:
+            progress_report(done_bytes)
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            futures = [executor.submit(self._download_part, index)
+                       for index in remaining]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                # let the queued parts return right away
+                self._failed.set()
+                raise
+
+        self.finish()
+        os.remove(self.state_path)
+        logger.info("Downloaded '%s' in %s parts", self.url,
+                    self._num_parts())
+
+    def _num_parts(self):
+        return -(-self.size // self.part_size)
+
+    def _part_range(self, index):
+        """Returns offset and length of a part"""
+        offset = index * self.part_size
+        return offset, min(self.part_size, self.size - offset)
+
+    def _download_part(self, index):
+        offset, length = self._part_range(index)
+        headers = {'Range': 'bytes={}-{}'.format(offset, offset + length - 1)}
+        if self.validator:
+            headers['If-Range'] = self.validator
+        for attempt in range(self.retries + 1):
+            if self._failed.is_set():
+                return
+            response = None
+            try:
+                response = self._session().get(self.url, headers=headers,
+                                               stream=True,
+                                               timeout=self.timeout)
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise RuntimeError(
+                        "'{}' has changed or doesn't support range "
+                        "requests anymore".format(self.url)
+                    )
+                part = self.write_part(index, offset, length, self._read(
+                    response.iter_content(CHUNK_SIZE), length
+                ))
+                break
+            except (requests.exceptions.RequestException,
+                    IncompletePart) as exc:
+                if attempt == self.retries:
+                    raise
+                logger.warning("Retrying part %s of '%s': %s",
+                               index, self.url, exc)
+            finally:
+                if response is not None:
+                    response.close()
+        with self._lock:
+            self.state['parts'][str(index)] = part
+            self.save_part()
+            save_state(self.state_path, self.state)
+        self._progress_report(length)
+
+    @staticmethod
+    def _read(chunks, length):
+        received = 0
+        for chunk in chunks:
+            received += len(chunk)
+            yield chunk
+        if received != length:
+            raise IncompletePart("Received {} of {} bytes".format(received,
+                                                                  length))
+
+    # methods to implement by subclasses
+
+    def start(self, previous_state):
+        """Prepares a new download (previous_state: state of a download
+        that can't be resumed or None)
+        :returns: dict of items to add to the state
+        """
+        return {}
+
+    def resume(self, state):
+        """Returns True if the download of state can be continued"""
+        return True
+
+    def write_part(self, index, offset, length, chunks):
+        """Stores the data of a part
+        :returns: JSON serializable information about the stored part
+        """
+        raise NotImplementedError
+
+    def save_part(self):
+        """Ensures that written parts survive a crash before they are
+        recorded in the state
+        """
+
+    def finish(self):
+        """Completes the download (called while holding the lock)"""
+
+    def close(self):
+        pass
+
+
+class FileDownload(RangedDownload):
+    """Downloads a URL into a partial file in the download dir of the file
+    store whose path is the same for all downloads of the URL and moves it
+    to destination when it is complete
+    """
+    def __init__(self, url, destination, **kwargs):
+        super(FileDownload, self).__init__(
+            url, get_state_path(url, directory=get_download_dir()), **kwargs
+        )
+        self.destination = destination
+        self.path = os.path.splitext(self.state_path)[0] + '.part'
+        self._fd = None
+
+    def start(self, previous_state):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC,
+                           0o600)
+        try:
+            os.posix_fallocate(self._fd, 0, self.size)
+        except OSError:  # not supported by all file systems
+            os.ftruncate(self._fd, self.size)
+        return {}
+
+    def resume(self, state):
+        try:
+            self._fd = os.open(self.path, os.O_RDWR)
+        except OSError:
+            return False
+        if os.fstat(self._fd).st_size != self.size:
+            self.close()
+            return False
+        return True
+
+    def write_part(self, index, offset, length, chunks):
+        for chunk in chunks:
+            os.pwrite(self._fd, chunk, offset)
+            offset += len(chunk)
+
+    def save_part(self):
+        os.fdatasync(self._fd)
+
+    def finish(self):
+        os.fsync(self._fd)
+        # renamed within the file store and before another process can
+        # start a new download into the partial file
+        move_file(self.path, self.destination)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class S3Download(RangedDownload):
+    """Downloads a URL into an S3 object with a multipart upload: each part
+    of the download is uploaded as one part. When a download is resumed the
+    key of the interrupted upload is used instead of the given one.
+    """
+    max_parts = 10000
+    min_part_size = 5 * 1024 * 1024  # except for the last part
+
+    def __init__(self, url, bucket, key, **kwargs):
+        super(S3Download, self).__init__(url, get_state_path(url, bucket),
+                                         **kwargs)
+        self.bucket = bucket
+        self.key = key
+        self._s3 = get_s3_client()
+
+    def start(self, previous_state):
+        if previous_state and previous_state.get('upload_id'):
+            try:
+                self._s3.abort_multipart_upload(
+                    Bucket=self.bucket, Key=previous_state['key'],
+                    UploadId=previous_state['upload_id']
+                )
+            except (botocore.exceptions.BotoCoreError,
+                    botocore.exceptions.ClientError) as exc:
+                logger.warning("Error aborting upload to 's3://%s/%s': %s",
+                               self.bucket, previous_state['key'], exc)
+        response = self._s3.create_multipart_upload(
+            Bucket=self.bucket, Key=self.key, **S3_WRITE_ARGS
+        )
+        return {'bucket': self.bucket, 'key': self.key,
+                'upload_id': response['UploadId']}
+
+    def resume(self, state):
+        try:
+            self._s3.list_parts(Bucket=self.bucket, Key=state['key'],
+                                UploadId=state['upload_id'], MaxParts=1)
+        except botocore.exceptions.ClientError as exc:
+            logger.info("Can't resume upload to 's3://%s/%s': %s",
+                        self.bucket, state['key'], exc)
+            return False
+        self.key = state['key']
+        return True
+
+    def write_part(self, index, offset, length, chunks):
+        response = self._s3.upload_part(
+            Bucket=self.bucket, Key=self.key,
+            UploadId=self.state['upload_id'], PartNumber=index + 1,
+            Body=b''.join(chunks)
+        )
+        return response['ETag']
+
+    def finish(self):
+        parts = sorted((int(index) + 1, etag)
+                       for index, etag in self.state['parts'].items())
+        self._s3.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key,
+            UploadId=self.state['upload_id'],
+            MultipartUpload={'Parts': [
+                {'PartNumber': number, 'ETag': etag}
+                for number, etag in parts
+            ]}
+        )
@@ -0,0 +1,132 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import threading
+import time
+from types import SimpleNamespace
+from urllib.request import urlopen
+
+from django.core.management.base import BaseCommand
+
+from ...tasks import ProgressPercentage
+
+
+class FakeTask(object):
+    """Stands in for a bound FileImportTask: counts the updates of the task
+    state and simulates the latency of a write to the result backend
+    """
+    def __init__(self, latency):
+        self.latency = latency
+        self.updates = 0
+        self.request = SimpleNamespace(id='benchmark')
+
+    def update_state(self, task_id=None, state=None, meta=None):
+        self.updates += 1
+        time.sleep(self.latency)
+
+
+class ChunkProgress(object):
+    """Reports progress on every chunk (the behaviour before updates were
+    coalesced by ProgressPercentage)
+    """
+    def __init__(self, task):
+        self._task = task
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_amount):
+        with self._lock:
+            self._task.update_state(task_id=self._task.request.id,
+                                    state='PROGRESS')
+
+
+def start_file_server(size):
+    """Serves size random bytes on a local port from a background thread
+    :returns: the server and the URL of the file
+    """
+    body = os.urandom(size)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except ConnectionError:
+                # file size lookups close the connection after the headers
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{}/data.bin'.format(server.server_port)
+
+
+def transfer(url, chunk_size, progress_report):
+    """Downloads the file in chunks and discards it
+    :returns: transfer time in seconds
+    """
+    start = time.time()
+    with urlopen(url, timeout=30) as response:
+        for chunk in iter(lambda: response.read(chunk_size), b''):
+            progress_report(len(chunk))
+    return time.time() - start
+
+
+class Command(BaseCommand):
+    help = """Benchmarks the overhead of file import progress reporting on a
+    download from a local HTTP server, with updates of the task state on
+    every chunk and coalesced by ProgressPercentage
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            action='store',
+            type=int,
+            default=256,
+            help='Size of the file in MB'
+        )
+        parser.add_argument(
+            '--chunk_size',
+            action='store',
+            type=int,
+            default=8,
+            help='Number of KB per progress callback (boto3 reports about '
+                 'every 8 KB)'
+        )
+        parser.add_argument(
+            '--latency',
+            action='store',
+            type=float,
+            default=0.2,
+            help='Simulated milliseconds per result backend write'
+        )
+
+    def handle(self, *args, **options):
+        size = options['size'] * 1024 * 1024
+        chunk_size = options['chunk_size'] * 1024
+        server, url = start_file_server(size)
+        try:
+            baseline = transfer(url, chunk_size, lambda _: None)
+            self.stdout.write("{} MB transferred in {:.2f} sec without "
+                              "progress reports".format(options['size'],
+                                                        baseline))
+            reporters = [
+                ('on every chunk', ChunkProgress),
+                ('coalesced', lambda task: ProgressPercentage(url, task)),
+            ]
+            for label, reporter in reporters:
+                task = FakeTask(options['latency'] / 1000.0)
+                seconds = transfer(url, chunk_size, reporter(task))
+                self.stdout.write(
+                    "Progress reported {}: {:.2f} sec ({:+.2f} sec), {} "
+                    "updates".format(label, seconds, seconds - baseline,
+                                     task.updates)
+                )
+        finally:
+            server.shutdown()
+            server.server_close()
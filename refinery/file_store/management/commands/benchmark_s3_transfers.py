@@ -0,0 +1,84 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from boto3.s3.transfer import TransferConfig
+import botocore
+
+from ...utils import create_s3_client, get_transfer_config
+
+
+class Command(BaseCommand):
+    help = """Benchmarks uploads and downloads of a large file with the
+    default boto3 transfer configuration and the one of the settings
+    (get_transfer_config()), e.g. against a local S3-compatible server
+    started with 'moto_server s3 -p 5000' and --endpoint_url
+    http://127.0.0.1:5000. moto is an optional development tool (install it
+    with 'pip install moto[server]' in a separate virtualenv); it is not a
+    dependency of Refinery.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--endpoint_url',
+            action='store',
+            help='URL of an S3-compatible server (default: AWS)'
+        )
+        parser.add_argument(
+            '--bucket',
+            action='store',
+            default='refinery-transfer-benchmark',
+            help='Bucket for the test object (created if necessary)'
+        )
+        parser.add_argument(
+            '--size',
+            action='store',
+            type=int,
+            default=512,
+            help='Size of the file in MB'
+        )
+
+    def handle(self, *args, **options):
+        s3 = create_s3_client(endpoint_url=options['endpoint_url'])
+        bucket = options['bucket']
+        key = 'benchmark.bin'
+        size = options['size']
+        try:
+            s3.head_bucket(Bucket=bucket)
+        except botocore.exceptions.ClientError:
+            s3.create_bucket(Bucket=bucket)
+
+        configs = [('default', TransferConfig()),
+                   ('settings', get_transfer_config())]
+        with tempfile.NamedTemporaryFile() as source, \
+                tempfile.NamedTemporaryFile() as destination:
+            for _ in range(size):
+                source.write(os.urandom(1024 * 1024))
+            source.flush()
+            try:
+                for label, config in configs:
+                    source.seek(0)
+                    start = time.time()
+                    s3.upload_fileobj(source, bucket, key, Config=config)
+                    upload_time = time.time() - start
+
+                    destination.seek(0)
+                    destination.truncate()
+                    start = time.time()
+                    s3.download_fileobj(bucket, key, destination,
+                                        Config=config)
+                    download_time = time.time() - start
+                    self.stdout.write(
+                        "{} MB with {} transfer configuration: upload "
+                        "{:.1f} MB/s, download {:.1f} MB/s".format(
+                            size, label, size / upload_time,
+                            size / download_time
+                        )
+                    )
+            except (botocore.exceptions.BotoCoreError,
+                    botocore.exceptions.ClientError) as exc:
+                raise CommandError("S3 transfer failed: {}".format(exc))
+            finally:
+                s3.delete_object(Bucket=bucket, Key=key)
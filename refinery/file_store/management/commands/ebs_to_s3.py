@@ -1,14 +1,14 @@
 import os
 import logging
 
-import boto3
 import botocore
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
 from ...models import FileStoreItem
-from ...utils import S3MediaStorage, S3_WRITE_ARGS
+from ...utils import (S3MediaStorage, S3_WRITE_ARGS, get_s3_client,
+                      get_transfer_config)
 
 logging.disable(logging.INFO)  # boto3 logging is verbose at DEBUG level
 
@@ -19,7 +19,7 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         storage = S3MediaStorage()
-        s3 = boto3.client('s3')
+        s3 = get_s3_client()
         for item in FileStoreItem.objects.all():
             try:
                 file_name = os.path.basename(item.datafile.path)
@@ -44,7 +44,8 @@ class Command(BaseCommand):
                 item.datafile.path, settings.MEDIA_BUCKET, key))
             try:
                 s3.upload_file(item.datafile.path, settings.MEDIA_BUCKET, key,
-                               ExtraArgs=S3_WRITE_ARGS)
+                               ExtraArgs=S3_WRITE_ARGS,
+                               Config=get_transfer_config())
             except (EnvironmentError, botocore.exceptions.BotoCoreError,
                     botocore.exceptions.ClientError) as exc:
                 raise CommandError(
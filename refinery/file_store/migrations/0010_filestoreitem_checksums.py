@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_store', '0009_xls_filetypes_and_fileextensions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filestoreitem',
+            name='md5',
+            field=models.CharField(max_length=32, editable=False,
+                                   blank=True),
+        ),
+        migrations.AddField(
+            model_name='filestoreitem',
+            name='sha256',
+            field=models.CharField(max_length=64, editable=False,
+                                   blank=True),
+        ),
+    ]
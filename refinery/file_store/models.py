@@ -7,6 +7,7 @@
 import logging
 import os
 import re
+import uuid
 
 from django.conf import settings
 from django.db import models
@@ -20,6 +21,8 @@ from django_extensions.db.fields import UUIDField
 import constants
 import core
 
+from .utils import Checksums
+
 logger = logging.getLogger(__name__)
 
 
@@ -96,6 +99,9 @@ class FileStoreItem(models.Model):
     filetype = models.ForeignKey(FileType, blank=True, null=True)
     # ID of Celery task used for importing the data file
     import_task_id = UUIDField(auto=False, blank=True)
+    # hex digests of the data file computed during import (blank if unknown)
+    md5 = models.CharField(blank=True, editable=False, max_length=32)
+    sha256 = models.CharField(blank=True, editable=False, max_length=64)
     # Date created
     created = models.DateTimeField(auto_now_add=True)
     # Date updated
@@ -141,6 +147,29 @@ class FileStoreItem(models.Model):
             logger.critical("Error getting size for '%s': %s", self, exc)
             return 0
 
+    def update_checksums(self):
+        """Calculate and store the checksums of the data file (for files
+        imported without reading the data, e.g., moved or reflinked)
+        :returns: True if the checksums were updated
+        """
+        checksums = Checksums()
+        try:
+            self.datafile.open('rb')
+            try:
+                checksums.update_from_file(self.datafile)
+            finally:
+                self.datafile.close()
+        except ValueError:  # no datafile
+            return False
+        except (EnvironmentError, botocore.exceptions.BotoCoreError,
+                botocore.exceptions.ClientError) as exc:
+            logger.error("Error calculating checksums of '%s': %s", self, exc)
+            return False
+        self.md5 = checksums.md5
+        self.sha256 = checksums.sha256
+        self.save(update_fields=['md5', 'sha256'])
+        return True
+
     def get_extension(self):
         """Return extension of datafile name or file name in source"""
         if self.datafile.name:
@@ -153,6 +182,7 @@ class FileStoreItem(models.Model):
         self.terminate_file_import_task()
         if self.datafile:
             file_name = self.datafile.name
+            self.md5 = self.sha256 = ''
             try:
                 self.datafile.delete(save=save_instance)
             except (EnvironmentError, botocore.exceptions.BotoCoreError,
@@ -195,12 +225,15 @@ class FileStoreItem(models.Model):
         data file to
         """
         file_store_item.datafile = self.datafile
+        file_store_item.md5 = self.md5
+        file_store_item.sha256 = self.sha256
         file_store_item.save()
         # It's crucial to clear the datafile of the prior
         # FileStoreItem as well. Otherwise there would be two
         # references to the same data file which could cause
         # unintended side-effects
         self.datafile = None
+        self.md5 = self.sha256 = ''
         self.save()
 
 
@@ -232,3 +265,41 @@ def _get_file_extension(extension):
         if not extension:
             raise
         return _get_file_extension('.'.join(extension.split('.')[1:]))
+
+
+def bulk_create_file_store_items(sources, batch_size=None):
+    """Create FileStoreItems for a list of sources with as few queries as
+    possible and return them in the same order
+    Applies the same source mapping and file type detection as
+    FileStoreItem.save() but looks up each file extension only once
+    """
+    filetypes = {}
+    items = []
+    for source in sources:
+        item = FileStoreItem(uuid=str(uuid.uuid4()),
+                             source=_map_source(source))
+        extension = item.get_extension()
+        if extension not in filetypes:
+            try:
+                filetypes[extension] = _get_file_extension(extension).filetype
+            except FileExtension.DoesNotExist as exc:
+                logger.warn("Could not assign type to file '%s': %s",
+                            item, exc)
+                filetypes[extension] = None
+            except FileExtension.MultipleObjectsReturned as exc:
+                logger.critical("Could not assign type to file '%s': %s",
+                                item, exc)
+                filetypes[extension] = None
+        item.filetype = filetypes[extension]
+        items.append(item)
+    FileStoreItem.objects.bulk_create(items, batch_size=batch_size)
+    # bulk_create() does not set primary keys
+    ids = {}
+    chunk_size = batch_size or len(items) or 1
+    for start in range(0, len(items), chunk_size):
+        ids.update(FileStoreItem.objects.filter(
+            uuid__in=[item.uuid for item in items[start:start + chunk_size]]
+        ).values_list('uuid', 'id'))
+    for item in items:
+        item.id = ids[item.uuid]
+    return items
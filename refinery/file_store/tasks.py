@@ -2,6 +2,7 @@
 import os
 import tempfile
 import threading
+import time
 from urllib.parse import urlparse
 from urllib.request import urlopen
 
@@ -11,9 +12,10 @@ import botocore
 import celery
 import requests
 
+from .download import FileDownload, S3Download, remove_abandoned_downloads
 from .models import FileStoreItem
-from .utils import (S3MediaStorage, SymlinkedFileSystemStorage,
-                    copy_file_object, copy_s3_object, delete_file,
+from .utils import (Checksums, S3MediaStorage, SymlinkedFileSystemStorage,
+                    copy_file, copy_file_object, copy_s3_object, delete_file,
                     delete_s3_object, download_s3_object, get_file_size,
                     make_dir, move_file, parse_s3_url, symlink_file,
                     upload_file_object)
@@ -61,32 +63,39 @@ class FileImportTask(celery.Task):
         item.save()
 
         # transfer data file
+        checksums = Checksums()
         try:
             if settings.REFINERY_S3_USER_DATA:
                 if os.path.isabs(item.source):
                     file_store_name = self.import_path_to_s3(
-                        item.source, target_name=target_name
+                        item.source, target_name=target_name,
+                        checksums=checksums
                     )
                 elif item.source.startswith('s3://'):
                     file_store_name = self.import_s3_to_s3(
-                        item.source, target_name=target_name
+                        item.source, target_name=target_name,
+                        checksums=checksums
                     )
                 else:
                     file_store_name = self.import_url_to_s3(
-                        item.source, target_name=target_name
+                        item.source, target_name=target_name,
+                        checksums=checksums
                     )
             else:
                 if os.path.isabs(item.source):
                     file_store_name = self.import_path_to_path(
-                        item.source, target_name=target_name
+                        item.source, target_name=target_name,
+                        checksums=checksums
                     )
                 elif item.source.startswith('s3://'):
                     file_store_name = self.import_s3_to_path(
-                        item.source, target_name=target_name
+                        item.source, target_name=target_name,
+                        checksums=checksums
                     )
                 else:
                     file_store_name = self.import_url_to_path(
-                        item.source, target_name=target_name
+                        item.source, target_name=target_name,
+                        checksums=checksums
                     )
         except (RuntimeError, celery.exceptions.SoftTimeLimitExceeded) as exc:
             logger.error("File import failed: %s", exc)
@@ -95,13 +104,19 @@ class FileImportTask(celery.Task):
             raise celery.exceptions.Ignore()
 
         item.datafile.name = file_store_name
+        if checksums.complete:
+            item.md5 = checksums.md5
+            item.sha256 = checksums.sha256
         item.save()
         logger.info("Imported FileStoreItem with UUID '%s'", item_uuid)
 
-    def import_path_to_path(self, source_path, symlink=True, target_name=None):
+    def import_path_to_path(self, source_path, symlink=True, target_name=None,
+                            checksums=None):
         """Import file from an absolute file system path into
         REFINERY_FILE_STORE_ROOT
         """
+        if checksums is None:
+            checksums = Checksums()
         storage = SymlinkedFileSystemStorage()
         if target_name is None:
             target_name = os.path.basename(source_path)
@@ -112,19 +127,21 @@ class FileImportTask(celery.Task):
                      source_path, file_store_path)
         if source_path.startswith((settings.REFINERY_DATA_IMPORT_DIR,
                                    tempfile.gettempdir())):
+            # no checksums: the file is renamed without reading the data
             move_file(source_path, file_store_path)
         else:
             if symlink:
+                # no checksums: the file is not owned by the file store and
+                # may change
                 symlink_file(source_path, file_store_path)
             else:
                 make_dir(os.path.dirname(file_store_path))
                 try:
                     with open(source_path, 'rb') as source, \
                             open(file_store_path, 'wb') as destination:
-                        copy_file_object(source, destination,
-                                         ProgressPercentage(
-                                             source_path, self.request.id
-                                         ))
+                        copy_file(source, destination,
+                                  ProgressPercentage(source_path, self),
+                                  checksums)
                 except EnvironmentError as exc:
                     delete_file(file_store_path)
                     raise RuntimeError("Error copying '{}' to '{}': {}".format(
@@ -135,8 +152,10 @@ class FileImportTask(celery.Task):
 
         return file_store_name
 
-    def import_path_to_s3(self, source_path, target_name=None):
+    def import_path_to_s3(self, source_path, target_name=None, checksums=None):
         """Import file from an absolute file system path into MEDIA_BUCKET"""
+        if checksums is None:
+            checksums = Checksums()
         storage = S3MediaStorage()
         if target_name is None:
             target_name = os.path.basename(source_path)
@@ -147,8 +166,9 @@ class FileImportTask(celery.Task):
         try:
             with open(source_path, 'rb') as source_file_object:
                 upload_file_object(
-                    source_file_object, settings.MEDIA_BUCKET, file_store_name,
-                    ProgressPercentage(source_path, self.request.id)
+                    source_file_object, settings.MEDIA_BUCKET,
+                    file_store_name, ProgressPercentage(source_path, self),
+                    checksums
                 )
         except (EnvironmentError, botocore.exceptions.BotoCoreError,
                 botocore.exceptions.ClientError) as exc:
@@ -162,8 +182,10 @@ class FileImportTask(celery.Task):
 
         return file_store_name
 
-    def import_s3_to_path(self, source_url, target_name=None):
+    def import_s3_to_path(self, source_url, target_name=None, checksums=None):
         """Import S3 object from s3:// URL into REFINERY_FILE_STORE_ROOT"""
+        if checksums is None:
+            checksums = Checksums()
         source_bucket, source_key = parse_s3_url(source_url)
         storage = SymlinkedFileSystemStorage()
         if target_name is None:
@@ -177,8 +199,8 @@ class FileImportTask(celery.Task):
         try:
             with open(file_store_path, 'wb') as destination:
                 download_s3_object(source_bucket, source_key, destination,
-                                   ProgressPercentage(source_url,
-                                                      self.request.id))
+                                   ProgressPercentage(source_url, self),
+                                   checksums)
         except (EnvironmentError, botocore.exceptions.BotoCoreError,
                 botocore.exceptions.ClientError) as exc:
             delete_file(file_store_path)
@@ -195,7 +217,7 @@ class FileImportTask(celery.Task):
 
         return file_store_name
 
-    def import_s3_to_s3(self, source_url, target_name=None):
+    def import_s3_to_s3(self, source_url, target_name=None, checksums=None):
         """Transfer S3 object from UPLOAD_BUCKET to MEDIA_BUCKET"""
         source_bucket, source_key = parse_s3_url(source_url)
         storage = S3MediaStorage()
@@ -205,11 +227,11 @@ class FileImportTask(celery.Task):
         logger.debug("Transferring from 's3://%s/%s' to 's3://%s/%s'",
                      source_bucket, source_key, settings.MEDIA_BUCKET,
                      file_store_name)
+        # no checksums: the data is copied by S3 without passing through here
         try:
             copy_s3_object(
                 source_bucket, source_key, settings.MEDIA_BUCKET,
-                file_store_name, ProgressPercentage(source_url,
-                                                    self.request.id)
+                file_store_name, ProgressPercentage(source_url, self)
             )
         except (botocore.exceptions.BotoCoreError,
                 botocore.exceptions.ClientError) as exc:
@@ -227,8 +249,10 @@ class FileImportTask(celery.Task):
 
         return file_store_name
 
-    def import_url_to_path(self, source_url, target_name=None):
+    def import_url_to_path(self, source_url, target_name=None, checksums=None):
         """Import file from URL into REFINERY_FILE_STORE_ROOT"""
+        if checksums is None:
+            checksums = Checksums()
         # move the file from temp dir into file store dir
         storage = SymlinkedFileSystemStorage()
         # remove query string from URL before extracting file name
@@ -240,12 +264,17 @@ class FileImportTask(celery.Task):
         logger.debug("Transferring from '%s' to '%s'",
                      source_url, file_store_path)
         make_dir(os.path.dirname(file_store_path))
+        progress_report = ProgressPercentage(source_url, self)
         try:
-            with urlopen(source_url, timeout=30) as response, \
-                    open(file_store_path, 'wb') as destination:
-                copy_file_object(response, destination,
-                                 ProgressPercentage(source_url,
-                                                    self.request.id))
+            # continues an interrupted download of the same URL
+            download = FileDownload(source_url, file_store_path)
+            if not download.run(progress_report):
+                # no checksums otherwise: the parts are downloaded out of
+                # order
+                with urlopen(source_url, timeout=30) as response, \
+                        open(file_store_path, 'wb') as destination:
+                    copy_file_object(response, destination, progress_report,
+                                     checksums)
         except EnvironmentError as exc:
             delete_file(file_store_path)
             raise RuntimeError("Error downloading from '{}': '{}'".format(
@@ -255,8 +284,10 @@ class FileImportTask(celery.Task):
 
         return file_store_name
 
-    def import_url_to_s3(self, source_url, target_name=None):
+    def import_url_to_s3(self, source_url, target_name=None, checksums=None):
         """Download file from URL and upload to MEDIA_BUCKET"""
+        if checksums is None:
+            checksums = Checksums()
         storage = S3MediaStorage()
         # remove query string from URL before extracting file name
         if target_name is None:
@@ -265,12 +296,20 @@ class FileImportTask(celery.Task):
 
         logger.debug("Transferring from '%s' to 's3://%s/%s'",
                      source_url, settings.MEDIA_BUCKET, file_store_name)
+        progress_report = ProgressPercentage(source_url, self)
         try:
-            with urlopen(source_url, timeout=30) as response:
-                upload_file_object(
-                    response, settings.MEDIA_BUCKET, file_store_name,
-                    ProgressPercentage(source_url, self.request.id)
-                )
+            # uploads the downloaded parts as parts of a multipart upload
+            # and continues an interrupted upload of the same URL
+            download = S3Download(source_url, settings.MEDIA_BUCKET,
+                                  file_store_name)
+            if download.run(progress_report):
+                # no checksums: the parts are uploaded out of order
+                file_store_name = download.key
+            else:
+                with urlopen(source_url, timeout=30) as response:
+                    upload_file_object(response, settings.MEDIA_BUCKET,
+                                       file_store_name, progress_report,
+                                       checksums)
         except (EnvironmentError, botocore.exceptions.BotoCoreError,
                 botocore.exceptions.ClientError) as exc:
             raise RuntimeError(
@@ -287,15 +326,34 @@ class FileImportTask(celery.Task):
 class ProgressPercentage(object):
     """Callable for progress monitoring of file transfers
     https://boto3.readthedocs.io/en/stable/_modules/boto3/s3/transfer.html
+    Transfers report progress every few KB, so updates of the task state are
+    coalesced: the state is only written when at least min_interval seconds
+    have passed and the transfer has progressed by at least min_step percent
+    since the last update (size of the file permitting), and on completion
     """
-    def __init__(self, file_location, task_id):
+    def __init__(self, file_location, task, min_interval=None, min_step=None):
         self._file_size = get_file_size(file_location)
-        self._import_task_id = task_id
+        self._task = task
+        # transfers report progress from their own threads, which don't have
+        # the request of the task
+        self._task_id = task.request.id
+        if min_interval is None:
+            min_interval = settings.REFINERY_IMPORT_PROGRESS_INTERVAL
+        if min_step is None:
+            min_step = settings.REFINERY_IMPORT_PROGRESS_STEP
+        self._min_interval = min_interval
+        self._min_step = min_step
         self._seen_so_far = 0
+        self._last_update = None  # time of the last update of the state
+        self._last_percent_done = 0
         self._lock = threading.Lock()
+        # the state is written outside of _lock, so that transfer threads
+        # don't wait for the result backend, but in order
+        self._update_lock = threading.Lock()
+        self._updates = 0  # number of the last update that was decided on
+        self._last_written = 0  # number of the last update that was written
 
     def __call__(self, bytes_amount):
-        # to simplify we'll assume this is hooked up to a single filename
         with self._lock:
             self._seen_so_far += bytes_amount
             # file size may not be available for some download objects
@@ -303,12 +361,30 @@ class ProgressPercentage(object):
                 percent_done = (self._seen_so_far / self._file_size) * 100
             else:
                 percent_done = 0
-            FileImportTask().update_state(
-                self._import_task_id, state='PROGRESS', meta={
-                    'percent_done': '{:.0f}'.format(percent_done),
-                    'current': self._seen_so_far, 'total': self._file_size
-                }
-            )
+            now = time.monotonic()
+            if self._file_size > 0 and self._seen_so_far >= self._file_size:
+                # always report completion (once)
+                if self._last_percent_done >= 100:
+                    return
+            elif self._last_update is not None and (
+                    now - self._last_update < self._min_interval or
+                    (self._file_size > 0 and percent_done -
+                     self._last_percent_done < self._min_step)):
+                return
+            self._last_update = now
+            self._last_percent_done = percent_done
+            self._updates += 1
+            update = self._updates
+            meta = {
+                'percent_done': '{:.0f}'.format(percent_done),
+                'current': self._seen_so_far, 'total': self._file_size
+            }
+        with self._update_lock:
+            if update < self._last_written:  # a later state was written
+                return
+            self._last_written = update
+            self._task.update_state(task_id=self._task_id, state='PROGRESS',
+                                    meta=meta)
 
 
 @celery.task.task()
@@ -326,6 +402,14 @@ def download_file(url, target_path, file_size=1):
     # TODO: handle out of disk space condition
     logger.debug("Downloading file from '%s'", url)
 
+    try:
+        if FileDownload(url, target_path).run():
+            logger.debug("Finished downloading")
+            return
+    except (EnvironmentError, RuntimeError) as exc:
+        logger.error(exc)
+        raise RuntimeError("Could not download '{}': {}".format(url, exc))
+
     # check if source file can be downloaded
     try:
         response = requests.get(url, stream=True)
@@ -373,3 +457,14 @@ def download_file(url, target_path, file_size=1):
 
     response.close()
     logger.debug("Finished downloading")
+
+
+@celery.task.task()
+def clean_up_downloads():
+    """Removes the partial files of URL imports that have not been continued
+    for REFINERY_DOWNLOAD_MAX_AGE hours
+    """
+    removed = remove_abandoned_downloads(
+        settings.REFINERY_DOWNLOAD_MAX_AGE * 3600
+    )
+    logger.info("Removed %s abandoned downloads", removed)
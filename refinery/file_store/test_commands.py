@@ -0,0 +1,14 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+
+class BenchmarkImportProgressCommandTest(SimpleTestCase):
+    def test_benchmark_import_progress(self):
+        out = StringIO()
+        call_command("benchmark_import_progress", size=1, chunk_size=64,
+                     latency=0, stdout=out)
+        self.assertIn("1 MB transferred", out.getvalue())
+        self.assertIn("Progress reported on every chunk", out.getvalue())
+        self.assertIn("Progress reported coalesced", out.getvalue())
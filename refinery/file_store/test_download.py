@@ -0,0 +1,278 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+import mock
+
+from .download import (FileDownload, S3Download, get_state_path, load_state,
+                       lock, remove_abandoned_downloads, save_state)
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serves server.body with support for single byte range requests (if
+    server.accept_ranges) and records the requested ranges
+    """
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def _respond(self, send_body):
+        body = self.server.body
+        match = re.match(r'bytes=(\d+)-(\d+)$',
+                         self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if (match and self.server.accept_ranges and
+                if_range in (None, self.server.etag)):
+            start, end = int(match.group(1)), int(match.group(2))
+            self.server.ranges.append((start, end))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end, len(body)
+            ))
+            body = body[start:end + 1]
+        else:
+            self.send_response(200)
+        if self.server.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', self.server.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadTestBase(SimpleTestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+        self.server.body = os.urandom(10 * 1000 + 10)
+        self.server.accept_ranges = True
+        self.server.etag = '"v1"'
+        self.server.ranges = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:{}/file.fastq'.format(
+            self.server.server_port
+        )
+        self.progress_report = mock.Mock()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _reported_bytes(self):
+        return sum(call[0][0]
+                   for call in self.progress_report.call_args_list)
+
+
+class FileDownloadTest(DownloadTestBase):
+    def setUp(self):
+        super(FileDownloadTest, self).setUp()
+        self.file_store_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            REFINERY_FILE_STORE_ROOT=self.file_store_dir
+        )
+        self.settings_override.enable()
+        self.destination = os.path.join(self.file_store_dir, 'ab', 'cd',
+                                        'file.fastq')
+        self.download = self._file_download()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.file_store_dir)
+        super(FileDownloadTest, self).tearDown()
+
+    def _file_download(self):
+        return FileDownload(self.url, self.destination, concurrency=3,
+                            part_size=1000, timeout=5, retries=0)
+
+    def _downloaded_data(self):
+        with open(self.destination, 'rb') as downloaded_file:
+            return downloaded_file.read()
+
+    def test_download_in_parts(self):
+        self.assertTrue(self.download.run(self.progress_report))
+        self.assertEqual(self._downloaded_data(), self.server.body)
+        self.assertEqual(len(self.server.ranges), 11)
+        self.assertEqual(self._reported_bytes(), len(self.server.body))
+        self.assertFalse(os.path.exists(self.download.state_path))
+        self.assertFalse(os.path.exists(self.download.path))
+
+    def test_partial_file_is_in_file_store(self):
+        self.assertTrue(self.download.path.startswith(self.file_store_dir))
+        self.assertTrue(
+            self.download.state_path.startswith(self.file_store_dir)
+        )
+
+    def test_file_is_moved_while_holding_lock(self):
+        def assert_locked(source, destination):
+            self.assertIsNone(lock(self.download.state_path + '.lock'))
+            os.rename(source, destination)
+
+        with mock.patch('file_store.download.move_file',
+                        side_effect=assert_locked):
+            self.assertTrue(self.download.run(self.progress_report))
+        self.assertEqual(self._downloaded_data(), self.server.body)
+
+    def test_download_without_range_support(self):
+        self.server.accept_ranges = False
+        self.assertFalse(self.download.run(self.progress_report))
+        self.assertFalse(os.path.exists(self.download.path))
+        self.assertFalse(os.path.exists(self.destination))
+        self.assertFalse(self.progress_report.called)
+
+    def test_download_of_url_downloaded_by_other_process(self):
+        other_download = self._file_download()
+        with mock.patch('fcntl.flock', side_effect=BlockingIOError):
+            self.assertFalse(other_download.run(self.progress_report))
+        self.assertEqual(self.server.ranges, [])
+
+    def _interrupt_download(self):
+        """Leaves the file and the state of a download interrupted after
+        the parts 0 and 2
+        """
+        os.makedirs(os.path.dirname(self.download.path))
+        with open(self.download.path, 'wb') as partial_file:
+            partial_file.write(self.server.body[:1000])
+            partial_file.write(b'\0' * 1000)
+            partial_file.write(self.server.body[2000:3000])
+            partial_file.truncate(len(self.server.body))
+        save_state(self.download.state_path, {
+            'url': self.url, 'size': len(self.server.body),
+            'validator': self.server.etag, 'part_size': 1000,
+            'parts': {'0': None, '2': None}
+        })
+
+    def test_resume_download(self):
+        self._interrupt_download()
+        self.assertTrue(self.download.run(self.progress_report))
+        self.assertEqual(self._downloaded_data(), self.server.body)
+        self.assertEqual(len(self.server.ranges), 9)
+        self.assertNotIn((0, 999), self.server.ranges)
+        self.assertNotIn((2000, 2999), self.server.ranges)
+        self.assertEqual(self._reported_bytes(), len(self.server.body))
+
+    def test_restart_download_of_changed_file(self):
+        self._interrupt_download()
+        self.server.etag = '"v2"'
+        self.assertTrue(self.download.run(self.progress_report))
+        self.assertEqual(self._downloaded_data(), self.server.body)
+        self.assertEqual(len(self.server.ranges), 11)
+
+    def test_failed_download_can_be_resumed(self):
+        with mock.patch.object(FileDownload, 'write_part',
+                               side_effect=IOError('No space left')):
+            with self.assertRaises(IOError):
+                self.download.run(self.progress_report)
+        self.assertEqual(load_state(self.download.state_path)['parts'], {})
+        self.assertTrue(self._file_download().run(self.progress_report))
+        self.assertEqual(self._downloaded_data(), self.server.body)
+
+    def _age(self, *paths):
+        for path in paths:
+            os.utime(path, (time.time() - 100, time.time() - 100))
+
+    def test_remove_abandoned_download(self):
+        self._interrupt_download()
+        self._age(self.download.path, self.download.state_path)
+        self.assertEqual(remove_abandoned_downloads(max_age=50), 1)
+        for path in [self.download.path, self.download.state_path,
+                     self.download.state_path + '.lock']:
+            self.assertFalse(os.path.exists(path))
+
+    def test_recent_download_is_not_removed(self):
+        self._interrupt_download()
+        self.assertEqual(remove_abandoned_downloads(max_age=50), 0)
+        self.assertTrue(os.path.exists(self.download.path))
+
+    def test_running_download_is_not_removed(self):
+        self._interrupt_download()
+        self._age(self.download.path, self.download.state_path)
+        lock_file = lock(self.download.state_path + '.lock')
+        try:
+            self.assertEqual(remove_abandoned_downloads(max_age=50), 0)
+        finally:
+            lock_file.close()
+        self.assertTrue(os.path.exists(self.download.path))
+
+
+@mock.patch('file_store.download.S3Download.min_part_size', 1)
+@mock.patch('file_store.download.get_s3_client')
+class S3DownloadTest(DownloadTestBase):
+    def _s3_download(self):
+        return S3Download(self.url, 'bucket', 'key', concurrency=3,
+                          part_size=1000, timeout=5, retries=0)
+
+    def setUp(self):
+        super(S3DownloadTest, self).setUp()
+        self.state_path = get_state_path(self.url, 'bucket')
+
+    def tearDown(self):
+        for suffix in ['', '.lock']:
+            path = self.state_path + suffix
+            if os.path.exists(path):
+                os.remove(path)
+        super(S3DownloadTest, self).tearDown()
+
+    def test_download_into_multipart_upload(self, get_s3_client_mock):
+        s3 = get_s3_client_mock.return_value
+        s3.create_multipart_upload.return_value = {'UploadId': 'upload'}
+        s3.upload_part.side_effect = lambda **kwargs: {
+            'ETag': 'etag{}'.format(kwargs['PartNumber'])
+        }
+        download = self._s3_download()
+        self.assertTrue(download.run(self.progress_report))
+        bodies = {call[1]['PartNumber']: call[1]['Body']
+                  for call in s3.upload_part.call_args_list}
+        self.assertEqual(
+            b''.join(bodies[number] for number in sorted(bodies)),
+            self.server.body
+        )
+        s3.complete_multipart_upload.assert_called_once_with(
+            Bucket='bucket', Key='key', UploadId='upload',
+            MultipartUpload={'Parts': [
+                {'PartNumber': number, 'ETag': 'etag{}'.format(number)}
+                for number in range(1, 12)
+            ]}
+        )
+        self.assertEqual(self._reported_bytes(), len(self.server.body))
+
+    def test_remove_abandoned_upload(self, get_s3_client_mock):
+        save_state(self.state_path, {
+            'url': self.url, 'size': len(self.server.body),
+            'validator': self.server.etag, 'part_size': 1000, 'parts': {},
+            'bucket': 'bucket', 'key': 'key', 'upload_id': 'upload'
+        })
+        os.utime(self.state_path, (time.time() - 100, time.time() - 100))
+        self.assertEqual(remove_abandoned_downloads(max_age=50), 1)
+        get_s3_client_mock.return_value.abort_multipart_upload.\
+            assert_called_once_with(Bucket='bucket', Key='key',
+                                    UploadId='upload')
+        self.assertFalse(os.path.exists(self.state_path))
+
+    def test_resume_multipart_upload(self, get_s3_client_mock):
+        s3 = get_s3_client_mock.return_value
+        s3.upload_part.return_value = {'ETag': 'etag'}
+        download = self._s3_download()
+        save_state(self.state_path, {
+            'url': self.url, 'size': len(self.server.body),
+            'validator': self.server.etag, 'part_size': 1000,
+            'parts': {str(index): 'etag' for index in range(10)},
+            'key': 'interrupted-key', 'upload_id': 'upload'
+        })
+        self.assertTrue(download.run(self.progress_report))
+        self.assertEqual(download.key, 'interrupted-key')
+        self.assertFalse(s3.create_multipart_upload.called)
+        self.assertEqual(self.server.ranges, [(10000, 10009)])
+        self.assertEqual(s3.upload_part.call_args[1]['PartNumber'], 11)
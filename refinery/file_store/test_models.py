@@ -1,3 +1,4 @@
+import hashlib
 import os
 from urllib.parse import urljoin
 import uuid
@@ -184,6 +185,29 @@ class FileStoreItemLocalFileTest(TestCase):
             file_store_item_to_transfer_data_file_to.datafile.name
         )
 
+    def test_update_checksums(self):
+        data = b'test data'
+        self.item.datafile.save(self.file_name, ContentFile(data))
+        self.assertTrue(self.item.update_checksums())
+        saved_item = FileStoreItem.objects.get(pk=self.item.pk)
+        self.assertEqual(saved_item.md5, hashlib.md5(data).hexdigest())
+        self.assertEqual(saved_item.sha256, hashlib.sha256(data).hexdigest())
+
+    def test_update_checksums_without_datafile(self):
+        self.item.save()
+        self.assertFalse(self.item.update_checksums())
+        self.assertEqual(self.item.md5, '')
+
+    def test_transfer_data_file_with_checksums(self):
+        self.item.md5 = 'md5'
+        self.item.sha256 = 'sha256'
+        self.item.datafile.save(self.file_name, ContentFile(''))
+        target_item = FileStoreItem()
+        self.item.transfer_data_file(target_item)
+        self.assertEqual((self.item.md5, self.item.sha256), ('', ''))
+        self.assertEqual((target_item.md5, target_item.sha256),
+                         ('md5', 'sha256'))
+
 
 @override_settings(REFINERY_DATA_IMPORT_DIR='/import/path',
                    REFINERY_DEPLOYMENT_PLATFORM='vagrant',
@@ -1,31 +1,144 @@
-import uuid
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
 
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, override_settings
 
 import mock
 
-from .tasks import ProgressPercentage
+from .tasks import FileImportTask, ProgressPercentage
+from .utils import Checksums
 
 
 class ProgressPercentageTest(SimpleTestCase):
     def setUp(self):
         self.test_size = 1000
-        self.task_id = str(uuid.uuid4())
+        self.task = mock.Mock()
 
-    @mock.patch('file_store.tasks.get_file_size')
-    def test_set_file_size(self, get_file_size_mock):
-        get_file_size_mock.return_value = self.test_size
-        progress_monitor = ProgressPercentage('/absolute/path', self.task_id)
+    def _progress_monitor(self, **kwargs):
+        with mock.patch('file_store.tasks.get_file_size',
+                        return_value=self.test_size):
+            return ProgressPercentage('/absolute/path', self.task, **kwargs)
+
+    def _reported_amounts(self):
+        return [call[1]['meta']['current']
+                for call in self.task.update_state.call_args_list]
+
+    def test_set_file_size(self):
+        progress_monitor = self._progress_monitor()
         self.assertEqual(progress_monitor._file_size, self.test_size)
 
-    @mock.patch('celery.Task.update_state')
-    @mock.patch('file_store.tasks.get_file_size')
-    def test_file_size_update(self, get_file_size_mock, update_state_mock):
-        get_file_size_mock.return_value = self.test_size
-        progress_monitor = ProgressPercentage('/absolute/path', self.task_id)
+    def test_file_size_update(self):
+        progress_monitor = self._progress_monitor()
         bytes_amount = 100
         progress_monitor(bytes_amount)
-        update_state_mock.assert_called_with(self.task_id, state='PROGRESS',
-                                             meta={'percent_done': '10',
-                                                   'current': bytes_amount,
-                                                   'total': self.test_size})
+        self.task.update_state.assert_called_with(
+            task_id=self.task.request.id,
+            state='PROGRESS', meta={'percent_done': '10',
+                                    'current': bytes_amount,
+                                    'total': self.test_size}
+        )
+
+    def test_update_from_transfer_thread(self):
+        # the request of the task is thread-local in Celery
+        self.task.request.id = 'import-task-id'
+        progress_monitor = self._progress_monitor()
+        self.task.request.id = None
+        thread = threading.Thread(target=progress_monitor, args=(100,))
+        thread.start()
+        thread.join()
+        self.assertEqual(
+            self.task.update_state.call_args[1]['task_id'], 'import-task-id'
+        )
+        self.assertEqual(self._reported_amounts(), [100])
+
+    @mock.patch('file_store.tasks.time.monotonic', return_value=0)
+    def test_updates_within_interval_are_coalesced(self, monotonic_mock):
+        progress_monitor = self._progress_monitor(min_interval=1, min_step=1)
+        progress_monitor(100)
+        progress_monitor(100)
+        monotonic_mock.return_value = 1
+        progress_monitor(100)
+        self.assertEqual(self._reported_amounts(), [100, 300])
+
+    @mock.patch('file_store.tasks.time.monotonic')
+    def test_updates_below_step_are_coalesced(self, monotonic_mock):
+        monotonic_mock.side_effect = range(10)
+        progress_monitor = self._progress_monitor(min_interval=1, min_step=20)
+        for _ in range(4):
+            progress_monitor(100)
+        self.assertEqual(self._reported_amounts(), [100, 300])
+
+    @mock.patch('file_store.tasks.time.monotonic', return_value=0)
+    def test_completion_is_always_reported_once(self, monotonic_mock):
+        progress_monitor = self._progress_monitor(min_interval=1, min_step=1)
+        progress_monitor(500)
+        progress_monitor(500)
+        progress_monitor(0)
+        self.assertEqual(self._reported_amounts(), [500, 1000])
+        self.assertEqual(
+            self.task.update_state.call_args[1]['meta']['percent_done'], '100'
+        )
+
+    @mock.patch('file_store.tasks.time.monotonic')
+    def test_unknown_file_size_is_reported_by_interval(self, monotonic_mock):
+        monotonic_mock.side_effect = [0, 0.5, 1]
+        self.test_size = 0
+        progress_monitor = self._progress_monitor(min_interval=1, min_step=1)
+        for _ in range(3):
+            progress_monitor(100)
+        self.assertEqual(self._reported_amounts(), [100, 300])
+
+
+class FileImportTaskChecksumsTest(SimpleTestCase):
+    def setUp(self):
+        self.file_store_dir = tempfile.mkdtemp()
+        self.data = b'test data'
+        with tempfile.NamedTemporaryFile(delete=False) as source:
+            source.write(self.data)
+        self.source_path = source.name
+        self.checksums = Checksums()
+
+    def tearDown(self):
+        shutil.rmtree(self.file_store_dir)
+        if os.path.exists(self.source_path):
+            os.remove(self.source_path)
+
+    def test_import_path_to_path_with_move_without_checksums(self):
+        with override_settings(REFINERY_FILE_STORE_ROOT=self.file_store_dir):
+            FileImportTask().import_path_to_path(self.source_path,
+                                                 checksums=self.checksums)
+        self.assertFalse(os.path.exists(self.source_path))
+        self.assertFalse(self.checksums.complete)
+
+    @mock.patch('fcntl.ioctl', side_effect=OSError(errno.EXDEV, ''))
+    @mock.patch('os.sendfile', side_effect=OSError(errno.ENOSYS, ''))
+    @mock.patch('os.copy_file_range', create=True,
+                side_effect=OSError(errno.ENOSYS, ''))
+    def test_import_path_to_path_with_copy_with_checksums(self, *mocks):
+        with override_settings(REFINERY_FILE_STORE_ROOT=self.file_store_dir,
+                               REFINERY_DATA_IMPORT_DIR='/import'):
+            with mock.patch('tempfile.gettempdir', return_value='/tmp/none'):
+                FileImportTask().import_path_to_path(
+                    self.source_path, symlink=False, checksums=self.checksums
+                )
+        self.assertTrue(self.checksums.complete)
+        self.assertEqual(self.checksums.md5,
+                         hashlib.md5(self.data).hexdigest())
+        self.assertEqual(self.checksums.sha256,
+                         hashlib.sha256(self.data).hexdigest())
+
+    @mock.patch('file_store.tasks.symlink_file')
+    def test_import_path_to_path_with_symlink_without_checksums(
+            self, symlink_file_mock):
+        with override_settings(REFINERY_FILE_STORE_ROOT=self.file_store_dir,
+                               REFINERY_DATA_IMPORT_DIR='/import'):
+            with mock.patch('tempfile.gettempdir', return_value='/tmp/none'):
+                FileImportTask().import_path_to_path(
+                    self.source_path, checksums=self.checksums
+                )
+        self.assertTrue(symlink_file_mock.called)
+        self.assertFalse(self.checksums.complete)
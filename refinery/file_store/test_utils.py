@@ -1,11 +1,18 @@
+import errno
+import hashlib
+import io
 import os
+import tempfile
 
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, override_settings
 
 import mock
 
-from .utils import (S3MediaStorage, SymlinkedFileSystemStorage, get_file_size,
-                    parse_s3_url, UNKNOWN_FILE_SIZE)
+from . import utils
+from .utils import (Checksums, S3MediaStorage, SymlinkedFileSystemStorage,
+                    copy_file, get_file_size, get_s3_client,
+                    get_transfer_config, parse_s3_url, upload_file_object,
+                    UNKNOWN_FILE_SIZE)
 
 
 class GetFileSizeTest(SimpleTestCase):
@@ -30,6 +37,164 @@ class UtilitiesTest(SimpleTestCase):
         self.assertEqual(key, 'key')
 
 
+class ChecksumsTest(SimpleTestCase):
+    def setUp(self):
+        self.data = os.urandom(1000)
+        self.checksums = Checksums()
+
+    def assert_checksums(self):
+        self.assertEqual(self.checksums.md5,
+                         hashlib.md5(self.data).hexdigest())
+        self.assertEqual(self.checksums.sha256,
+                         hashlib.sha256(self.data).hexdigest())
+
+    def test_update_from_file(self):
+        self.checksums.update_from_file(io.BytesIO(self.data))
+        self.assert_checksums()
+        self.assertTrue(self.checksums.complete)
+
+    def test_wrap(self):
+        source = self.checksums.wrap(io.BytesIO(self.data))
+        self.assertEqual(source.read(100) + source.read(), self.data)
+        self.assert_checksums()
+        self.assertFalse(self.checksums.complete)
+        self.assertFalse(hasattr(source, 'seek'))
+
+    def test_wrap_writer(self):
+        destination = io.BytesIO()
+        writer = self.checksums.wrap_writer(destination)
+        writer.write(self.data[:100])
+        writer.write(self.data[100:])
+        self.assertEqual(destination.getvalue(), self.data)
+        self.assert_checksums()
+        self.assertFalse(hasattr(writer, 'seek'))
+
+
+@mock.patch('file_store.utils.KERNEL_COPY_CHUNK_SIZE', 1024)
+class CopyFileTest(SimpleTestCase):
+    def setUp(self):
+        self.data = os.urandom(4096 + 10)
+        self.source = tempfile.NamedTemporaryFile()
+        self.source.write(self.data)
+        self.source.flush()
+        self.source.seek(0)
+        self.destination = tempfile.NamedTemporaryFile()
+        self.progress_report = mock.Mock()
+
+    def tearDown(self):
+        self.source.close()
+        self.destination.close()
+
+    def _copy_file(self, checksums=None):
+        copy_file(self.source, self.destination, self.progress_report,
+                  checksums)
+        self.destination.seek(0)
+        self.assertEqual(self.destination.read(), self.data)
+        self.assertEqual(
+            sum(call[0][0] for call in self.progress_report.call_args_list),
+            len(self.data)
+        )
+
+    @mock.patch('fcntl.ioctl', side_effect=OSError(errno.EOPNOTSUPP, ''))
+    def test_copy_file_in_kernel(self, ioctl_mock):
+        checksums = Checksums()
+        self._copy_file(checksums)
+        self.assertEqual(self.progress_report.call_count, 5)
+        self.assertFalse(checksums.complete)
+
+    @mock.patch('fcntl.ioctl', side_effect=OSError(errno.EXDEV, ''))
+    @mock.patch('os.sendfile', side_effect=OSError(errno.ENOSYS, ''))
+    @mock.patch('os.copy_file_range', create=True,
+                side_effect=OSError(errno.ENOSYS, ''))
+    def test_copy_file_fallback(self, copy_file_range_mock, sendfile_mock,
+                                ioctl_mock):
+        checksums = Checksums()
+        self._copy_file(checksums)
+        self.assertEqual(self.progress_report.call_count, 1)
+        self.assertTrue(checksums.complete)
+        self.assertEqual(checksums.md5, hashlib.md5(self.data).hexdigest())
+
+    @mock.patch('fcntl.ioctl', side_effect=OSError(errno.EXDEV, ''))
+    @mock.patch('os.copy_file_range', create=True)
+    def test_copy_file_fallback_after_partial_copy(self, copy_file_range_mock,
+                                                   ioctl_mock):
+        def copy_file_range(source_fd, destination_fd, count, offset_src,
+                            offset_dst):
+            if offset_src:
+                raise OSError(errno.EXDEV, '')
+            os.write(destination_fd, os.pread(source_fd, count, offset_src))
+            return count
+        copy_file_range_mock.side_effect = copy_file_range
+        self._copy_file()
+
+    @mock.patch('fcntl.ioctl')
+    @mock.patch('os.sendfile')
+    def test_copy_file_reflink(self, sendfile_mock, ioctl_mock):
+        copy_file(self.source, self.destination, self.progress_report)
+        ioctl_mock.assert_called_once_with(self.destination.fileno(),
+                                           mock.ANY, self.source.fileno())
+        self.progress_report.assert_called_once_with(len(self.data))
+        self.assertFalse(sendfile_mock.called)
+
+    @mock.patch('fcntl.ioctl', side_effect=OSError(errno.EACCES, ''))
+    def test_copy_file_error(self, ioctl_mock):
+        with self.assertRaises(OSError):
+            copy_file(self.source, self.destination, self.progress_report)
+
+
+@mock.patch('file_store.utils.boto3.client')
+class S3ClientTest(SimpleTestCase):
+    def setUp(self):
+        utils._s3_client = None
+
+    def tearDown(self):
+        utils._s3_client = None
+
+    @override_settings(REFINERY_S3_MAX_POOL_CONNECTIONS=20)
+    def test_get_s3_client(self, client_mock):
+        self.assertIs(get_s3_client(), get_s3_client())
+        client_mock.assert_called_once_with('s3', config=mock.ANY)
+        self.assertEqual(
+            client_mock.call_args[1]['config'].max_pool_connections, 20
+        )
+
+    def test_get_s3_client_after_fork(self, client_mock):
+        client_mock.side_effect = lambda *args, **kwargs: mock.Mock()
+        client = get_s3_client()
+        with mock.patch('os.getpid', return_value=-1):
+            self.assertIsNot(get_s3_client(), client)
+
+    @override_settings(REFINERY_S3_MULTIPART_THRESHOLD=16,
+                       REFINERY_S3_MULTIPART_CHUNKSIZE=32,
+                       REFINERY_S3_MAX_CONCURRENCY=4,
+                       REFINERY_S3_USE_THREADS=False)
+    def test_get_transfer_config(self, client_mock):
+        config = get_transfer_config(max_concurrency=2)
+        self.assertEqual(config.multipart_threshold, 16 * 1024 * 1024)
+        self.assertEqual(config.multipart_chunksize, 32 * 1024 * 1024)
+        self.assertEqual(config.max_concurrency, 2)
+        self.assertFalse(config.use_threads)
+
+    def test_upload_file_object_with_transfer_config(self, client_mock):
+        upload_file_object(mock.sentinel.source, 'bucket', 'key')
+        self.assertEqual(
+            client_mock.return_value.upload_fileobj.call_args[1][
+                'Config'
+            ].multipart_chunksize,
+            get_transfer_config().multipart_chunksize
+        )
+
+    def test_upload_file_object_with_checksums(self, client_mock):
+        data = b'test data'
+        checksums = Checksums()
+        client_mock.return_value.upload_fileobj.side_effect = \
+            lambda source, *args, **kwargs: source.read()
+        upload_file_object(io.BytesIO(data), 'bucket', 'key',
+                           checksums=checksums)
+        self.assertTrue(checksums.complete)
+        self.assertEqual(checksums.md5, hashlib.md5(data).hexdigest())
+
+
 class S3MediaStorageTest(SimpleTestCase):
 
     def setUp(self):
@@ -1,8 +1,11 @@
+import errno
+import fcntl
 import logging
 import os
 import shutil
 import stat
 import hashlib
+import threading
 from urllib.request import urlopen
 from urllib.parse import urlparse
 from django.conf import settings
@@ -12,7 +15,9 @@ from django.utils.deconstruct import deconstructible
 from django.utils.text import get_valid_filename
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 import botocore
+from botocore.config import Config
 from storages.backends.s3boto3 import S3Boto3Storage
 
 logger = logging.getLogger(__name__)
@@ -21,6 +26,57 @@ logger = logging.getLogger(__name__)
 S3_WRITE_ARGS = {'ACL': 'public-read'}
 # placeholder value for when file size is unknown
 UNKNOWN_FILE_SIZE = 0
+# ioctl request for cloning a file (reflink) from linux/fs.h
+FICLONE = 0x40049409
+# number of bytes per kernel-assisted copy call (progress is reported after
+# every call)
+KERNEL_COPY_CHUNK_SIZE = 64 * 1024 * 1024
+# errors of reflinks and kernel-assisted copies that mean the kernel or the
+# file systems don't support them
+UNSUPPORTED_COPY_ERRORS = {errno.ENOSYS, errno.EXDEV, errno.EINVAL,
+                           errno.ENOTTY, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+_s3_client = None
+_s3_client_pid = None
+_s3_client_lock = threading.Lock()
+
+
+def create_s3_client(**kwargs):
+    """Returns a new S3 client with a connection pool large enough for the
+    threads of multipart transfers
+    kwargs: passed on to boto3.client() (e.g., endpoint_url)
+    """
+    return boto3.client('s3', config=Config(
+        max_pool_connections=settings.REFINERY_S3_MAX_POOL_CONNECTIONS
+    ), **kwargs)
+
+
+def get_s3_client():
+    """Returns the S3 client of the current process (a new one is created
+    after a fork so that pooled connections are never shared by processes)
+    """
+    global _s3_client, _s3_client_pid
+    with _s3_client_lock:
+        if _s3_client is None or _s3_client_pid != os.getpid():
+            _s3_client = create_s3_client()
+            _s3_client_pid = os.getpid()
+        return _s3_client
+
+
+def get_transfer_config(**kwargs):
+    """Returns the configuration of managed (multipart) S3 transfers
+    kwargs: override the settings (in TransferConfig units)
+    """
+    options = {
+        'multipart_threshold':
+            settings.REFINERY_S3_MULTIPART_THRESHOLD * 1024 * 1024,
+        'multipart_chunksize':
+            settings.REFINERY_S3_MULTIPART_CHUNKSIZE * 1024 * 1024,
+        'max_concurrency': settings.REFINERY_S3_MAX_CONCURRENCY,
+        'use_threads': settings.REFINERY_S3_USE_THREADS,
+    }
+    options.update(kwargs)
+    return TransferConfig(**options)
 
 
 class S3MediaStorage(S3Boto3Storage):
@@ -32,7 +88,7 @@ class S3MediaStorage(S3Boto3Storage):
     def exists(self, name):
         # returns False only if no object versions or delete markers are
         # present to prevent overwrites
-        s3 = boto3.client('s3')
+        s3 = get_s3_client()
         result = s3.list_object_versions(Bucket=self.bucket_name, Prefix=name)
         return bool(result.get('Versions') or result.get('DeleteMarkers'))
 
@@ -51,6 +107,69 @@ class S3MediaStorage(S3Boto3Storage):
         return self.get_available_name(get_valid_filename(name))
 
 
+class Checksums(object):
+    """MD5 and SHA-256 digests of data streamed through read() or write() of
+    a wrapped file object or passed to update() directly
+    """
+    def __init__(self):
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+        # True once all data of a file has been added
+        self.complete = False
+
+    def update(self, data):
+        self._md5.update(data)
+        self._sha256.update(data)
+
+    def update_from_file(self, file_object):
+        """Adds the rest of the data of a file object"""
+        chunk_size = 10 * 1024 * 1024  # 10MB
+        for chunk in iter(lambda: file_object.read(chunk_size), b''):
+            self.update(chunk)
+        self.complete = True
+
+    def wrap(self, file_object):
+        """Returns a file object that adds the data read from file_object
+        (it isn't seekable so that readers process the data in order)
+        """
+        return _ChecksumReader(file_object, self)
+
+    def wrap_writer(self, file_object):
+        """Returns a file object that adds the data written to file_object
+        (it isn't seekable so that writers provide the data in order)
+        """
+        return _ChecksumWriter(file_object, self)
+
+    @property
+    def md5(self):
+        return self._md5.hexdigest()
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+
+class _ChecksumReader(object):
+    def __init__(self, file_object, checksums):
+        self._file_object = file_object
+        self._checksums = checksums
+
+    def read(self, size=-1):
+        data = self._file_object.read(size)
+        self._checksums.update(data)
+        return data
+
+
+class _ChecksumWriter(object):
+    def __init__(self, file_object, checksums):
+        self._file_object = file_object
+        self._checksums = checksums
+
+    def write(self, data):
+        self._checksums.update(data)
+        return self._file_object.write(data)
+
+
 @deconstructible
 class SymlinkedFileSystemStorage(FileSystemStorage):
     """Custom file system storage class with support for symlinked files"""
@@ -87,24 +206,90 @@ class SymlinkedFileSystemStorage(FileSystemStorage):
         return self.get_available_name(get_valid_filename(name))
 
 
-def copy_file_object(source, destination, progress_report=lambda _: None):
-    """Copy a file object and update progress"""
+def _copy_file_range(source_fd, destination_fd, offset, count):
+    return os.copy_file_range(source_fd, destination_fd, count,
+                              offset, offset)
+
+
+def _sendfile(source_fd, destination_fd, offset, count):
+    # sendfile() writes at the current position of the destination
+    os.lseek(destination_fd, offset, os.SEEK_SET)
+    return os.sendfile(destination_fd, source_fd, offset, count)
+
+
+def copy_file(source, destination, progress_report=lambda _: None,
+              checksums=None):
+    """Copy a regular file object into another without moving the data
+    through user space if possible: the destination becomes a reflink of the
+    source on file systems that support it (e.g., Btrfs or XFS), otherwise
+    the kernel copies the data with copy_file_range() or sendfile(). Falls
+    back to copy_file_object() for the rest of the data.
+    Checksums are only calculated if all data is copied through user space.
+    """
+    source_fd = source.fileno()
+    destination_fd = destination.fileno()
+    size = os.fstat(source_fd).st_size
+    copied = 0
+    try:
+        fcntl.ioctl(destination_fd, FICLONE, source_fd)
+    except OSError as exc:
+        if exc.errno not in UNSUPPORTED_COPY_ERRORS:
+            raise
+    else:
+        copied = size
+        progress_report(size)
+    kernel_copies = [_sendfile]
+    if hasattr(os, 'copy_file_range'):  # Python 3.8+
+        kernel_copies.insert(0, _copy_file_range)
+    for kernel_copy in kernel_copies:
+        try:
+            while copied < size:
+                count = kernel_copy(
+                    source_fd, destination_fd, copied,
+                    min(KERNEL_COPY_CHUNK_SIZE, size - copied)
+                )
+                if not count:  # end of file
+                    break
+                copied += count
+                progress_report(count)
+        except OSError as exc:
+            if exc.errno not in UNSUPPORTED_COPY_ERRORS:
+                raise
+            logger.debug("%s() not supported: %s", kernel_copy.__name__[1:],
+                         exc)
+        else:
+            break
+    source.seek(copied)
+    destination.seek(copied)
+    copy_file_object(source, destination, progress_report,
+                     checksums if not copied else None)
+
+
+def copy_file_object(source, destination, progress_report=lambda _: None,
+                     checksums=None):
+    """Copy a file object, update progress and optionally checksums"""
     chunk_size = 10 * 1024 * 1024  # 10MB
     for chunk in iter(lambda: source.read(chunk_size), b''):
         destination.write(chunk)
+        if checksums is not None:
+            checksums.update(chunk)
         progress_report(len(chunk))
     # ensure that all internal buffers are written to disk
     destination.flush()
     os.fsync(destination.fileno())
+    if checksums is not None:
+        checksums.complete = True
 
 
 def copy_s3_object(source_bucket, source_key, destination_bucket,
                    destination_key, progress_report=lambda _: None):
     """Copy S3 object and update task progress"""
-    s3 = boto3.client('s3')
-    s3.copy(CopySource={'Bucket': source_bucket, 'Key': source_key},
-            Bucket=destination_bucket, Key=destination_key,
-            ExtraArgs=S3_WRITE_ARGS, Callback=progress_report)
+    get_s3_client().copy(
+        CopySource={'Bucket': source_bucket, 'Key': source_key},
+        Bucket=destination_bucket, Key=destination_key,
+        ExtraArgs=S3_WRITE_ARGS, Callback=progress_report,
+        Config=get_transfer_config()
+    )
 
 
 def delete_file(absolute_path):
@@ -118,7 +303,7 @@ def delete_file(absolute_path):
 
 
 def delete_s3_object(bucket, key):
-    s3 = boto3.client('s3')
+    s3 = get_s3_client()
     logger.debug("Deleting 's3://%s/%s'",  bucket, key)
     try:
         s3.delete_object(Bucket=bucket, Key=key)
@@ -130,13 +315,23 @@ def delete_s3_object(bucket, key):
 
 
 def download_s3_object(bucket, key, download_object,
-                       progress_report=lambda _: None):
-    """Download object from S3 to a temp file and update task progress"""
-    s3 = boto3.client('s3')
-    s3.download_fileobj(bucket, key, download_object, Callback=progress_report)
+                       progress_report=lambda _: None, checksums=None):
+    """Download object from S3 to a temp file and update task progress and
+    optionally checksums
+    """
+    if checksums is None:
+        target = download_object
+    else:
+        # parts are written in order to a non-seekable target
+        target = checksums.wrap_writer(download_object)
+    get_s3_client().download_fileobj(bucket, key, target,
+                                     Callback=progress_report,
+                                     Config=get_transfer_config())
     # ensure that all internal buffers are written to disk
     download_object.flush()
     os.fsync(download_object.fileno())
+    if checksums is not None:
+        checksums.complete = True
 
 
 def get_file_size(file_location):
@@ -147,7 +342,7 @@ def get_file_size(file_location):
         except EnvironmentError:
             return UNKNOWN_FILE_SIZE
     elif file_location.startswith('s3://'):
-        s3 = boto3.client('s3')
+        s3 = get_s3_client()
         bucket, key = parse_s3_url(file_location)
         try:
             return s3.head_object(Bucket=bucket, Key=key)['ContentLength']
@@ -217,8 +412,17 @@ def symlink_file(source_path, link_path):
     logger.info("Created symlink '%s' to '%s'", link_path, source_path)
 
 
-def upload_file_object(source, bucket, key, progress_report=lambda _: None):
-    """Upload file-like object to S3 and report progress"""
-    s3 = boto3.client('s3')
-    s3.upload_fileobj(source, bucket, key, ExtraArgs=S3_WRITE_ARGS,
-                      Callback=progress_report)
+def upload_file_object(source, bucket, key, progress_report=lambda _: None,
+                       checksums=None):
+    """Upload file-like object to S3, report progress and optionally update
+    checksums
+    """
+    if checksums is not None:
+        # a non-seekable source is read in order
+        source = checksums.wrap(source)
+    get_s3_client().upload_fileobj(source, bucket, key,
+                                   ExtraArgs=S3_WRITE_ARGS,
+                                   Callback=progress_report,
+                                   Config=get_transfer_config())
+    if checksums is not None:
+        checksums.complete = True
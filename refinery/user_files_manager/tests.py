@@ -1,3 +1,4 @@
+import gzip
 import json
 import logging
 from urllib.parse import urljoin
@@ -17,11 +18,13 @@ from rest_framework.authtoken.models import Token
 from rest_framework.test import (APIRequestFactory, APITestCase,
                                  force_authenticate)
 
+from core.models import ExtendedGroup
 from data_set_manager.models import Assay
 from data_set_manager.search_indexes import NodeIndex
 from factory_boy.utils import create_dataset_with_necessary_models
 
-from .utils import generate_solr_params_for_user
+from .utils import (generate_solr_params_for_user,
+                    get_accessible_assay_uuids)
 from .views import UserFileAPIView, user_files_csv
 
 logger = logging.getLogger(__name__)
@@ -47,7 +50,6 @@ class UserFileAPITests(APITestCase):
         ])
 
     def _test_user_files_csv(self, assay_uuid=False, use_token_auth=False):
-        solr_mock_reference = 'search_solr' if assay_uuid else '_get_solr'
         get_data = {"assay_uuid": uuid.uuid4()} if assay_uuid else {}
 
         request = self.factory.get(
@@ -75,13 +77,16 @@ class UserFileAPITests(APITestCase):
         }
         response_dict = {"response": {"docs": [mock_doc]}}
         with mock.patch(
-                'user_files_manager.views.' + solr_mock_reference,
+                'user_files_manager.views.search_solr',
                 return_value=bytes(json.dumps(response_dict),
                                    encoding='utf-8')
+        ), mock.patch(
+                'user_files_manager.views.generate_solr_params_for_user',
+                return_value={'json': {}, 'params': {}}
         ):
             response = user_files_csv(request)
             self.assertEqual(
-                response.content,
+                b''.join(response.streaming_content),
                 b'url,filename,fake\r\nfake-url,fake-filename,\r\n'
             )
 
@@ -105,6 +110,57 @@ class UserFileAPITests(APITestCase):
     def test_get_user_files_csv_with_assay_uuid(self):
         self._test_user_files_csv(assay_uuid=True)
 
+    def _get_solr_page(self, names, cursor, next_cursor):
+        return bytes(json.dumps({
+            "responseHeader": {"params": {"cursorMark": cursor}},
+            "response": {"docs": [{"name": name} for name in names]},
+            "nextCursorMark": next_cursor
+        }), encoding='utf-8')
+
+    @override_settings(USER_FILES_COLUMNS='name')
+    def test_get_user_files_csv_pages_with_cursor(self):
+        request = self.factory.get("/files_download?limit=100000000")
+        force_authenticate(request, user=User.objects.create_user(
+            'testuser', 'test@example.com', 'password'
+        ))
+        pages = [self._get_solr_page(['a', 'b'], '*', 'AoE1'),
+                 self._get_solr_page(['c'], 'AoE1', 'AoE2'),
+                 self._get_solr_page([], 'AoE2', 'AoE2')]
+        solr_params = {'json': {'facet': {}},
+                       'params': {'cursorMark': '*'}}
+        with mock.patch('user_files_manager.views.search_solr',
+                        side_effect=pages) as search_solr_mock, \
+                mock.patch(
+                    'user_files_manager.views.generate_solr_params_for_user',
+                    return_value=solr_params
+                ) as generate_mock:
+            response = user_files_csv(request)
+            content = b''.join(response.streaming_content)
+        self.assertEqual(content, b'url,name\r\n,a\r\n,b\r\n,c\r\n')
+        self.assertEqual(search_solr_mock.call_count, 3)
+        self.assertNotIn('facet', solr_params['json'])
+        params = generate_mock.call_args[0][0]
+        self.assertEqual(params['cursor'], '')
+        self.assertNotEqual(params['limit'], '100000000')
+
+    @override_settings(USER_FILES_COLUMNS='name')
+    def test_get_user_files_csv_with_gzip(self):
+        request = self.factory.get("/files_download",
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        force_authenticate(request, user=User.objects.create_user(
+            'testuser', 'test@example.com', 'password'
+        ))
+        with mock.patch(
+                'user_files_manager.views.generate_solr_params_for_user',
+                return_value=None
+        ):
+            response = user_files_csv(request)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)),
+            b'url,name\r\n'
+        )
+
 
 class UserFilesUITests(StaticLiveServerTestCase):
     def setUp(self):
@@ -138,7 +194,7 @@ class UserFilesUITests(StaticLiveServerTestCase):
         force_authenticate(request, user=user, token=user.auth_token)
         response = self.view(request)
         self.assertEqual(
-            response.content,
+            b''.join(response.streaming_content),
             b'url,name,fake\r\n'
         )
 
@@ -203,10 +259,36 @@ class UserFilesUtilsTests(TestCase):
                              )
 
     def test_generate_solr_params_for_user_returns_json_filter(self):
+        query = generate_solr_params_for_user(QueryDict({}), self.user.id)
+        self.assertListEqual(
+            query.get('json').get('filter'),
+            ['access:({})'.format(' OR '.join(
+                ['u_{}'.format(self.user.id)] +
+                ['g_{}'.format(group.id)
+                 for group in self.user.groups.order_by('id')]
+            ))]
+        )
+
+    def test_generate_solr_params_for_superuser_returns_json_filter(self):
+        self.user.is_superuser = True
+        self.user.save()
         query = generate_solr_params_for_user(QueryDict({}), self.user.id)
         self.assertListEqual(query.get('json').get('filter'),
-                             ['assay_uuid:({})'.format(self.assay_uuid)]
-                             )
+                             ['assay_uuid:({})'.format(self.assay_uuid)])
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }})
+    def test_get_accessible_assay_uuids_is_cached_until_shared(self):
+        other_user = User.objects.create_user('otheruser', '', 'password')
+        self.assertEqual(get_accessible_assay_uuids(other_user), [])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_accessible_assay_uuids(other_user), [])
+        group = ExtendedGroup.objects.create(name='share group')
+        group.user_set.add(other_user)
+        self.dataset.share(group)
+        self.assertEqual(get_accessible_assay_uuids(other_user),
+                         [self.assay_uuid])
 
     def test_generate_solr_params_for_user_returns_json_query(self):
         query = generate_solr_params_for_user(QueryDict({}), self.user.id)
@@ -1,10 +1,12 @@
+from django.core.cache import cache
 from django.http import Http404
 
 from guardian.compat import get_user_model
 from guardian.shortcuts import get_objects_for_user
 
+from core.models import InvestigationLink, get_data_set_access_generation
 from core.utils import accept_global_perms
-from data_set_manager.models import Assay, Study
+from data_set_manager.models import Assay
 from data_set_manager.utils import generate_solr_params
 
 User = get_user_model()
@@ -24,6 +26,7 @@ def generate_solr_params_for_user(params, user_id):
         facet_filter - adds params to facet fields&fqs for filtering on fields
         facet_pivot - list of fields to pivot
         sort - Ordering include field name, whitespace, & asc or desc.
+        cursor - deep paging with a Solr cursor instead of offset
         fq - filter query
      """
     try:
@@ -34,28 +37,49 @@ def generate_solr_params_for_user(params, user_id):
         except User.DoesNotExist:
             raise Http404
 
-    # will update to allow users to view read_meta datasets then we can
-    # update to use get_resources_for_user method in core/utils
-    datasets = get_objects_for_user(user, 'core.read_dataset',
-                                    accept_global_perms=accept_global_perms(
-                                        'dataset'
-                                    ))
-    assay_uuids = []
-    for dataset in datasets:
-        investigation_link = dataset.get_latest_investigation_link()
-        if investigation_link is None:
-            continue
-            # It's not an error not to have data,
-            # but there's nothing more to do here.
-        investigation = investigation_link.investigation
-
-        study_ids = Study.objects.filter(
-            investigation=investigation
-        ).values_list('id', flat=True)
-
-        assay_uuids += Assay.objects.filter(
-            study_id__in=study_ids
-        ).values_list('uuid', flat=True)
-
+    assay_uuids = get_accessible_assay_uuids(user)
+    # node documents of the latest versions of readable data sets are
+    # tagged with the users and groups that can read them
+    access = None if user.is_superuser else get_access_tokens(user)
     return generate_solr_params(params, assay_uuids=assay_uuids,
-                                facets_from_config=True)
+                                facets_from_config=True, access=access)
+
+
+def get_accessible_assay_uuids(user):
+    """Returns the UUIDs of the assays of the latest versions of all data
+    sets the user can read. Cached until data set permissions, versions or
+    group memberships change.
+    """
+    cache_key = 'accessible-assays-{}-{}'.format(
+        user.id, get_data_set_access_generation()
+    )
+    assay_uuids = cache.get(cache_key)
+    if assay_uuids is None:
+        # will update to allow users to view read_meta datasets then we can
+        # update to use get_resources_for_user method in core/utils
+        datasets = get_objects_for_user(
+            user, 'core.read_dataset',
+            accept_global_perms=accept_global_perms('dataset')
+        )
+        # like DataSet.get_latest_investigation_link(): the latest link wins
+        latest_investigation_ids = dict(
+            InvestigationLink.objects.filter(
+                data_set__in=datasets
+            ).order_by('date').values_list('data_set_id', 'investigation_id')
+        ).values()
+        assay_uuids = list(Assay.objects.filter(
+            study__investigation_id__in=latest_investigation_ids
+        ).values_list('uuid', flat=True))
+        cache.set(cache_key, assay_uuids)
+    return assay_uuids
+
+
+def get_access_tokens(user):
+    """Returns the values of the Solr access field of documents the user can
+    read: the user ('u_<id>') and all of its groups ('g_<id>')
+    """
+    return ['u_{}'.format(user.id)] + [
+        'g_{}'.format(group_id)
+        for group_id in user.groups.order_by('id').values_list('id',
+                                                               flat=True)
+    ]
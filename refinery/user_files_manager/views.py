@@ -3,9 +3,10 @@ from json import dumps, loads
 import logging
 
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import render_to_response
 from django.template import RequestContext
+from django.views.decorators.gzip import gzip_page
 from rest_framework.authentication import (SessionAuthentication,
                                            TokenAuthentication)
 
@@ -17,6 +18,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from unidecode import unidecode
 
+import constants
 from data_set_manager.search_indexes import NodeIndex
 from data_set_manager.utils import (format_solr_response,
                                     generate_solr_params_for_assay,
@@ -33,27 +35,39 @@ def user_files(request):
                               context_instance=RequestContext(request))
 
 
-@api_view(['GET'])
-@authentication_classes((SessionAuthentication, TokenAuthentication,))
-@permission_classes((IsAuthenticated,))
-def user_files_csv(request):
-    assay_uuid = request.GET.get("assay_uuid")
-    if assay_uuid is not None:
-        solr_params = generate_solr_params_for_assay(request.GET, assay_uuid)
-        solr_response = search_solr(solr_params, 'data_set_manager')
-    else:
-        solr_response = _get_solr(request.GET, request.user.id)
+class _Echo(object):
+    """File-like object that returns the written value, so that csv.writer()
+    can format rows for a streaming response
+    """
+    def write(self, value):
+        return value
 
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="user-files.csv"'
 
+def _iter_solr_docs(solr_params):
+    """Yields all documents matching solr_params one page at a time using a
+    Solr cursor, so that only one page is held in memory
+    """
+    if solr_params is None:
+        return
+    while True:
+        solr_response = loads(
+            search_solr(solr_params, 'data_set_manager').decode()
+        )
+        docs = solr_response['response']['docs']
+        for doc in docs:
+            yield doc
+        next_cursor = solr_response.get('nextCursorMark')
+        if (not docs or next_cursor is None or
+                next_cursor == solr_params['params']['cursorMark']):
+            break
+        solr_params['params']['cursorMark'] = next_cursor
+
+
+def _iter_user_files_csv_rows(docs):
     cols = settings.USER_FILES_COLUMNS.split(',')
-
-    writer = csv.writer(response)
-    writer.writerow(['url'] + cols)
+    writer = csv.writer(_Echo())
     # DOWNLOAD_URL's internal solr name not good for end-user.
-
-    docs = loads(solr_response.decode())['response']['docs']
+    yield writer.writerow(['url'] + cols)
     for doc in docs:
         row = [doc.get(NodeIndex.DOWNLOAD_URL) or '']
         for col in cols:
@@ -64,23 +78,53 @@ def user_files_csv(request):
                 ''
             )
             row.append(unidecode(possibly_unicode))
-        writer.writerow(row)
+        yield writer.writerow(row)
+
 
+@gzip_page
+@api_view(['GET'])
+@authentication_classes((SessionAuthentication, TokenAuthentication,))
+@permission_classes((IsAuthenticated,))
+def user_files_csv(request):
+    """Streams all files matching the query as CSV (gzip-compressed if the
+    client accepts it) without a limit on the number of rows
+    """
+    params = request.GET.copy()
+    # the limit is the page size of the cursor
+    params['limit'] = str(constants.REFINERY_SOLR_DOC_LIMIT)
+    params['cursor'] = ''
+    assay_uuid = params.get("assay_uuid")
+    if assay_uuid is not None:
+        solr_params = generate_solr_params_for_assay(params, assay_uuid)
+    else:
+        solr_params = generate_solr_params_for_user(params, request.user.id)
+    if solr_params is not None:
+        # facet counts are not exported
+        solr_params['json'].pop('facet', None)
+
+    response = StreamingHttpResponse(
+        _iter_user_files_csv_rows(_iter_solr_docs(solr_params)),
+        content_type='text/csv'
+    )
+    response['Content-Disposition'] = 'attachment; filename="user-files.csv"'
     return response
 
 
 class UserFileAPIView(APIView):
     def get(self, request):
-        solr_response = _get_solr(request.query_params, request.user.id)
-        solr_response_json = format_solr_response(solr_response)
+        solr_params = generate_solr_params_for_user(
+            request.query_params,
+            user_id=request.user.id)
+        solr_response = _get_solr(solr_params)
+        solr_response_json = format_solr_response(
+            solr_response,
+            fields=solr_params and solr_params['json'].get('fields')
+        )
 
         return Response(solr_response_json)
 
 
-def _get_solr(params, user_id):
-    solr_params = generate_solr_params_for_user(
-        params,
-        user_id=user_id)
+def _get_solr(solr_params):
     if solr_params is None:
         return bytes(dumps({
             'responseHeader': {},